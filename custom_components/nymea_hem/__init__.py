@@ -2,30 +2,59 @@
 
 from __future__ import annotations
 
-import asyncio
 import logging
 from datetime import timedelta
-from typing import Any
 
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import ConfigEntryNotReady
 from homeassistant.helpers import config_validation as cv
-from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 from .const import (
+    CONF_BACKFILL,
+    CONF_BUFFER_RETENTION,
+    CONF_BUFFER_STATES,
+    CONF_GRID_METER,
+    CONF_LOCAL_STATISTICS,
+    CONF_CONNECTION_TIMEOUT,
     CONF_HOST,
+    CONF_MAX_REQUEST_RATE,
     CONF_PASSWORD,
     CONF_POLL_INTERVAL,
     CONF_PORT,
+    CONF_READ_TIMEOUT,
+    CONF_SLOW_TIER_INTERVAL,
+    CONF_SLOW_TIER_STATES,
     CONF_SSL,
+    CONF_TOKEN,
+    CONF_TRANSPORT,
     CONF_USERNAME,
+    DEFAULT_BACKFILL,
+    DEFAULT_CONNECTION_TIMEOUT,
+    DEFAULT_LOCAL_STATISTICS,
     DEFAULT_POLL_INTERVAL,
     DEFAULT_PORT,
+    DEFAULT_READ_TIMEOUT,
+    DEFAULT_SLOW_TIER_INTERVAL,
     DEFAULT_SSL,
+    DATA_FLEET,
     DOMAIN,
 )
-from .nymea_client import NymeaClient
+from .backfill import NymeaBackfill, async_remove_store as async_remove_backfill_store
+from .capture import create_client
+from .coordinator import NymeaUpdateCoordinator
+from .filters import ThingFilter
+from .fleet import NymeaFleet
+from .governor import DEFAULT_REQUEST_RATE
+from .handoff import claim_client
+from .local_statistics import LocalStatistics
+from .metrics import StartupTrace
+from .ring_buffer import DEFAULT_BUFFER_RETENTION, StateBuffers
+from .snapshot import NymeaSnapshotStore
+from .transport import DEFAULT_TRANSPORT
+from .services import async_setup_services
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -33,16 +62,12 @@ PLATFORMS: list[Platform] = [Platform.SENSOR]
 
 CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
 
-# Retry configuration constants
-DEFAULT_RETRY_ATTEMPTS = 3
-DEFAULT_RETRY_DELAY = 5  # seconds
-MAX_RETRY_DELAY = 300  # 5 minutes max
-RETRY_MULTIPLIER = 2  # exponential backoff
-
 
 async def async_setup(hass: HomeAssistant, config: dict) -> bool:
     """Set up the Nymea HEM component."""
     hass.data.setdefault(DOMAIN, {})
+    hass.data[DOMAIN][DATA_FLEET] = NymeaFleet(hass)
+    await async_setup_services(hass)
     return True
 
 
@@ -52,140 +77,220 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         _LOGGER.error("Invalid configuration. Missing required parameters.")
         return False
 
-    nymea_client = NymeaClient(
+    # Reuse the connection validated by the config flow, if it is still open
+    nymea_client = claim_client(hass, entry.unique_id) or create_client(
+        hass.config.config_dir,
         host=entry.data[CONF_HOST],
         port=entry.data.get(CONF_PORT, DEFAULT_PORT),
         username=entry.data[CONF_USERNAME],
         password=entry.data[CONF_PASSWORD],
         ssl_enabled=entry.data.get(CONF_SSL, DEFAULT_SSL),
+        token=entry.data.get(CONF_TOKEN),
+        transport=entry.data.get(CONF_TRANSPORT, DEFAULT_TRANSPORT),
+        session=async_get_clientsession(hass),
     )
 
-    coordinator: DataUpdateCoordinator | None = None
-    
-    try:
-        await nymea_client.authenticate()
-        _LOGGER.info("Nymea client authenticated successfully")
-
-        # Track failed update attempts for smart retry logic
-        class NymeaUpdateCoordinator(DataUpdateCoordinator):
-            """Custom coordinator with retry logic."""
-            
-            def __init__(self, *args, **kwargs):
-                super().__init__(*args, **kwargs)
-                self.last_error: Exception | None = None
-                self.consecutive_failures = 0
-                self.max_consecutive_failures = DEFAULT_RETRY_ATTEMPTS
-                
-            async def _async_update_data(self) -> Any:
-                """Fetch data with improved error handling and retry logic."""
-                try:
-                    # Ensure connection is still alive before attempting update
-                    if not nymea_client.is_connected():
-                        _LOGGER.debug("Connection lost, attempting to re-authenticate")
-                        await nymea_client.authenticate()
-                    
-                    data = await nymea_client.get_things()
-                    
-                    # Reset failure counter on success
-                    if self.consecutive_failures > 0:
-                        _LOGGER.info(
-                            "Connection recovered after %d consecutive failures",
-                            self.consecutive_failures
-                        )
-                        self.consecutive_failures = 0
-                    
-                    self.last_error = None
-                    return data
-                    
-                except asyncio.TimeoutError as err:
-                    self.consecutive_failures += 1
-                    error_msg = f"Connection timeout (attempt {self.consecutive_failures}/{self.max_consecutive_failures})"
-                    _LOGGER.warning(error_msg)
-                    self.last_error = err
-                    
-                    # If we haven't exceeded max attempts, raise UpdateFailed to trigger retry
-                    if self.consecutive_failures < self.max_consecutive_failures:
-                        raise UpdateFailed(error_msg) from err
-                    else:
-                        # After max attempts, log severity and still raise but with different message
-                        raise UpdateFailed(
-                            f"Failed to connect after {self.max_consecutive_failures} attempts: {err}"
-                        ) from err
-                        
-                except ConnectionError as err:
-                    self.consecutive_failures += 1
-                    error_msg = f"Connection lost (attempt {self.consecutive_failures}/{self.max_consecutive_failures}): {err}"
-                    _LOGGER.warning(error_msg)
-                    self.last_error = err
-                    
-                    if self.consecutive_failures < self.max_consecutive_failures:
-                        raise UpdateFailed(error_msg) from err
-                    else:
-                        raise UpdateFailed(
-                            f"Connection permanently lost after {self.max_consecutive_failures} attempts"
-                        ) from err
-                        
-                except Exception as err:
-                    self.consecutive_failures += 1
-                    error_msg = f"Unexpected error updating Nymea data (attempt {self.consecutive_failures}/{self.max_consecutive_failures})"
-                    _LOGGER.error(
-                        "%s: %s",
-                        error_msg,
-                        err,
-                        exc_info=True
-                    )
-                    self.last_error = err
-                    raise UpdateFailed(error_msg) from err
-
-        async def async_update_data():
-            """Fetch updated data from Nymea."""
-            return await coordinator._async_update_data()
-
-        # Configure update interval from config or use default
-        poll_interval_seconds = entry.data.get(CONF_POLL_INTERVAL, DEFAULT_POLL_INTERVAL)
-        update_interval = timedelta(seconds=poll_interval_seconds)
-        
-        _LOGGER.debug(
-            "Creating DataUpdateCoordinator with poll interval: %d seconds",
-            poll_interval_seconds
-        )
+    # The timeline starts here; a client handed over by the config flow is connected already
+    nymea_client.metrics.startup = StartupTrace()
 
-        coordinator = NymeaUpdateCoordinator(
-            hass,
-            _LOGGER,
-            name=f"{DOMAIN}_{entry.entry_id}",
-            update_method=async_update_data,
-            update_interval=update_interval,
-        )
+    nymea_client.set_timeouts(
+        _entry_setting(entry, CONF_CONNECTION_TIMEOUT, DEFAULT_CONNECTION_TIMEOUT),
+        _entry_setting(entry, CONF_READ_TIMEOUT, DEFAULT_READ_TIMEOUT),
+    )
+    nymea_client.set_request_rate(
+        _entry_setting(entry, CONF_MAX_REQUEST_RATE, DEFAULT_REQUEST_RATE)
+    )
 
-        # Do the first refresh
-        await coordinator.async_config_entry_first_refresh()
-        _LOGGER.info("Nymea HEM integration initialized successfully")
+    # Configure update interval from options, config or use default
+    poll_interval_seconds = _entry_setting(entry, CONF_POLL_INTERVAL, DEFAULT_POLL_INTERVAL)
+    update_interval = timedelta(seconds=poll_interval_seconds)
 
-    except Exception as err:
-        _LOGGER.error("Failed to set up Nymea client: %s", err, exc_info=True)
-        await nymea_client.close_connection()
-        return False
+    _LOGGER.debug(
+        "Creating DataUpdateCoordinator with poll interval: %d seconds",
+        poll_interval_seconds
+    )
+
+    snapshot = NymeaSnapshotStore(hass, entry.entry_id)
+    coordinator = NymeaUpdateCoordinator(
+        hass,
+        nymea_client,
+        name=f"{DOMAIN}_{entry.entry_id}",
+        update_interval=update_interval,
+        snapshot=snapshot,
+        slow_tier_interval=_entry_setting(
+            entry, CONF_SLOW_TIER_INTERVAL, DEFAULT_SLOW_TIER_INTERVAL
+        ),
+        thing_filter=ThingFilter(entry.options),
+        slow_tier_states=_entry_setting(entry, CONF_SLOW_TIER_STATES, ""),
+    )
+    coordinator.energy_flow.grid_meter = _entry_setting(entry, CONF_GRID_METER, "") or None
+    server_info = nymea_client.server_info
+
+    backfill = NymeaBackfill(
+        hass,
+        entry,
+        coordinator,
+        enabled=_entry_setting(entry, CONF_BACKFILL, DEFAULT_BACKFILL),
+    )
+    await backfill.async_load()
+
+    # Changing this option reloads the entry, as it changes the sensors' state classes
+    local_statistics = _entry_setting(entry, CONF_LOCAL_STATISTICS, DEFAULT_LOCAL_STATISTICS)
+    if local_statistics and "recorder" in hass.config.components:
+        coordinator.local_statistics = LocalStatistics(hass, entry, coordinator)
+        entry.async_on_unload(coordinator.local_statistics.async_start())
+
+    # Changing the buffered states reloads the entry, as it adds or removes sensors
+    buffer_options = (
+        _entry_setting(entry, CONF_BUFFER_STATES, ""),
+        _entry_setting(entry, CONF_BUFFER_RETENTION, DEFAULT_BUFFER_RETENTION),
+    )
+    if buffer_options[0]:
+        coordinator.buffers = StateBuffers(*buffer_options)
+
+    # Share the SSL context, handshake slots and thing classes with other entries
+    fleet: NymeaFleet = hass.data[DOMAIN][DATA_FLEET]
+    if entry.data.get(CONF_SSL, DEFAULT_SSL):
+        nymea_client.set_ssl_context(await fleet.async_get_ssl_context())
+    entry.async_on_unload(fleet.async_register(entry.entry_id, coordinator))
+
+    cached = await snapshot.async_load()
+    if cached is None:
+        try:
+            await nymea_client.connect()
+            _LOGGER.info("Nymea client connected successfully")
+
+            # Do the first refresh
+            await coordinator.async_config_entry_first_refresh()
+        except Exception as err:
+            await nymea_client.close_connection()
+            raise ConfigEntryNotReady(f"Failed to set up Nymea client: {err}") from err
+        _LOGGER.info("Nymea HEM integration initialized successfully")
+        server_info = nymea_client.server_info
+        _async_update_unique_id(hass, entry, server_info.get("uuid"))
+    else:
+        # Start from the last known state; connecting happens in the background
+        coordinator.async_restore_snapshot(cached)
+        server_info = cached.get("server_info") or {}
 
     hass.data.setdefault(DOMAIN, {})
     hass.data[DOMAIN][entry.entry_id] = {
         "client": nymea_client,
         "coordinator": coordinator,
-        "server_info": getattr(
-            nymea_client,
-            "_server_info",
-            {
-                "name": "Unknown Nymea Server",
-                "version": "Unknown",
-                "uuid": f"unknown_{entry.entry_id}",
-            },
-        ),
+        "backfill": backfill,
+        "local_statistics": local_statistics,
+        "buffer_options": buffer_options,
+        "server_info": server_info
+        or {
+            "name": "Unknown Nymea Server",
+            "version": "Unknown",
+            "uuid": f"unknown_{entry.entry_id}",
+        },
     }
 
+    @callback
+    def _async_persist_token() -> None:
+        """Store a token the client obtained by re-authenticating."""
+        if nymea_client.token and nymea_client.token != entry.data.get(CONF_TOKEN):
+            hass.config_entries.async_update_entry(
+                entry, data={**entry.data, CONF_TOKEN: nymea_client.token}
+            )
+
+    entry.async_on_unload(coordinator.async_add_listener(_async_persist_token))
+    entry.async_on_unload(coordinator.async_add_listener(backfill.async_handle_refresh))
+    entry.async_on_unload(entry.add_update_listener(async_update_options))
+
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+
+    if coordinator.stale:
+        entry.async_create_background_task(
+            hass,
+            _async_connect_in_background(hass, entry, coordinator),
+            name=f"{DOMAIN}_connect_{entry.entry_id}",
+        )
     return True
 
 
+async def _async_connect_in_background(
+    hass: HomeAssistant, entry: ConfigEntry, coordinator: NymeaUpdateCoordinator
+) -> None:
+    """Replace the restored snapshot with live data once the server answers.
+
+    The refresh connects first; if the server is not reachable the
+    coordinator keeps retrying with backoff while the snapshot is served.
+    """
+    await coordinator.async_refresh()
+    if not coordinator.last_update_success:
+        _LOGGER.warning(
+            "Nymea server not reachable (%s), serving the last snapshot",
+            coordinator.last_error,
+        )
+        return
+    _LOGGER.info("Nymea HEM integration initialized successfully")
+    _async_update_unique_id(hass, entry, coordinator.client.server_info.get("uuid"))
+
+
+def _entry_setting(entry: ConfigEntry, key: str, default):
+    """Return a setting from the options, falling back to the entry data."""
+    return entry.options.get(key, entry.data.get(key, default))
+
+
+async def async_update_options(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Apply changed options to the running client and coordinator."""
+    entry_data = hass.data.get(DOMAIN, {}).get(entry.entry_id)
+    if not entry_data:
+        return
+
+    buffer_options = (
+        _entry_setting(entry, CONF_BUFFER_STATES, ""),
+        _entry_setting(entry, CONF_BUFFER_RETENTION, DEFAULT_BUFFER_RETENTION),
+    )
+    if (
+        _entry_setting(entry, CONF_LOCAL_STATISTICS, DEFAULT_LOCAL_STATISTICS)
+        != entry_data["local_statistics"]
+        or buffer_options != entry_data["buffer_options"]
+    ):
+        await hass.config_entries.async_reload(entry.entry_id)
+        return
+
+    entry_data["client"].set_timeouts(
+        _entry_setting(entry, CONF_CONNECTION_TIMEOUT, DEFAULT_CONNECTION_TIMEOUT),
+        _entry_setting(entry, CONF_READ_TIMEOUT, DEFAULT_READ_TIMEOUT),
+    )
+    entry_data["client"].set_request_rate(
+        _entry_setting(entry, CONF_MAX_REQUEST_RATE, DEFAULT_REQUEST_RATE)
+    )
+    entry_data["coordinator"].async_apply_options(
+        timedelta(seconds=_entry_setting(entry, CONF_POLL_INTERVAL, DEFAULT_POLL_INTERVAL)),
+        _entry_setting(entry, CONF_SLOW_TIER_INTERVAL, DEFAULT_SLOW_TIER_INTERVAL),
+        _entry_setting(entry, CONF_SLOW_TIER_STATES, ""),
+    )
+    entry_data["coordinator"].async_apply_filter(ThingFilter(entry.options))
+    entry_data["coordinator"].energy_flow.grid_meter = (
+        _entry_setting(entry, CONF_GRID_METER, "") or None
+    )
+    entry_data["backfill"].enabled = _entry_setting(entry, CONF_BACKFILL, DEFAULT_BACKFILL)
+
+
+@callback
+def _async_update_unique_id(
+    hass: HomeAssistant, entry: ConfigEntry, server_uuid: str | None
+) -> None:
+    """Give entries created before unique ids were used the server uuid."""
+    if entry.unique_id is not None or not server_uuid:
+        return
+    if any(
+        other.unique_id == server_uuid
+        for other in hass.config_entries.async_entries(DOMAIN)
+    ):
+        _LOGGER.warning(
+            "Another Nymea HEM entry already uses server %s; remove the duplicate",
+            server_uuid,
+        )
+        return
+    hass.config_entries.async_update_entry(entry, unique_id=server_uuid)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
@@ -196,3 +301,9 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         await client.close_connection()
 
     return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Delete the persisted snapshot and backfill state of a removed entry."""
+    await NymeaSnapshotStore(hass, entry.entry_id).async_remove()
+    await async_remove_backfill_store(hass, entry.entry_id)
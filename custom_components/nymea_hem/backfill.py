@@ -0,0 +1,335 @@
+"""Backfill of connection gaps from the state log of the Nymea server."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, Any
+
+from homeassistant.components.recorder import get_instance
+from homeassistant.components.recorder.models import StatisticData, StatisticMetaData
+from homeassistant.components.recorder.statistics import (
+    async_import_statistics,
+    statistics_during_period,
+)
+from homeassistant.components.sensor import SensorStateClass
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import ATTR_UNIT_OF_MEASUREMENT
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.entity_registry import async_get as async_get_entity_registry
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN
+
+if TYPE_CHECKING:
+    from .coordinator import NymeaUpdateCoordinator
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+
+HOUR = 3600
+# Shorter gaps are covered by the live statistics, in seconds
+BACKFILL_MIN_GAP = 900
+# Gaps are backfilled at most this far back, in seconds
+BACKFILL_MAX_AGE = 7 * 24 * HOUR
+BACKFILL_PAGE_SIZE = 500
+# Pause between two log pages, so live polls always get the connection first
+BACKFILL_PAGE_DELAY = 2.0
+# Delay before the time of the last live refresh is written, in seconds
+LAST_SEEN_WRITE_DELAY = 60
+
+# Sensors with these state classes have long-term statistics
+STATISTIC_STATE_CLASSES = {
+    SensorStateClass.MEASUREMENT,
+    SensorStateClass.TOTAL,
+    SensorStateClass.TOTAL_INCREASING,
+}
+
+# (thing id, state type id) -> (entity id, unit, state class)
+Targets = dict[tuple[str, str], tuple[str, str | None, str]]
+
+
+def _storage_key(entry_id: str) -> str:
+    """Return the storage key of an entry's backfill state."""
+    return f"{DOMAIN}.{entry_id}.backfill"
+
+
+async def async_remove_store(hass: HomeAssistant, entry_id: str) -> None:
+    """Delete the persisted backfill state of a removed entry."""
+    await Store(hass, STORAGE_VERSION, _storage_key(entry_id)).async_remove()
+
+
+class NymeaBackfill:
+    """Import the state log of gaps in live data into long-term statistics.
+
+    The time of the last live refresh is persisted. When live data arrives
+    after a longer gap, whether Home Assistant or the connection was down,
+    the state log of the gap is fetched in pages and imported as hourly
+    statistics, one batch per sensor.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry: ConfigEntry,
+        coordinator: NymeaUpdateCoordinator,
+        enabled: bool = True,
+    ) -> None:
+        """Initialize the backfill."""
+        self._hass = hass
+        self._entry = entry
+        self._coordinator = coordinator
+        self._store: Store = Store(hass, STORAGE_VERSION, _storage_key(entry.entry_id))
+        self.enabled = enabled
+        # Wall-clock time of the last successful live refresh
+        self.last_seen: float | None = None
+        self.last_run: dict[str, Any] | None = None
+        self._task: asyncio.Task | None = None
+
+    async def async_load(self) -> None:
+        """Load the time of the last live refresh."""
+        data = await self._store.async_load()
+        if data:
+            self.last_seen = data.get("last_seen")
+
+    @callback
+    def async_handle_refresh(self) -> None:
+        """Remember live refreshes and start a backfill after a gap."""
+        coordinator = self._coordinator
+        if not coordinator.last_update_success or coordinator.stale:
+            return
+
+        now = time.time()
+        last_seen, self.last_seen = self.last_seen, now
+        self._store.async_delay_save(lambda: {"last_seen": self.last_seen}, LAST_SEEN_WRITE_DELAY)
+
+        if last_seen is None or now - last_seen < BACKFILL_MIN_GAP:
+            return
+        if not self.enabled or "recorder" not in self._hass.config.components:
+            return
+        if self._task is not None and not self._task.done():
+            return
+        # Cancelled when the entry is unloaded
+        self._task = self._entry.async_create_background_task(
+            self._hass,
+            self._async_backfill(max(last_seen, now - BACKFILL_MAX_AGE), now),
+            name=f"{DOMAIN}_backfill_{self._entry.entry_id}",
+        )
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the state of the backfill."""
+        return {
+            "enabled": self.enabled,
+            "last_seen": self.last_seen,
+            "running": self._task is not None and not self._task.done(),
+            "last_run": self.last_run,
+        }
+
+    async def _async_backfill(self, gap_start: float, gap_end: float) -> None:
+        """Import the complete hours overlapping the gap."""
+        first_hour = gap_start - gap_start % HOUR
+        last_hour = gap_end - gap_end % HOUR
+        if first_hour >= last_hour:
+            return
+
+        targets = self._statistic_targets()
+        if not targets:
+            return
+
+        started = time.monotonic()
+        try:
+            # One hour earlier, to know the value in effect when the first hour began
+            samples, entries = await self._async_fetch_samples(
+                targets, first_hour - HOUR, last_hour
+            )
+        except Exception as err:  # noqa: BLE001
+            _LOGGER.warning("Fetching the Nymea state log for the backfill failed: %s", err)
+            return
+
+        imported = 0
+        for key, key_samples in samples.items():
+            entity_id, unit, state_class = targets[key]
+            statistics = await self._async_hourly_statistics(
+                entity_id, state_class, key_samples, first_hour, last_hour
+            )
+            if not statistics:
+                continue
+            metadata = StatisticMetaData(
+                has_mean=state_class == SensorStateClass.MEASUREMENT,
+                has_sum=state_class != SensorStateClass.MEASUREMENT,
+                name=None,
+                source="recorder",
+                statistic_id=entity_id,
+                unit_of_measurement=unit,
+            )
+            async_import_statistics(self._hass, metadata, statistics)
+            imported += len(statistics)
+
+        self.last_run = {
+            "gap_start": gap_start,
+            "gap_end": gap_end,
+            "log_entries": entries,
+            "sensors": len(samples),
+            "statistics": imported,
+            "duration_s": round(time.monotonic() - started, 1),
+        }
+        _LOGGER.info(
+            "Backfilled %d hourly statistics of %d sensors from %d Nymea log entries",
+            imported,
+            len(samples),
+            entries,
+        )
+
+    def _statistic_targets(self) -> Targets:
+        """Return the sensors with long-term statistics, keyed by Nymea state."""
+        entity_registry = async_get_entity_registry(self._hass)
+        targets: Targets = {}
+        for thing_id, state_type_id in self._coordinator.states:
+            entity_id = entity_registry.async_get_entity_id(
+                "sensor", DOMAIN, f"{thing_id}_{state_type_id}"
+            )
+            state = self._hass.states.get(entity_id) if entity_id else None
+            if state is None:
+                continue
+            state_class = state.attributes.get("state_class")
+            if state_class not in STATISTIC_STATE_CLASSES:
+                continue
+            targets[(thing_id, state_type_id)] = (
+                entity_id,
+                state.attributes.get(ATTR_UNIT_OF_MEASUREMENT),
+                state_class,
+            )
+        return targets
+
+    async def _async_fetch_samples(
+        self, targets: Targets, start: float, end: float
+    ) -> tuple[dict[tuple[str, str], list[tuple[float, float]]], int]:
+        """Page through the state log and return the numeric samples per state."""
+        samples: dict[tuple[str, str], list[tuple[float, float]]] = defaultdict(list)
+        thing_ids = {thing_id for thing_id, _ in targets}
+        offset = 0
+        while True:
+            # Never compete with a live poll for the connection
+            await self._coordinator.async_wait_for_refresh()
+            entries, count = await self._coordinator.client.get_log_entries(
+                thing_ids, start, end, BACKFILL_PAGE_SIZE, offset
+            )
+            for entry in entries:
+                key = (entry.get("thingId"), entry.get("typeId"))
+                if key not in targets:
+                    continue
+                try:
+                    samples[key].append((entry["timestamp"] / 1000, float(entry["value"])))
+                except (KeyError, TypeError, ValueError):
+                    continue
+            offset += len(entries)
+            if len(entries) < BACKFILL_PAGE_SIZE or offset >= count:
+                break
+            await asyncio.sleep(BACKFILL_PAGE_DELAY)
+
+        for key_samples in samples.values():
+            key_samples.sort()
+        return samples, offset
+
+    async def _async_hourly_statistics(
+        self,
+        entity_id: str,
+        state_class: str,
+        samples: list[tuple[float, float]],
+        first_hour: float,
+        last_hour: float,
+    ) -> list[StatisticData]:
+        """Aggregate the samples of one sensor into hourly statistics."""
+        aggregates = hourly_aggregates(samples, first_hour, last_hour)
+        if not aggregates:
+            return []
+
+        if state_class == SensorStateClass.MEASUREMENT:
+            return [
+                StatisticData(
+                    start=dt_util.utc_from_timestamp(hour),
+                    mean=mean,
+                    min=low,
+                    max=high,
+                )
+                for hour, mean, low, high, _ in aggregates
+            ]
+
+        # Sums continue from the statistics of the hour before the gap
+        previous = await get_instance(self._hass).async_add_executor_job(
+            statistics_during_period,
+            self._hass,
+            dt_util.utc_from_timestamp(first_hour - HOUR),
+            dt_util.utc_from_timestamp(first_hour),
+            {entity_id},
+            "hour",
+            None,
+            {"state", "sum"},
+        )
+        rows = previous.get(entity_id)
+        if not rows or rows[-1].get("sum") is None or rows[-1].get("state") is None:
+            _LOGGER.debug("No statistics before the gap for %s, not backfilling it", entity_id)
+            return []
+
+        total = rows[-1]["sum"]
+        last_state = rows[-1]["state"]
+        statistics = []
+        for hour, _, _, _, state in aggregates:
+            if state_class == SensorStateClass.TOTAL_INCREASING and state < last_state:
+                # The meter was reset
+                total += state
+            else:
+                total += state - last_state
+            last_state = state
+            statistics.append(
+                StatisticData(
+                    start=dt_util.utc_from_timestamp(hour), state=state, sum=total
+                )
+            )
+        return statistics
+
+
+def hourly_aggregates(
+    samples: list[tuple[float, float]], first_hour: float, last_hour: float
+) -> list[tuple[float, float, float, float, float]]:
+    """Return (hour, time-weighted mean, min, max, last value) per covered hour.
+
+    Samples are sorted (timestamp, value) pairs of a step function; each
+    value holds until the next sample. Hours before the first sample are
+    skipped.
+    """
+    aggregates = []
+    index = 0
+    current: float | None = None
+    while index < len(samples) and samples[index][0] <= first_hour:
+        current = samples[index][1]
+        index += 1
+
+    for hour in range(int(first_hour), int(last_hour), HOUR):
+        end = hour + HOUR
+        cursor = float(hour)
+        weighted = covered = 0.0
+        low: float | None = None
+        high: float | None = None
+        while True:
+            if index < len(samples) and samples[index][0] < end:
+                timestamp, value = samples[index]
+                index += 1
+            else:
+                timestamp, value = end, None
+            if current is not None and timestamp > cursor:
+                weighted += current * (timestamp - cursor)
+                covered += timestamp - cursor
+                low = current if low is None else min(low, current)
+                high = current if high is None else max(high, current)
+            cursor = max(cursor, timestamp)
+            if value is None:
+                break
+            current = value
+        if covered:
+            aggregates.append((hour, weighted / covered, low, high, current))
+    return aggregates
@@ -0,0 +1,249 @@
+"""Traffic capture and deterministic replay for the Nymea HEM integration."""
+
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Any
+
+import aiohttp
+
+from .nymea_client import NymeaClient
+from .transport import DEFAULT_TRANSPORT, MemoryTransport, NymeaTransport
+
+_LOGGER = logging.getLogger(__name__)
+
+CAPTURE_FORMAT = "nymea_hem-capture"
+CAPTURE_VERSION = 1
+
+REPLAY_HOST_PREFIX = "replay:"
+REPLAY_REALTIME_HOST_PREFIX = "replay+realtime:"
+
+REDACTED = "**REDACTED**"
+REDACT_KEYS = {"password", "token", "username"}
+
+# Bound the number of buffered exchanges so a forgotten capture cannot grow forever
+MAX_CAPTURED_EXCHANGES = 100_000
+
+
+def redact(data: Any) -> Any:
+    """Return a copy of a JSON value with credentials and tokens replaced."""
+    if isinstance(data, dict):
+        return {
+            key: REDACTED if key in REDACT_KEYS else redact(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [redact(value) for value in data]
+    return data
+
+
+class TrafficCapture:
+    """Buffer redacted JSON-RPC exchanges and write them as gzipped JSON lines."""
+
+    def __init__(self, path: str) -> None:
+        """Initialize the capture."""
+        self.path = path
+        self._started = time.time()
+        self._started_monotonic = time.monotonic()
+        self._exchanges: list[dict[str, Any]] = []
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        """Return the number of buffered exchanges."""
+        return len(self._exchanges)
+
+    def record(
+        self,
+        request: dict[str, Any],
+        response: dict[str, Any],
+        started: float,
+        latency: float,
+    ) -> None:
+        """Record one request/response exchange."""
+        if len(self._exchanges) >= MAX_CAPTURED_EXCHANGES:
+            self.dropped += 1
+            return
+        self._exchanges.append(
+            {
+                "t": round(started - self._started_monotonic, 6),
+                "lat": round(latency, 6),
+                "m": request.get("method"),
+                "req": redact(request),
+                "res": redact(response),
+            }
+        )
+
+    def write(self) -> None:
+        """Write the capture to disk; runs in an executor."""
+        header = {
+            "format": CAPTURE_FORMAT,
+            "version": CAPTURE_VERSION,
+            "started": self._started,
+            "exchanges": len(self._exchanges),
+            "dropped": self.dropped,
+        }
+        with gzip.open(self.path, "wt", encoding="utf-8") as capture_file:
+            capture_file.write(json.dumps(header, separators=(",", ":")) + "\n")
+            for exchange in self._exchanges:
+                capture_file.write(json.dumps(exchange, separators=(",", ":")) + "\n")
+
+
+def load_capture(path: str) -> list[dict[str, Any]]:
+    """Load the exchanges of a capture file; runs in an executor."""
+    with gzip.open(path, "rt", encoding="utf-8") as capture_file:
+        header = json.loads(capture_file.readline())
+        if header.get("format") != CAPTURE_FORMAT:
+            raise ValueError(f"{path} is not a Nymea HEM capture")
+        return [json.loads(line) for line in capture_file if line.strip()]
+
+
+class ReplayResponder:
+    """Answer requests with captured responses.
+
+    Each request is answered with the next captured response of the same
+    method. Once all responses of a method were served, the replay starts
+    over, so polling can run indefinitely on a short capture.
+    """
+
+    def __init__(self, exchanges: list[dict[str, Any]], realtime: bool = False) -> None:
+        """Initialize the replay."""
+        self._responses: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        for exchange in exchanges:
+            self._responses[exchange["m"]].append(exchange)
+        self._cursors: dict[str, int] = defaultdict(int)
+        self._realtime = realtime
+
+    def _next_response(self, request: dict[str, Any]) -> tuple[dict[str, Any], float]:
+        """Return the captured response and latency for a request."""
+        method = request.get("method")
+        captured = self._responses.get(method)
+        if not captured and method == "JSONRPC.Authenticate":
+            # Captures taken on an authenticated connection start with Hello
+            return (
+                {
+                    "id": request.get("id"),
+                    "status": "success",
+                    "params": {"success": True, "token": REDACTED},
+                },
+                0.0,
+            )
+        if not captured:
+            return (
+                {
+                    "id": request.get("id"),
+                    "status": "error",
+                    "error": f"{method} is not part of the capture",
+                },
+                0.0,
+            )
+        cursor = self._cursors[method]
+        self._cursors[method] = (cursor + 1) % len(captured)
+        exchange = captured[cursor]
+        return {**exchange["res"], "id": request.get("id")}, exchange["lat"]
+
+    def __call__(self, request: dict[str, Any]) -> Any:
+        """Return the response, delayed by the captured latency in realtime mode."""
+        response, latency = self._next_response(request)
+        if self._realtime and latency:
+            return _delayed(response, latency)
+        return response
+
+
+async def _delayed(response: dict[str, Any], latency: float) -> dict[str, Any]:
+    """Return response after latency seconds."""
+    await asyncio.sleep(latency)
+    return response
+
+
+class ReplayNymeaClient(NymeaClient):
+    """Nymea client that talks to a capture instead of a server."""
+
+    def __init__(self, path: str, realtime: bool = False, **kwargs: Any) -> None:
+        """Initialize the replay client."""
+        super().__init__(**kwargs)
+        self._capture_path = path
+        self._realtime = realtime
+        self._exchanges: list[dict[str, Any]] | None = None
+
+    async def _create_transport(self, ssl_context) -> NymeaTransport:
+        """Create an in-memory transport answering from the capture."""
+        if self._exchanges is None:
+            self._exchanges = await asyncio.get_running_loop().run_in_executor(
+                None, load_capture, self._capture_path
+            )
+            _LOGGER.info(
+                "Replaying %d exchanges from %s", len(self._exchanges), self._capture_path
+            )
+        return MemoryTransport(self.metrics, ReplayResponder(self._exchanges, self._realtime))
+
+    async def _create_ssl_context(self):
+        """Replays never use TLS."""
+        return None
+
+    def set_request_rate(self, rate: float) -> None:
+        """Replays are never rate limited; requests are still sent one at a time."""
+
+    @property
+    def server_info(self) -> dict[str, Any]:
+        """Return the captured server info under a replay-specific uuid.
+
+        This keeps replay entries and devices apart from those of the live
+        server the capture was taken from.
+        """
+        info = super().server_info
+        if info.get("uuid"):
+            return {**info, "uuid": f"replay-{info['uuid']}"}
+        return info
+
+
+def create_client(
+    config_path: str,
+    host: str,
+    port: int,
+    username: str,
+    password: str,
+    ssl_enabled: bool,
+    token: str | None = None,
+    transport: str = DEFAULT_TRANSPORT,
+    session: aiohttp.ClientSession | None = None,
+) -> NymeaClient:
+    """Create a client for a server or, for replay hosts, for a capture file.
+
+    A host of ``replay:<file>`` replays a capture as fast as possible and
+    ``replay+realtime:<file>`` keeps the captured response latencies. Relative
+    file names are resolved against the config directory.
+    """
+    for prefix, realtime in (
+        (REPLAY_REALTIME_HOST_PREFIX, True),
+        (REPLAY_HOST_PREFIX, False),
+    ):
+        if host.startswith(prefix):
+            path = host[len(prefix):]
+            if not path.startswith("/"):
+                path = f"{config_path}/{path}"
+            return ReplayNymeaClient(
+                path,
+                realtime,
+                host=host,
+                port=port,
+                username=username,
+                password=password,
+                ssl_enabled=False,
+                token=token,
+            )
+
+    return NymeaClient(
+        host=host,
+        port=port,
+        username=username,
+        password=password,
+        ssl_enabled=ssl_enabled,
+        token=token,
+        transport=transport,
+        session=session,
+    )
@@ -5,17 +5,42 @@ from typing import Any, Dict, Optional
 import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.const import CONF_HOST, CONF_PORT, CONF_USERNAME, CONF_PASSWORD
+from homeassistant.core import callback
+from homeassistant.data_entry_flow import AbortFlow
 from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 from .const import (
     DOMAIN,
+    CONF_BACKFILL,
+    CONF_BUFFER_RETENTION,
+    CONF_BUFFER_STATES,
+    CONF_GRID_METER,
+    CONF_CONNECTION_TIMEOUT,
+    CONF_LOCAL_STATISTICS,
+    CONF_MAX_REQUEST_RATE,
     CONF_SSL,
     CONF_POLL_INTERVAL,
+    CONF_READ_TIMEOUT,
+    CONF_SLOW_TIER_INTERVAL,
+    CONF_SLOW_TIER_STATES,
+    CONF_TOKEN,
+    CONF_TRANSPORT,
+    DEFAULT_BACKFILL,
+    DEFAULT_CONNECTION_TIMEOUT,
+    DEFAULT_LOCAL_STATISTICS,
     DEFAULT_PORT,
+    DEFAULT_READ_TIMEOUT,
     DEFAULT_SSL,
     DEFAULT_POLL_INTERVAL,
+    DEFAULT_SLOW_TIER_INTERVAL,
 )
-from .nymea_client import NymeaClient
+from .capture import create_client
+from .filters import FILTER_OPTIONS
+from .governor import DEFAULT_REQUEST_RATE
+from .handoff import hand_off_client
+from .ring_buffer import DEFAULT_BUFFER_RETENTION
+from .transport import DEFAULT_TRANSPORT, TRANSPORTS
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -24,6 +49,12 @@ class NymeaHEMConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     VERSION = 1
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        """Return the options flow."""
+        return NymeaHEMOptionsFlow(config_entry)
+
     async def async_step_user(self, user_input: Optional[Dict[str, Any]] = None):
         """Handle the initial step."""
         errors = {}
@@ -36,6 +67,7 @@ class NymeaHEMConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 username = user_input.get(CONF_USERNAME)
                 password = user_input.get(CONF_PASSWORD)
                 ssl_enabled = user_input.get(CONF_SSL, DEFAULT_SSL)
+                transport = user_input.get(CONF_TRANSPORT, DEFAULT_TRANSPORT)
                 poll_interval = user_input.get(CONF_POLL_INTERVAL, DEFAULT_POLL_INTERVAL)
 
                 # Perform validation
@@ -50,17 +82,43 @@ class NymeaHEMConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                     return self._show_config_form(errors)
 
                 # Attempt to authenticate
-                client = NymeaClient(
+                client = create_client(
+                    self.hass.config.config_dir,
                     host=host,
                     port=port,
                     username=username,
                     password=password,
-                    ssl_enabled=ssl_enabled                    
+                    ssl_enabled=ssl_enabled,
+                    transport=transport,
+                    session=async_get_clientsession(self.hass),
                 )
 
                 # Verify connection and authentication
-                await client.authenticate()
-                
+                try:
+                    await client.authenticate()
+                except Exception:
+                    await client.close_connection()
+                    raise
+
+            except Exception as err:
+                _LOGGER.error(f"Connection error: {err}")
+                errors["base"] = "cannot_connect"
+
+            else:
+                # Reject a second entry for the same server
+                server_uuid = client.server_info.get("uuid")
+                if server_uuid:
+                    await self.async_set_unique_id(server_uuid)
+                    try:
+                        self._abort_if_unique_id_configured()
+                    except AbortFlow:
+                        await client.close_connection()
+                        raise
+                    # Hand the authenticated connection over to the entry setup
+                    hand_off_client(self.hass, server_uuid, client)
+                else:
+                    await client.close_connection()
+
                 # Create unique entry
                 return self.async_create_entry(
                     title=f"Nymea HEM - {host}",
@@ -70,13 +128,11 @@ class NymeaHEMConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                         CONF_USERNAME: username,
                         CONF_PASSWORD: password,
                         CONF_SSL: ssl_enabled,
-                        CONF_POLL_INTERVAL: poll_interval
+                        CONF_TRANSPORT: transport,
+                        CONF_POLL_INTERVAL: poll_interval,
+                        CONF_TOKEN: client.token,
                     }
                 )
-            
-            except Exception as err:
-                _LOGGER.error(f"Connection error: {err}")
-                errors["base"] = "cannot_connect"
 
         return self._show_config_form(errors)
 
@@ -90,7 +146,78 @@ class NymeaHEMConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 vol.Required(CONF_USERNAME, default=""): str,
                 vol.Required(CONF_PASSWORD, default=""): str,
                 vol.Optional(CONF_SSL, default=DEFAULT_SSL): bool,
+                vol.Optional(CONF_TRANSPORT, default=DEFAULT_TRANSPORT): vol.In(TRANSPORTS),
                 vol.Optional(CONF_POLL_INTERVAL, default=DEFAULT_POLL_INTERVAL): int
             }),
             errors=errors or {}
-        )
\ No newline at end of file
+        )
+
+
+class NymeaHEMOptionsFlow(config_entries.OptionsFlow):
+    """Retune a running Nymea HEM entry without reconnecting."""
+
+    def __init__(self, config_entry) -> None:
+        """Initialize the options flow."""
+        self._entry = config_entry
+
+    async def async_step_init(self, user_input: Optional[Dict[str, Any]] = None):
+        """Manage polling, timeouts, refresh tiers and entity filters."""
+        if user_input is not None:
+            return self.async_create_entry(title="", data={**self._entry.options, **user_input})
+
+        current = {**self._entry.data, **self._entry.options}
+        return self.async_show_form(
+            step_id="init",
+            data_schema=vol.Schema({
+                vol.Required(
+                    CONF_POLL_INTERVAL,
+                    default=current.get(CONF_POLL_INTERVAL, DEFAULT_POLL_INTERVAL),
+                ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+                vol.Required(
+                    CONF_SLOW_TIER_INTERVAL,
+                    default=current.get(CONF_SLOW_TIER_INTERVAL, DEFAULT_SLOW_TIER_INTERVAL),
+                ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                # States published in the slow tier, as state name patterns
+                vol.Optional(
+                    CONF_SLOW_TIER_STATES, default=current.get(CONF_SLOW_TIER_STATES, "")
+                ): str,
+                vol.Required(
+                    CONF_CONNECTION_TIMEOUT,
+                    default=current.get(CONF_CONNECTION_TIMEOUT, DEFAULT_CONNECTION_TIMEOUT),
+                ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+                vol.Required(
+                    CONF_READ_TIMEOUT,
+                    default=current.get(CONF_READ_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+                # Requests per second sent to the server; 0 disables the limit
+                vol.Required(
+                    CONF_MAX_REQUEST_RATE,
+                    default=current.get(CONF_MAX_REQUEST_RATE, DEFAULT_REQUEST_RATE),
+                ): vol.All(vol.Coerce(float), vol.Range(min=0)),
+                vol.Required(
+                    CONF_BACKFILL,
+                    default=current.get(CONF_BACKFILL, DEFAULT_BACKFILL),
+                ): bool,
+                vol.Required(
+                    CONF_LOCAL_STATISTICS,
+                    default=current.get(CONF_LOCAL_STATISTICS, DEFAULT_LOCAL_STATISTICS),
+                ): bool,
+                # Name or id of the thing measuring the grid connection
+                vol.Optional(
+                    CONF_GRID_METER, default=current.get(CONF_GRID_METER, "")
+                ): str,
+                # Numeric states kept in memory at full resolution, as state name patterns
+                vol.Optional(
+                    CONF_BUFFER_STATES, default=current.get(CONF_BUFFER_STATES, "")
+                ): str,
+                vol.Required(
+                    CONF_BUFFER_RETENTION,
+                    default=current.get(CONF_BUFFER_RETENTION, DEFAULT_BUFFER_RETENTION),
+                ): vol.All(vol.Coerce(int), vol.Range(min=60, max=86400)),
+                # Comma separated, case-insensitive wildcard patterns
+                **{
+                    vol.Optional(key, default=current.get(key, "")): str
+                    for key in FILTER_OPTIONS
+                },
+            }),
+        )
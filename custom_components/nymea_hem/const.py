@@ -11,17 +11,57 @@ CONF_PORT = "port"
 CONF_USERNAME = "username"
 CONF_PASSWORD = "password"
 CONF_SSL = "ssl"
+CONF_TRANSPORT = "transport"
 CONF_POLL_INTERVAL = "poll_interval"
+CONF_TOKEN = "token"
+CONF_CONNECTION_TIMEOUT = "connection_timeout"
+CONF_READ_TIMEOUT = "read_timeout"
+CONF_SLOW_TIER_INTERVAL = "slow_tier_interval"
+CONF_SLOW_TIER_STATES = "slow_tier_states"
+CONF_BACKFILL = "backfill"
+CONF_LOCAL_STATISTICS = "local_statistics"
+CONF_MAX_REQUEST_RATE = "max_request_rate"
+CONF_BUFFER_STATES = "buffer_states"
+CONF_BUFFER_RETENTION = "buffer_retention"
+CONF_GRID_METER = "grid_meter"
+CONF_INCLUDE_THINGS = "include_things"
+CONF_EXCLUDE_THINGS = "exclude_things"
+CONF_INCLUDE_INTERFACES = "include_interfaces"
+CONF_EXCLUDE_INTERFACES = "exclude_interfaces"
+CONF_INCLUDE_THING_CLASSES = "include_thing_classes"
+CONF_EXCLUDE_THING_CLASSES = "exclude_thing_classes"
+CONF_INCLUDE_STATES = "include_states"
+CONF_EXCLUDE_STATES = "exclude_states"
 
 DEFAULT_PORT = 2222
 DEFAULT_SSL = True
 DEFAULT_POLL_INTERVAL = 60
+DEFAULT_CONNECTION_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 15
+DEFAULT_SLOW_TIER_INTERVAL = 0
+DEFAULT_BACKFILL = True
+DEFAULT_LOCAL_STATISTICS = False
+
+DATA_FLEET = "fleet"
+DATA_HANDOFF = "handoff"
+DATA_PROFILER = "profiler"
+
+# Seconds a validated config flow connection waits for its entry to be set up
+HANDOFF_TIMEOUT = 60
+
+SERVICE_BUFFER_QUERY = "buffer_query"
+SERVICE_CAPTURE = "capture"
+SERVICE_FLEET_STATUS = "fleet_status"
+SERVICE_GET_PAYLOAD = "get_payload"
+SERVICE_PROFILE = "profile"
+SERVICE_TARIFF_QUERY = "tariff_query"
 
 JSONRPC_HELLO_METHOD = "JSONRPC.Hello"
 JSONRPC_AUTH_METHOD = "JSONRPC.Authenticate"
 INTEGRATIONS_GET_THINGS = "Integrations.GetThings"
 INTEGRATIONS_GET_THING_STATE = "Integrations.GetThingState"
 INTEGRATIONS_GET_THING_CLASSES = "Integrations.GetThingClasses"
+LOGGING_GET_LOG_ENTRIES = "Logging.GetLogEntries"
 
 ATTR_DEVICE_ID = "device_id"
 ATTR_DEVICE_NAME = "device_name"
@@ -31,4 +71,6 @@ ATTR_THING_CLASS_NAME = "thing_class_name"
 ATTR_STATE_TYPE_ID = "state_type_id"
 ATTR_STATE_NAME = "state_name"
 ATTR_VALUE_IN_STATE = "value_in_state"
-ATTR_VALUE_PAYLOAD = "value_payload"
+ATTR_PAYLOAD_HASH = "payload_hash"
+ATTR_PAYLOAD_SIZE = "payload_size"
+ATTR_STALE = "stale"
@@ -0,0 +1,573 @@
+"""Data update coordinator for the Nymea HEM integration."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Callable
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+
+from .energy_flow import EnergyFlow
+from .filters import ThingFilter, compile_patterns, parse_patterns
+from .nymea_client import NymeaClient
+from .payloads import PayloadStore
+from .ring_buffer import StateBuffers
+from .snapshot import NymeaSnapshotStore
+from .tariffs import TariffStore
+
+if TYPE_CHECKING:
+    from .fleet import NymeaFleet
+    from .local_statistics import LocalStatistics
+
+_LOGGER = logging.getLogger(__name__)
+
+# Retry configuration constants
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 5  # seconds
+MAX_RETRY_DELAY = 300  # 5 minutes max
+RETRY_MULTIPLIER = 2  # exponential backoff
+
+# Seconds a thing must be missing before its entities and device are removed;
+# until then its sensors are unavailable, so a thing that is briefly gone
+# during a server restart or plugin reload keeps its history and settings
+THING_REMOVAL_GRACE = 24 * 3600
+
+# Consecutive refreshes longer than the poll interval before work is shed
+OVERLOAD_THRESHOLD = 3
+
+# Low-priority work, in the order it is shed under sustained overload
+SHED_ATTRIBUTES = "attributes"
+SHED_CLASS_REVALIDATION = "class_revalidation"
+SHED_SLOW_TIER = "slow_tier"
+SHED_ORDER = (SHED_ATTRIBUTES, SHED_CLASS_REVALIDATION, SHED_SLOW_TIER)
+
+# Called with the added or changed things, the retired thing ids and the
+# (thing id, state type id) keys of states that were filtered out
+TopologyListener = Callable[
+    [list[dict[str, Any]], list[str], list[tuple[str, str]]], None
+]
+
+
+class NymeaUpdateCoordinator(DataUpdateCoordinator):
+    """Custom coordinator with retry logic."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        client: NymeaClient,
+        name: str,
+        update_interval: timedelta,
+        snapshot: NymeaSnapshotStore | None = None,
+        slow_tier_interval: float = 0,
+        thing_filter: ThingFilter | None = None,
+        slow_tier_states: str | None = None,
+    ) -> None:
+        """Initialize the coordinator."""
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=name,
+            update_interval=update_interval,
+        )
+        self.client = client
+        self.metrics = client.metrics
+        self.snapshot = snapshot
+        # True while entities show the persisted snapshot instead of live data
+        self.stale = False
+        self.stale_since: float | None = None
+        self._configured_interval = update_interval
+        # Slow-tier work runs at most every slow_tier_interval seconds
+        self.slow_tier_interval = slow_tier_interval
+        self.slow_tier_due = True
+        self._last_slow_tier: float | None = None
+        # State name patterns of the sensors published in the slow tier
+        self._slow_tier_pattern = compile_patterns(parse_patterns(slow_tier_states))
+        # (thing class id, state type id) -> published in the slow tier
+        self._slow_tier_decisions: dict[tuple[str, str], bool] = {}
+        # Firmware version the cached thing classes were fetched from
+        self._classes_version: str | None = None
+        # Set by a version change or added things until the classes were re-fetched
+        self._revalidation_due = False
+        self.thing_filter = thing_filter or ThingFilter()
+        self._filter_changed = False
+        # Number of SHED_ORDER entries currently skipped
+        self.shed_level = 0
+        self._consecutive_overruns = 0
+        self._refresh_task: asyncio.Future | None = None
+        # Held by each refresh; hold it to swap the connection between refreshes
+        self.refresh_lock = asyncio.Lock()
+        self.last_error: Exception | None = None
+        self.consecutive_failures = 0
+        self.max_consecutive_failures = DEFAULT_RETRY_ATTEMPTS
+        # Index of the latest refresh: thing id -> thing, (thing id, state type id) -> state
+        self.things_by_id: dict[str, dict[str, Any]] = {}
+        self.states: dict[tuple[str, str], dict[str, Any]] = {}
+        # Thing class id -> thing class details, fetched once per class
+        self.thing_classes: dict[str, dict[str, Any]] = {}
+        # Price and time-slot schedules, re-parsed only when their value changes
+        self.tariffs = TariffStore()
+        # State values too large for an entity state, by content hash
+        self.payloads = PayloadStore()
+        # Site energy flows derived from the meters, producers and batteries
+        self.energy_flow = EnergyFlow()
+        self._known_thing_ids: set[str] | None = None
+        # Thing id -> time it was first missing
+        self._missing_things: dict[str, float] = {}
+        self._topology_listeners: list[TopologyListener] = []
+        # Set while the entry is registered with the domain-wide fleet
+        self.fleet: NymeaFleet | None = None
+        # Set when statistics are computed locally instead of by the recorder
+        self.local_statistics: LocalStatistics | None = None
+        # Set when states are kept in memory at full resolution
+        self.buffers: StateBuffers | None = None
+
+    @property
+    def configured_interval_seconds(self) -> float:
+        """Return the poll interval configured for this entry."""
+        return self._configured_interval.total_seconds()
+
+    def health(self) -> dict[str, Any]:
+        """Return health and timing figures of this server."""
+        server_info = self.client.server_info
+        get_things = self.metrics.rpc_latency.get("Integrations.GetThings")
+        return {
+            "name": server_info.get("name"),
+            "version": server_info.get("version"),
+            "last_update_success": self.last_update_success,
+            "stale": self.stale,
+            "consecutive_failures": self.consecutive_failures,
+            "poll_interval": self.configured_interval_seconds,
+            "next_poll_in": self.update_interval.total_seconds()
+            if self.update_interval
+            else None,
+            "refresh_duration": self.metrics.refresh_duration.as_dict(),
+            "get_things_mean_ms": get_things.as_dict()["mean_ms"] if get_things else None,
+            "reconnects": self.metrics.reconnects,
+            "refresh_overruns": self.metrics.refresh_overruns,
+            "shed_level": self.shed_level,
+            "things": len(self.things_by_id),
+        }
+
+    async def async_wait_for_refresh(self) -> None:
+        """Wait until a running refresh finished, whatever its outcome."""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            await asyncio.wait([self._refresh_task])
+
+    def shedding(self, work: str) -> bool:
+        """Return True while the given low-priority work is skipped."""
+        return work in SHED_ORDER[: self.shed_level]
+
+    def _shared_thing_classes(self) -> dict[str, dict[str, Any]] | None:
+        """Return the fleet cache for this server's firmware version, if any."""
+        version = self.client.server_info.get("version")
+        if self.fleet is None or not version:
+            return None
+        return self.fleet.shared_thing_classes(version)
+
+    @callback
+    def async_add_topology_listener(self, listener: TopologyListener) -> CALLBACK_TYPE:
+        """Listen for things being added, removed or having their thing class changed."""
+        self._topology_listeners.append(listener)
+
+        @callback
+        def remove_listener() -> None:
+            self._topology_listeners.remove(listener)
+
+        return remove_listener
+
+    async def async_fetch_thing_classes(self, thing_class_ids: set[str]) -> None:
+        """Fetch the thing classes that are not cached yet in one request."""
+        missing = [
+            thing_class_id
+            for thing_class_id in thing_class_ids
+            if thing_class_id and thing_class_id not in self.thing_classes
+        ]
+        if not missing:
+            return
+
+        # Servers running the same firmware version share their thing classes
+        shared = self._shared_thing_classes()
+        if shared:
+            for thing_class_id in missing:
+                if thing_class_id in shared:
+                    self.thing_classes[thing_class_id] = shared[thing_class_id]
+            missing = [
+                thing_class_id for thing_class_id in missing
+                if thing_class_id not in self.thing_classes
+            ]
+            if not missing:
+                return
+
+        try:
+            thing_classes = await self.client.get_thing_classes(missing)
+        except Exception as err:
+            _LOGGER.error("Error fetching thing class details for %s: %s", missing, err)
+            return
+
+        for thing_class in thing_classes:
+            if "id" in thing_class:
+                self.thing_classes[thing_class["id"]] = thing_class
+                if shared is not None:
+                    shared[thing_class["id"]] = thing_class
+
+    @callback
+    def async_apply_options(
+        self,
+        update_interval: timedelta,
+        slow_tier_interval: float,
+        slow_tier_states: str | None = None,
+    ) -> None:
+        """Change the poll interval and the slow tier from the next refresh on."""
+        self._configured_interval = update_interval
+        if not self.stale:
+            self.update_interval = update_interval
+        self.slow_tier_interval = slow_tier_interval
+        self._slow_tier_pattern = compile_patterns(parse_patterns(slow_tier_states))
+        self._slow_tier_decisions = {}
+
+    def in_slow_tier(self, thing_class_id: str | None, state_type: dict[str, Any]) -> bool:
+        """Return True if a state is published in the slow tier.
+
+        The slow tier only holds the states whose name or display name
+        matches the configured patterns, and only while it has an interval.
+        """
+        if not self.slow_tier_interval or self._slow_tier_pattern is None:
+            return False
+        key = (thing_class_id, state_type.get("id"))
+        decision = self._slow_tier_decisions.get(key)
+        if decision is None:
+            decision = any(
+                self._slow_tier_pattern.match(str(state_type.get(name, "")))
+                for name in ("name", "displayName")
+            )
+            self._slow_tier_decisions[key] = decision
+        return decision
+
+    @callback
+    def async_apply_filter(self, thing_filter: ThingFilter) -> None:
+        """Use new include and exclude rules from the next refresh on."""
+        if thing_filter == self.thing_filter:
+            return
+        self.thing_filter = thing_filter
+        self._filter_changed = True
+
+    async def _async_revalidate_thing_classes(self) -> None:
+        """Re-fetch the cached thing classes and report things whose states changed."""
+        if not self.thing_classes:
+            return
+
+        try:
+            thing_classes = await self.client.get_thing_classes(list(self.thing_classes))
+        except Exception as err:  # noqa: BLE001
+            _LOGGER.debug("Thing class revalidation failed: %s", err)
+            return
+
+        shared = self._shared_thing_classes()
+        changed: set[str] = set()
+        for thing_class in thing_classes:
+            thing_class_id = thing_class.get("id")
+            cached = self.thing_classes.get(thing_class_id)
+            if cached is None:
+                continue
+            if _state_type_ids(thing_class) != _state_type_ids(cached):
+                changed.add(thing_class_id)
+            self.thing_classes[thing_class_id] = thing_class
+            if shared is not None:
+                shared[thing_class_id] = thing_class
+
+        if not changed:
+            return
+
+        things = [
+            thing for thing in self.things_by_id.values()
+            if thing.get("thingClassId") in changed
+        ]
+        _LOGGER.info("State types of %d Nymea thing classes changed", len(changed))
+        for listener in list(self._topology_listeners):
+            listener(things, [], [])
+
+    @callback
+    def async_restore_snapshot(self, snapshot: dict[str, Any]) -> None:
+        """Serve the persisted snapshot until the server is reachable again."""
+        self.thing_classes.update(snapshot.get("thing_classes", {}))
+        self.data = self.thing_filter.filter_things(snapshot["things"], self.thing_classes)
+        self._index_things(self.data)
+        self._detect_topology_changes()
+        self._classes_version = snapshot.get("server_info", {}).get("version")
+        self.stale = True
+        self.stale_since = snapshot.get("saved_at")
+        # Retry with backoff instead of the regular poll interval
+        self.update_interval = timedelta(seconds=DEFAULT_RETRY_DELAY)
+
+    def _snapshot_data(self) -> dict[str, Any]:
+        """Return the data persisted in the snapshot."""
+        return {
+            "saved_at": time.time(),
+            "server_info": self.client.server_info,
+            "things": self.data or [],
+            "thing_classes": self.thing_classes,
+        }
+
+    def _index_things(self, things: list[dict[str, Any]]) -> None:
+        """Index the things and states of a refresh for constant-time lookups."""
+        self.things_by_id = {thing["id"]: thing for thing in things if thing.get("id")}
+        self.states = {
+            (thing_id, state["stateTypeId"]): state
+            for thing_id, thing in self.things_by_id.items()
+            for state in thing.get("states", [])
+            if "stateTypeId" in state
+        }
+        self.tariffs.update(self.things_by_id, self.states, self.thing_classes)
+        self.energy_flow.update(self.things_by_id, self.states, self.thing_classes)
+
+    def _detect_topology_changes(self) -> None:
+        """Notify listeners about added and retired things."""
+        current = self.things_by_id
+        if self._known_thing_ids is None:
+            self._known_thing_ids = set(current)
+            return
+
+        added = [thing for thing_id, thing in current.items() if thing_id not in self._known_thing_ids]
+        removed: list[str] = []
+        now = time.monotonic()
+        for thing_id in self._known_thing_ids - current.keys():
+            missing_since = self._missing_things.setdefault(thing_id, now)
+            if missing_since == now:
+                _LOGGER.info(
+                    "Nymea thing %s is missing; its sensors are unavailable and "
+                    "are removed if it does not return within %d hours",
+                    thing_id,
+                    THING_REMOVAL_GRACE // 3600,
+                )
+            elif now - missing_since >= THING_REMOVAL_GRACE:
+                removed.append(thing_id)
+                self._missing_things.pop(thing_id)
+        for thing_id in current:
+            if self._missing_things.pop(thing_id, None) is not None:
+                _LOGGER.info("Nymea thing %s is back", thing_id)
+
+        if not added and not removed:
+            return
+        if added:
+            # Things of a known class may come from an updated plugin
+            self._revalidation_due = True
+
+        self._known_thing_ids.update(current)
+        self._known_thing_ids.difference_update(removed)
+        _LOGGER.info(
+            "Nymea topology changed: %d things added, %d things removed",
+            len(added),
+            len(removed),
+        )
+        for listener in list(self._topology_listeners):
+            listener(added, removed, [])
+
+    def _track_load(self, elapsed: float) -> None:
+        """Count overruns and raise or lower the shed level."""
+        interval = self.configured_interval_seconds
+        if interval and elapsed >= interval:
+            self.metrics.refresh_overruns += 1
+            self._consecutive_overruns += 1
+            if (
+                self._consecutive_overruns >= OVERLOAD_THRESHOLD
+                and self.shed_level < len(SHED_ORDER)
+            ):
+                self.shed_level += 1
+                _LOGGER.warning(
+                    "Nymea refreshes take %.1fs with a poll interval of %.0fs, "
+                    "skipping %s",
+                    elapsed,
+                    interval,
+                    ", ".join(SHED_ORDER[: self.shed_level]),
+                )
+            return
+
+        self._consecutive_overruns = 0
+        if self.shed_level:
+            self.shed_level -= 1
+            if not self.shed_level:
+                _LOGGER.info("Nymea refreshes are on time again, resuming all work")
+
+    def _next_update_interval(self, elapsed: float) -> timedelta:
+        """Return the interval to the next poll, staggered within the fleet.
+
+        After an overrun the ticks missed while the refresh ran are dropped
+        and the server gets at least as much idle time as the refresh took.
+        """
+        if self.fleet is None:
+            interval = self._configured_interval
+        else:
+            interval = timedelta(
+                seconds=self.fleet.next_poll_delay(self, self.configured_interval_seconds)
+            )
+        if elapsed >= self.configured_interval_seconds:
+            interval = max(interval, timedelta(seconds=elapsed))
+        return interval
+
+    def _notify_filter_change(self, previous_states: dict[tuple[str, str], Any]) -> None:
+        """Report newly included things and states and newly excluded states."""
+        dropped = [
+            key
+            for key in previous_states
+            if key not in self.states and key[0] in self.things_by_id
+        ]
+        for listener in list(self._topology_listeners):
+            listener(list(self.things_by_id.values()), [], dropped)
+
+    async def _async_update_data(self) -> Any:
+        """Fetch data, merging concurrent requests into the running refresh."""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self.metrics.merged_refreshes += 1
+            return await asyncio.shield(self._refresh_task)
+
+        self._refresh_task = asyncio.ensure_future(self._async_refresh_locked())
+        return await self._refresh_task
+
+    async def _async_refresh_locked(self) -> Any:
+        """Refresh once the refresh lock is free; waiting is not part of the duration."""
+        async with self.refresh_lock:
+            return await self._async_refresh_things()
+
+    async def _async_refresh_things(self) -> Any:
+        """Fetch data and record how long the refresh took."""
+        started = time.monotonic()
+        try:
+            data = await self._async_fetch_things()
+        except UpdateFailed:
+            self.metrics.refresh_failures += 1
+            if self.stale:
+                self.update_interval = timedelta(
+                    seconds=min(
+                        self.update_interval.total_seconds() * RETRY_MULTIPLIER,
+                        MAX_RETRY_DELAY,
+                    )
+                )
+            raise
+        else:
+            if self.stale:
+                _LOGGER.info("Nymea server reachable again, switching to live data")
+                self.stale = False
+                self.stale_since = None
+            elapsed = time.monotonic() - started
+            self._track_load(elapsed)
+            self.update_interval = self._next_update_interval(elapsed)
+            if self.shedding(SHED_ATTRIBUTES):
+                self.metrics.record_shed(SHED_ATTRIBUTES)
+            if self.thing_filter.active:
+                # Class names and state names are needed to apply the rules
+                await self.async_fetch_thing_classes(
+                    {thing.get("thingClassId") for thing in data}
+                )
+                data = self.thing_filter.filter_things(data, self.thing_classes)
+            previous_states = self.states
+            self._index_things(data)
+            if self.buffers is not None:
+                self.buffers.feed(
+                    time.time(),
+                    self.things_by_id,
+                    self.states,
+                    self.thing_classes,
+                    self.configured_interval_seconds,
+                )
+            self._detect_topology_changes()
+            if self._filter_changed:
+                self._filter_changed = False
+                self._notify_filter_change(previous_states)
+            now = time.monotonic()
+            self.slow_tier_due = (
+                self._last_slow_tier is None
+                or now - self._last_slow_tier >= self.slow_tier_interval
+            )
+            if self.slow_tier_due and self.shedding(SHED_SLOW_TIER):
+                self.slow_tier_due = False
+                self.metrics.record_shed(SHED_SLOW_TIER)
+            if self.slow_tier_due:
+                self._last_slow_tier = now
+            version = self.client.server_info.get("version")
+            if version and version != self._classes_version:
+                # Thing classes may change with the firmware; the first
+                # version seen is the one the classes were fetched from
+                self._revalidation_due |= self._classes_version is not None
+                self._classes_version = version
+            if self._revalidation_due:
+                if self.shedding(SHED_CLASS_REVALIDATION):
+                    self.metrics.record_shed(SHED_CLASS_REVALIDATION)
+                else:
+                    self._revalidation_due = False
+                    await self._async_revalidate_thing_classes()
+            if self.snapshot is not None:
+                self.snapshot.async_schedule_save(self._snapshot_data)
+            return data
+        finally:
+            self.metrics.refresh_duration.record(time.monotonic() - started)
+
+    async def _async_fetch_things(self) -> Any:
+        """Fetch data with improved error handling and retry logic."""
+        try:
+            # Ensure connection is still alive before attempting update
+            if not self.client.is_connected():
+                _LOGGER.debug("Connection lost, attempting to reconnect")
+                await self.client.connect()
+
+            data = await self.client.get_things()
+
+            # Reset failure counter on success
+            if self.consecutive_failures > 0:
+                _LOGGER.info(
+                    "Connection recovered after %d consecutive failures",
+                    self.consecutive_failures
+                )
+                self.consecutive_failures = 0
+
+            self.last_error = None
+            return data
+
+        except asyncio.TimeoutError as err:
+            self.consecutive_failures += 1
+            error_msg = f"Connection timeout (attempt {self.consecutive_failures}/{self.max_consecutive_failures})"
+            _LOGGER.warning(error_msg)
+            self.last_error = err
+
+            # If we haven't exceeded max attempts, raise UpdateFailed to trigger retry
+            if self.consecutive_failures < self.max_consecutive_failures:
+                raise UpdateFailed(error_msg) from err
+            else:
+                # After max attempts, log severity and still raise but with different message
+                raise UpdateFailed(
+                    f"Failed to connect after {self.max_consecutive_failures} attempts: {err}"
+                ) from err
+
+        except ConnectionError as err:
+            self.consecutive_failures += 1
+            error_msg = f"Connection lost (attempt {self.consecutive_failures}/{self.max_consecutive_failures}): {err}"
+            _LOGGER.warning(error_msg)
+            self.last_error = err
+
+            if self.consecutive_failures < self.max_consecutive_failures:
+                raise UpdateFailed(error_msg) from err
+            else:
+                raise UpdateFailed(
+                    f"Connection permanently lost after {self.max_consecutive_failures} attempts"
+                ) from err
+
+        except Exception as err:
+            self.consecutive_failures += 1
+            error_msg = f"Unexpected error updating Nymea data (attempt {self.consecutive_failures}/{self.max_consecutive_failures})"
+            _LOGGER.error(
+                "%s: %s",
+                error_msg,
+                err,
+                exc_info=True
+            )
+            self.last_error = err
+            raise UpdateFailed(error_msg) from err
+
+
+def _state_type_ids(thing_class: dict[str, Any]) -> set[str]:
+    """Return the state type ids of a thing class."""
+    return {state_type.get("id") for state_type in thing_class.get("stateTypes", [])}
@@ -0,0 +1,50 @@
+"""Diagnostics support for the Nymea HEM integration."""
+
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import CONF_HOST, CONF_PASSWORD, CONF_TOKEN, CONF_USERNAME, DATA_FLEET, DOMAIN
+
+TO_REDACT = {CONF_HOST, CONF_PASSWORD, CONF_TOKEN, CONF_USERNAME, "uuid"}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    entry_data = hass.data[DOMAIN][entry.entry_id]
+    client = entry_data["client"]
+    coordinator = entry_data["coordinator"]
+
+    return {
+        "entry": async_redact_data(dict(entry.data), TO_REDACT),
+        "options": dict(entry.options),
+        "server_info": async_redact_data(entry_data.get("server_info", {}), TO_REDACT),
+        "coordinator": {
+            "last_update_success": coordinator.last_update_success,
+            "update_interval": coordinator.update_interval.total_seconds()
+            if coordinator.update_interval
+            else None,
+            "slow_tier_interval": coordinator.slow_tier_interval,
+            "consecutive_failures": coordinator.consecutive_failures,
+            "stale": coordinator.stale,
+            "stale_since": coordinator.stale_since,
+            "shed_level": coordinator.shed_level,
+            "last_error": repr(coordinator.last_error) if coordinator.last_error else None,
+            "things": len(coordinator.data or []),
+        },
+        "metrics": client.metrics.as_dict(),
+        "payloads": coordinator.payloads.as_dict(),
+        "buffers": coordinator.buffers.as_dict() if coordinator.buffers else None,
+        "backfill": entry_data["backfill"].as_dict(),
+        "local_statistics": coordinator.local_statistics.as_dict()
+        if coordinator.local_statistics
+        else None,
+        # Only this entry's slot; the other servers belong to other entries
+        "fleet": hass.data[DOMAIN][DATA_FLEET].slot_as_dict(entry.entry_id),
+    }
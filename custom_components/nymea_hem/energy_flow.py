@@ -0,0 +1,186 @@
+"""Energy flows of the site derived from the meters, producers and batteries."""
+
+from __future__ import annotations
+
+import logging
+from collections.abc import Mapping
+from typing import Any
+
+_LOGGER = logging.getLogger(__name__)
+
+ROLE_GRID = "grid"
+ROLE_PRODUCER = "producer"
+ROLE_STORAGE = "storage"
+
+# Interface -> role, checked in this order so that a producer or battery
+# also implementing the meter interface is not taken for the grid meter.
+# Plain energy meters usually measure single loads and have no role.
+ROLE_INTERFACES = (
+    ("energystorage", ROLE_STORAGE),
+    ("smartmeterproducer", ROLE_PRODUCER),
+    ("smartmeterconsumer", None),
+    ("smartmeter", ROLE_GRID),
+)
+
+POWER_STATE = "currentPower"
+# Nymea power unit -> factor to watts
+POWER_UNITS = {"UnitWatt": 1.0, "UnitKiloWatt": 1000.0}
+
+# Derived values, in watts or percent
+GRID_POWER = "grid_power"
+PRODUCTION_POWER = "production_power"
+BATTERY_POWER = "battery_power"
+HOUSE_LOAD = "house_load"
+SELF_CONSUMPTION = "self_consumption"
+AUTARKY = "autarky"
+
+# Results are rounded so that measurement noise does not cause writes
+PRECISION = 1
+
+
+def _role(interfaces: list[str]) -> str | None:
+    """Return the energy role of a thing with the given interfaces."""
+    interfaces = {str(interface).lower() for interface in interfaces}
+    for interface, role in ROLE_INTERFACES:
+        if interface in interfaces:
+            return role
+    return None
+
+
+def _percent(part: float, total: float) -> float | None:
+    """Return part of total in percent, clamped to 0 to 100."""
+    if total <= 0:
+        return None
+    return round(min(max(part / total * 100, 0.0), 100.0), PRECISION)
+
+
+class EnergyFlow:
+    """Compute grid, production, battery and house flows once per refresh.
+
+    Inputs are identified by interface: producers (smartmeterproducer)
+    report production in either sign and batteries (energystorage) report
+    positive power while charging. Exactly one grid meter reports positive
+    power for import: the thing named or identified by grid_meter, or else
+    the smartmeter with the lowest name.
+    """
+
+    def __init__(self, grid_meter: str | None = None) -> None:
+        """Initialize without inputs."""
+        self.grid_meter = grid_meter
+        self.values: dict[str, float | None] = {}
+        # Role -> number of things feeding it in the last update
+        self.inputs: dict[str, int] = {}
+        # Thing id of the grid meter of the last update
+        self.grid_meter_id: str | None = None
+        # Thing class id -> (role or None, power state type id, factor to watts) or None
+        self._classes: dict[str, tuple[str | None, str, float] | None] = {}
+        # Grid meters the ambiguity warning was logged for
+        self._warned: tuple[str, ...] = ()
+
+    @property
+    def active(self) -> bool:
+        """Return True once a grid meter was found."""
+        return bool(self.inputs.get(ROLE_GRID))
+
+    def update(
+        self,
+        things_by_id: Mapping[str, dict[str, Any]],
+        states: Mapping[tuple[str, str], dict[str, Any]],
+        thing_classes: Mapping[str, dict[str, Any]],
+    ) -> bool:
+        """Recompute the flows; return True if any value changed."""
+        power = {ROLE_GRID: 0.0, ROLE_PRODUCER: 0.0, ROLE_STORAGE: 0.0}
+        inputs: dict[str, int] = {}
+        self.grid_meter_id = self._grid_meter_id(things_by_id, thing_classes)
+        for thing_id, thing in things_by_id.items():
+            source = self._source(thing, thing_classes)
+            if source is None:
+                continue
+            role, state_type_id, factor = source
+            if thing_id == self.grid_meter_id:
+                role = ROLE_GRID
+            elif role in (ROLE_GRID, None):
+                continue
+            state = states.get((thing_id, state_type_id))
+            try:
+                value = float(state["value"]) * factor
+            except (KeyError, TypeError, ValueError):
+                continue
+            power[role] += abs(value) if role == ROLE_PRODUCER else value
+            inputs[role] = inputs.get(role, 0) + 1
+        self.inputs = inputs
+
+        values: dict[str, float | None] = {}
+        if self.active:
+            grid = power[ROLE_GRID]
+            production = power[ROLE_PRODUCER]
+            battery = power[ROLE_STORAGE]
+            house_load = grid + production - battery
+            values = {
+                GRID_POWER: round(grid, PRECISION),
+                PRODUCTION_POWER: round(production, PRECISION)
+                if ROLE_PRODUCER in inputs
+                else None,
+                BATTERY_POWER: round(battery, PRECISION) if ROLE_STORAGE in inputs else None,
+                HOUSE_LOAD: round(max(house_load, 0.0), PRECISION),
+                # Share of the production used on site instead of exported
+                SELF_CONSUMPTION: _percent(production - max(-grid, 0.0), production),
+                # Share of the house load not imported from the grid
+                AUTARKY: _percent(house_load - max(grid, 0.0), house_load),
+            }
+
+        changed = values != self.values
+        self.values = values
+        return changed
+
+    def _grid_meter_id(
+        self,
+        things_by_id: Mapping[str, dict[str, Any]],
+        thing_classes: Mapping[str, dict[str, Any]],
+    ) -> str | None:
+        """Return the id of the one thing used as grid meter."""
+        if self.grid_meter:
+            wanted = self.grid_meter.casefold()
+            for thing_id, thing in things_by_id.items():
+                if wanted in (thing_id.casefold(), str(thing.get("name", "")).casefold()):
+                    return thing_id
+            return None
+
+        meters = sorted(
+            (str(thing.get("name", "")), thing_id)
+            for thing_id, thing in things_by_id.items()
+            if (self._source(thing, thing_classes) or (None,))[0] == ROLE_GRID
+        )
+        if len(meters) > 1 and tuple(name for name, _ in meters) != self._warned:
+            self._warned = tuple(name for name, _ in meters)
+            _LOGGER.warning(
+                "Found %d smart meters (%s), using %s as grid meter; "
+                "pick another one with the grid meter option",
+                len(meters),
+                ", ".join(self._warned),
+                meters[0][0],
+            )
+        return meters[0][1] if meters else None
+
+    def _source(
+        self, thing: dict[str, Any], thing_classes: Mapping[str, dict[str, Any]]
+    ) -> tuple[str | None, str, float] | None:
+        """Return the role and power state of a thing, decided once per class."""
+        thing_class_id = thing.get("thingClassId")
+        if thing_class_id in self._classes:
+            return self._classes[thing_class_id]
+        thing_class = thing_classes.get(thing_class_id)
+        if thing_class is None:
+            # Decide once the thing class is known
+            return None
+
+        # Things without a role are kept, as any of them may be picked as grid meter
+        source = None
+        role = _role(thing.get("interfaces") or thing_class.get("interfaces", []))
+        for state_type in thing_class.get("stateTypes", []):
+            if state_type.get("name") == POWER_STATE and "id" in state_type:
+                factor = POWER_UNITS.get(state_type.get("unit"), 1.0)
+                source = (role, state_type["id"], factor)
+                break
+        self._classes[thing_class_id] = source
+        return source
@@ -0,0 +1,173 @@
+"""Include and exclude rules for Nymea things and states."""
+
+from __future__ import annotations
+
+import fnmatch
+import re
+from collections.abc import Iterable, Mapping
+from typing import Any
+
+from .const import (
+    CONF_EXCLUDE_INTERFACES,
+    CONF_EXCLUDE_STATES,
+    CONF_EXCLUDE_THING_CLASSES,
+    CONF_EXCLUDE_THINGS,
+    CONF_INCLUDE_INTERFACES,
+    CONF_INCLUDE_STATES,
+    CONF_INCLUDE_THING_CLASSES,
+    CONF_INCLUDE_THINGS,
+)
+
+FILTER_OPTIONS = (
+    CONF_INCLUDE_THINGS,
+    CONF_EXCLUDE_THINGS,
+    CONF_INCLUDE_INTERFACES,
+    CONF_EXCLUDE_INTERFACES,
+    CONF_INCLUDE_THING_CLASSES,
+    CONF_EXCLUDE_THING_CLASSES,
+    CONF_INCLUDE_STATES,
+    CONF_EXCLUDE_STATES,
+)
+
+
+def parse_patterns(value: str | Iterable[str] | None) -> tuple[str, ...]:
+    """Split a comma separated option into a tuple of patterns."""
+    if not value:
+        return ()
+    if isinstance(value, str):
+        value = value.split(",")
+    return tuple(pattern.strip() for pattern in value if pattern.strip())
+
+
+def compile_patterns(patterns: tuple[str, ...]) -> re.Pattern | None:
+    """Compile shell-style patterns into one case-insensitive regex."""
+    if not patterns:
+        return None
+    return re.compile(
+        "|".join(fnmatch.translate(pattern) for pattern in patterns), re.IGNORECASE
+    )
+
+
+def _allowed(
+    include: re.Pattern | None, exclude: re.Pattern | None, candidates: list[str]
+) -> bool:
+    """Return True if the candidates pass the include and exclude rules."""
+    if include is not None and not any(include.match(c) for c in candidates):
+        return False
+    if exclude is not None and any(exclude.match(c) for c in candidates):
+        return False
+    return True
+
+
+class ThingFilter:
+    """Drop things and states before they are converted, indexed or published.
+
+    Things match by name or id, interfaces by name, thing classes by id, name
+    or display name, and states by name or display name. Patterns are
+    shell-style wildcards and case-insensitive. Include rules keep only what
+    matches; exclude rules win over include rules.
+    """
+
+    def __init__(self, rules: Mapping[str, Any] | None = None) -> None:
+        """Initialize the filter from option values."""
+        rules = rules or {}
+        self.rules = {key: parse_patterns(rules.get(key)) for key in FILTER_OPTIONS}
+        self._include_things = compile_patterns(self.rules[CONF_INCLUDE_THINGS])
+        self._exclude_things = compile_patterns(self.rules[CONF_EXCLUDE_THINGS])
+        self._include_interfaces = compile_patterns(self.rules[CONF_INCLUDE_INTERFACES])
+        self._exclude_interfaces = compile_patterns(self.rules[CONF_EXCLUDE_INTERFACES])
+        self._include_classes = compile_patterns(self.rules[CONF_INCLUDE_THING_CLASSES])
+        self._exclude_classes = compile_patterns(self.rules[CONF_EXCLUDE_THING_CLASSES])
+        self._include_states = compile_patterns(self.rules[CONF_INCLUDE_STATES])
+        self._exclude_states = compile_patterns(self.rules[CONF_EXCLUDE_STATES])
+        # (thing class id, state type id) -> keep; state names only depend on the class
+        self._state_decisions: dict[tuple[str, str], bool] = {}
+
+    def __eq__(self, other: object) -> bool:
+        """Filters are equal if their rules are."""
+        return isinstance(other, ThingFilter) and self.rules == other.rules
+
+    @property
+    def active(self) -> bool:
+        """Return True if any rule is configured."""
+        return any(self.rules.values())
+
+    def filter_things(
+        self,
+        things: list[dict[str, Any]],
+        thing_classes: Mapping[str, dict[str, Any]],
+    ) -> list[dict[str, Any]]:
+        """Return the things and states that pass the rules."""
+        if not self.active:
+            return things
+
+        filtered = []
+        for thing in things:
+            thing_class_id = thing.get("thingClassId")
+            thing_class = thing_classes.get(thing_class_id) or {}
+            if not self._thing_allowed(thing, thing_class):
+                continue
+            filtered.append(
+                {
+                    **thing,
+                    "states": [
+                        state
+                        for state in thing.get("states", [])
+                        if self._state_allowed(thing_class_id, thing_class, state.get("stateTypeId"))
+                    ],
+                }
+            )
+        return filtered
+
+    def _thing_allowed(self, thing: dict[str, Any], thing_class: dict[str, Any]) -> bool:
+        """Apply the thing, interface and thing class rules."""
+        if not _allowed(
+            self._include_things,
+            self._exclude_things,
+            [str(thing.get("name", "")), str(thing.get("id", ""))],
+        ):
+            return False
+        interfaces = [str(i) for i in thing.get("interfaces") or thing_class.get("interfaces", [])]
+        if not _allowed(self._include_interfaces, self._exclude_interfaces, interfaces):
+            return False
+        return _allowed(
+            self._include_classes,
+            self._exclude_classes,
+            [
+                str(thing.get("thingClassId", "")),
+                str(thing_class.get("name", "")),
+                str(thing_class.get("displayName", "")),
+            ],
+        )
+
+    def _state_allowed(
+        self, thing_class_id: str | None, thing_class: dict[str, Any], state_type_id: str | None
+    ) -> bool:
+        """Apply the state rules, caching the decision per state type."""
+        if self._include_states is None and self._exclude_states is None:
+            return True
+
+        key = (thing_class_id, state_type_id)
+        decision = self._state_decisions.get(key)
+        if decision is not None:
+            return decision
+
+        state_type = next(
+            (
+                state_type
+                for state_type in thing_class.get("stateTypes", [])
+                if state_type.get("id") == state_type_id
+            ),
+            None,
+        )
+        if state_type is None:
+            # Without the thing class the state name is unknown; keep the state
+            return True
+
+        decision = _allowed(
+            self._include_states,
+            self._exclude_states,
+            [str(state_type.get("name", "")), str(state_type.get("displayName", ""))],
+        )
+        self._state_decisions[key] = decision
+        return decision
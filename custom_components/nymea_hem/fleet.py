@@ -0,0 +1,128 @@
+"""Domain-wide coordination of several Nymea servers."""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import ssl
+import time
+from typing import TYPE_CHECKING, Any
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+
+if TYPE_CHECKING:
+    from .coordinator import NymeaUpdateCoordinator
+
+# Connects and handshakes running at the same time across all servers
+MAX_CONCURRENT_HANDSHAKES = 2
+
+
+class NymeaFleet:
+    """Share resources and stagger polls across all Nymea config entries.
+
+    Every entry gets a slot within its poll interval so that servers polled
+    at the same interval are spread evenly instead of firing together. The
+    SSL context, a handshake limiter and thing classes of servers running
+    the same firmware version are shared between entries.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize the fleet."""
+        self._hass = hass
+        self._epoch = time.monotonic()
+        self._coordinators: dict[str, NymeaUpdateCoordinator] = {}
+        self._ssl_context: ssl.SSLContext | None = None
+        self._ssl_lock = asyncio.Lock()
+        self.handshake_limiter = asyncio.Semaphore(MAX_CONCURRENT_HANDSHAKES)
+        # Server version -> thing class id -> thing class details
+        self._thing_classes: dict[str, dict[str, dict[str, Any]]] = {}
+
+    @callback
+    def async_register(
+        self, entry_id: str, coordinator: NymeaUpdateCoordinator
+    ) -> CALLBACK_TYPE:
+        """Add an entry to the fleet and return a callback removing it."""
+        self._coordinators[entry_id] = coordinator
+        coordinator.fleet = self
+        coordinator.client.set_handshake_limiter(self.handshake_limiter)
+
+        @callback
+        def unregister() -> None:
+            self._coordinators.pop(entry_id, None)
+            coordinator.fleet = None
+
+        return unregister
+
+    async def async_get_ssl_context(self) -> ssl.SSLContext:
+        """Return the SSL context shared by all clients."""
+        async with self._ssl_lock:
+            if self._ssl_context is None:
+                self._ssl_context = await self._hass.async_add_executor_job(
+                    _create_ssl_context
+                )
+        return self._ssl_context
+
+    def shared_thing_classes(self, version: str) -> dict[str, dict[str, Any]]:
+        """Return the thing class cache shared by servers of one firmware version."""
+        return self._thing_classes.setdefault(version, {})
+
+    def next_poll_delay(self, coordinator: NymeaUpdateCoordinator, interval: float) -> float:
+        """Return the delay that puts the next poll of coordinator into its slot.
+
+        Entries sharing the same interval are spread evenly over it. The
+        delay is kept between half and one and a half intervals, so a poll
+        is never pulled directly behind the previous one.
+        """
+        peers = self._peers(interval)
+        if len(peers) < 2 or coordinator not in peers or interval <= 0:
+            return interval
+
+        offset = peers.index(coordinator) * interval / len(peers)
+        now = time.monotonic()
+        earliest = now + interval / 2
+        cycles = max(0, math.ceil((earliest - self._epoch - offset) / interval))
+        return self._epoch + offset + cycles * interval - now
+
+    def _peers(self, interval: float) -> list[NymeaUpdateCoordinator]:
+        """Return the coordinators polling at interval, in slot order."""
+        return [
+            peer
+            for peer in self._coordinators.values()
+            if peer.configured_interval_seconds == interval
+        ]
+
+    def slot_as_dict(self, entry_id: str) -> dict[str, Any]:
+        """Return the poll slot and shared cache of one entry, without the other servers."""
+        coordinator = self._coordinators.get(entry_id)
+        if coordinator is None:
+            return {"registered": False}
+        peers = self._peers(coordinator.configured_interval_seconds)
+        version = coordinator.client.server_info.get("version")
+        return {
+            "registered": True,
+            "servers": len(self._coordinators),
+            "poll_slot": peers.index(coordinator),
+            "poll_slots": len(peers),
+            "max_concurrent_handshakes": MAX_CONCURRENT_HANDSHAKES,
+            "shared_thing_classes": len(self._thing_classes.get(version, {})) if version else 0,
+        }
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return health and timing of every server in the fleet."""
+        return {
+            "servers": [
+                coordinator.health() for coordinator in self._coordinators.values()
+            ],
+            "max_concurrent_handshakes": MAX_CONCURRENT_HANDSHAKES,
+            "shared_thing_classes": {
+                version: len(classes) for version, classes in self._thing_classes.items()
+            },
+        }
+
+
+def _create_ssl_context() -> ssl.SSLContext:
+    """Create the SSL context; runs in an executor as it loads certificates."""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
@@ -0,0 +1,153 @@
+"""Admission control for the JSON-RPC requests sent to one Nymea server."""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from .metrics import NymeaMetrics
+
+# Request priorities, lower values are admitted first
+PRIORITY_CONTROL = 0
+PRIORITY_POLL = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {
+    PRIORITY_CONTROL: "control",
+    PRIORITY_POLL: "poll",
+    PRIORITY_BULK: "bulk",
+}
+
+# Methods not listed here are sent with PRIORITY_POLL
+METHOD_PRIORITIES = {
+    "JSONRPC.Hello": PRIORITY_CONTROL,
+    "JSONRPC.Authenticate": PRIORITY_CONTROL,
+    "Integrations.GetThings": PRIORITY_POLL,
+    "Integrations.GetThingState": PRIORITY_POLL,
+    "Integrations.GetThingClasses": PRIORITY_BULK,
+    "Logging.GetLogEntries": PRIORITY_BULK,
+}
+
+# Sustained requests per second and the burst allowed on top; 0 disables the
+# limit, which is the default so only servers known to need it are paced
+DEFAULT_REQUEST_RATE = 0.0
+REQUEST_BURST = 10
+# Responses are not matched by id, so a connection carries one request at a time
+MAX_CONCURRENT_REQUESTS = 1
+
+
+class RequestGovernor:
+    """Token bucket and concurrency limit with priority queueing.
+
+    A request is admitted when a concurrency slot and a token are free.
+    Waiting requests are admitted by priority and in arrival order within
+    a priority, so polls and handshakes overtake queued bulk reads while
+    the server never sees more than the configured rate.
+    """
+
+    def __init__(
+        self,
+        metrics: NymeaMetrics,
+        rate: float = DEFAULT_REQUEST_RATE,
+        burst: int = REQUEST_BURST,
+        concurrency: int = MAX_CONCURRENT_REQUESTS,
+    ) -> None:
+        """Initialize the governor with a full bucket."""
+        self._metrics = metrics
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._active = 0
+        # Heap of (priority, arrival, future) of the waiting requests
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._arrivals = itertools.count()
+        self._wakeup: asyncio.TimerHandle | None = None
+
+    def set_rate(self, rate: float) -> None:
+        """Change the sustained request rate; 0 disables the limit."""
+        self.rate = rate
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_POLL) -> AsyncIterator[None]:
+        """Hold an admitted request slot for the duration of the block."""
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: int) -> None:
+        """Wait until a request of the given priority is admitted."""
+        metrics = self._metrics
+        started = time.monotonic()
+        if not self._waiters and self._admit():
+            metrics.record_queue_wait(PRIORITY_NAMES[priority], 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), future))
+        metrics.queue_depth += 1
+        metrics.max_queue_depth = max(metrics.max_queue_depth, metrics.queue_depth)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted right before the cancellation
+                self.release()
+            else:
+                future.cancel()
+            raise
+        finally:
+            metrics.queue_depth -= 1
+        metrics.record_queue_wait(PRIORITY_NAMES[priority], time.monotonic() - started)
+
+    def release(self) -> None:
+        """Free the slot of a finished request."""
+        self._active -= 1
+        self._dispatch()
+
+    def _admit(self) -> bool:
+        """Take a concurrency slot and a token if both are available."""
+        if self._active >= self.concurrency:
+            return False
+        if self.rate > 0:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+        self._active += 1
+        return True
+
+    def _dispatch(self) -> None:
+        """Admit waiting requests in priority order while capacity is left."""
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if not self._admit():
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+
+        if self._waiters and self._active < self.concurrency and self._wakeup is None:
+            # Out of tokens: retry once the next token is due
+            self._metrics.rate_limit_waits += 1
+            self._wakeup = asyncio.get_running_loop().call_later(
+                (1 - self._tokens) / self.rate, self._refill_due
+            )
+
+    def _refill_due(self) -> None:
+        """Admit waiters after the bucket refilled."""
+        self._wakeup = None
+        self._dispatch()
@@ -0,0 +1,42 @@
+"""Hand a validated config flow connection over to the entry setup."""
+
+from __future__ import annotations
+
+import logging
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+from .const import DATA_HANDOFF, DOMAIN, HANDOFF_TIMEOUT
+from .nymea_client import NymeaClient
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@callback
+def hand_off_client(hass: HomeAssistant, unique_id: str, client: NymeaClient) -> None:
+    """Park an authenticated client until the entry with unique_id is set up.
+
+    The connection is closed if no setup claims it within HANDOFF_TIMEOUT.
+    """
+    pending = hass.data.setdefault(DOMAIN, {}).setdefault(DATA_HANDOFF, {})
+    if (previous := pending.pop(unique_id, None)) is not None:
+        hass.async_create_task(previous.close_connection())
+    pending[unique_id] = client
+
+    @callback
+    def _async_expire(_now) -> None:
+        if pending.get(unique_id) is client:
+            _LOGGER.debug("Closing unclaimed connection of %s", unique_id)
+            del pending[unique_id]
+            hass.async_create_task(client.close_connection())
+
+    async_call_later(hass, HANDOFF_TIMEOUT, _async_expire)
+
+
+@callback
+def claim_client(hass: HomeAssistant, unique_id: str | None) -> NymeaClient | None:
+    """Return the parked client of an entry, if there is one."""
+    if unique_id is None:
+        return None
+    return hass.data.get(DOMAIN, {}).get(DATA_HANDOFF, {}).pop(unique_id, None)
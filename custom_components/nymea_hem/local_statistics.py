@@ -0,0 +1,267 @@
+"""Long-term statistics computed in memory instead of by the recorder."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any
+
+from homeassistant.components.recorder import get_instance
+from homeassistant.components.recorder.models import StatisticData, StatisticMetaData
+from homeassistant.components.recorder.statistics import (
+    async_add_external_statistics,
+    get_last_statistics,
+)
+from homeassistant.components.sensor import SensorStateClass
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_track_utc_time_change
+from homeassistant.util import dt as dt_util, slugify
+
+from .const import DOMAIN
+
+if TYPE_CHECKING:
+    from .coordinator import NymeaUpdateCoordinator
+
+_LOGGER = logging.getLogger(__name__)
+
+HOUR = 3600
+# Sensors with local statistics publish their state at most this often, in seconds
+LOCAL_STATISTICS_WRITE_INTERVAL = 300
+
+
+class HourlyAccumulator:
+    """Accumulate a step function into hourly time-weighted aggregates.
+
+    Each value holds until the next one; None marks the value as unknown,
+    and unknown time is left out of the aggregates.
+    """
+
+    __slots__ = ("_hour", "_time", "_value", "_last", "_weighted", "_covered", "_low", "_high")
+
+    def __init__(self) -> None:
+        """Initialize an empty accumulator."""
+        self._hour: int | None = None
+        self._time = 0.0
+        self._value: float | None = None
+        # Last known value, kept while the value is unknown
+        self._last: float | None = None
+        self._weighted = 0.0
+        self._covered = 0.0
+        self._low: float | None = None
+        self._high: float | None = None
+
+    def add(
+        self, timestamp: float, value: float | None
+    ) -> list[tuple[int, float, float, float, float]]:
+        """Add a sample and return the hours it completed."""
+        completed = self.advance(timestamp)
+        if self._hour is None:
+            self._hour = int(timestamp - timestamp % HOUR)
+            self._time = timestamp
+        self._value = value
+        if value is not None:
+            self._last = value
+        return completed
+
+    def advance(self, timestamp: float) -> list[tuple[int, float, float, float, float]]:
+        """Integrate up to timestamp and return (hour, mean, min, max, last) per completed hour."""
+        completed = []
+        if self._hour is None:
+            return completed
+        while timestamp >= self._hour + HOUR:
+            self._integrate(self._hour + HOUR)
+            if self._covered:
+                completed.append(
+                    (self._hour, self._weighted / self._covered, self._low, self._high, self._last)
+                )
+            self._hour += HOUR
+            self._weighted = self._covered = 0.0
+            self._low = self._high = None
+        self._integrate(timestamp)
+        return completed
+
+    def _integrate(self, timestamp: float) -> None:
+        """Add the current value from the last integration up to timestamp."""
+        if self._value is not None and timestamp > self._time:
+            self._weighted += self._value * (timestamp - self._time)
+            self._covered += timestamp - self._time
+            self._low = self._value if self._low is None else min(self._low, self._value)
+            self._high = self._value if self._high is None else max(self._high, self._value)
+        self._time = max(self._time, timestamp)
+
+
+class _Series:
+    """Statistic of one Nymea state."""
+
+    __slots__ = ("metadata", "accumulator", "has_sum", "sum", "last_state", "pending")
+
+    def __init__(self, metadata: StatisticMetaData, has_sum: bool) -> None:
+        self.metadata = metadata
+        self.accumulator = HourlyAccumulator()
+        self.has_sum = has_sum
+        # Running sum and state of the last written hour, loaded before the first write
+        self.sum: float | None = None
+        self.last_state: float | None = None
+        self.pending: list[tuple[int, float, float, float, float]] = []
+
+
+class LocalStatistics:
+    """Compute hourly statistics of Nymea states and write them as external statistics.
+
+    The recorder then neither stores every polled value nor compiles
+    statistics from them: sensors in this mode have no state class and
+    publish their state at most every LOCAL_STATISTICS_WRITE_INTERVAL.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry: ConfigEntry,
+        coordinator: NymeaUpdateCoordinator,
+    ) -> None:
+        """Initialize the statistics."""
+        self._hass = hass
+        self._entry = entry
+        self._coordinator = coordinator
+        self._series: dict[tuple[str, str], _Series] = {}
+        self._write_lock = asyncio.Lock()
+        self.statistics_written = 0
+
+    @callback
+    def async_register(
+        self,
+        key: tuple[str, str],
+        name: str,
+        unit: str | None,
+        state_class: SensorStateClass,
+    ) -> str:
+        """Start accumulating a state and return its statistic id."""
+        series = self._series.get(key)
+        if series is None:
+            has_sum = state_class != SensorStateClass.MEASUREMENT
+            statistic_id = f"{DOMAIN}:{slugify(f'{key[0]}_{key[1]}')}"
+            series = self._series[key] = _Series(
+                StatisticMetaData(
+                    has_mean=not has_sum,
+                    has_sum=has_sum,
+                    name=name,
+                    source=DOMAIN,
+                    statistic_id=statistic_id,
+                    unit_of_measurement=unit,
+                ),
+                has_sum,
+            )
+        return series.metadata["statistic_id"]
+
+    @callback
+    def async_start(self) -> CALLBACK_TYPE:
+        """Sample every refresh and write completed hours; return a stop callback."""
+        remove_listener = self._coordinator.async_add_listener(self._async_sample)
+        # A few seconds past the hour, so the last samples of the hour are in
+        remove_timer = async_track_utc_time_change(
+            self._hass, self._async_hour_passed, minute=0, second=10
+        )
+
+        @callback
+        def stop() -> None:
+            remove_listener()
+            remove_timer()
+
+        return stop
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the state of the local statistics."""
+        return {
+            "statistics": len(self._series),
+            "statistics_written": self.statistics_written,
+        }
+
+    @callback
+    def _async_sample(self) -> None:
+        """Add the values of the latest refresh."""
+        if not self._coordinator.last_update_success or self._coordinator.stale:
+            values: dict[tuple[str, str], Any] = {}
+        else:
+            values = self._coordinator.states
+        now = time.time()
+        completed = False
+        for key, series in self._series.items():
+            state = values.get(key)
+            try:
+                value = float(state["value"]) if state is not None else None
+            except (KeyError, TypeError, ValueError):
+                value = None
+            hours = series.accumulator.add(now, value)
+            if hours:
+                series.pending.extend(hours)
+                completed = True
+        if completed:
+            self._async_schedule_write()
+
+    @callback
+    def _async_hour_passed(self, now) -> None:
+        """Close the past hour even if no refresh arrived since."""
+        timestamp = now.timestamp()
+        completed = False
+        for series in self._series.values():
+            hours = series.accumulator.advance(timestamp)
+            if hours:
+                series.pending.extend(hours)
+                completed = True
+        if completed:
+            self._async_schedule_write()
+
+    @callback
+    def _async_schedule_write(self) -> None:
+        """Write the completed hours in a task cancelled when the entry is unloaded."""
+        self._entry.async_create_background_task(
+            self._hass,
+            self._async_write(),
+            name=f"{DOMAIN}_local_statistics_{self._entry.entry_id}",
+        )
+
+    async def _async_write(self) -> None:
+        """Write the completed hours, one batch per statistic."""
+        async with self._write_lock:
+            for series in self._series.values():
+                if not series.pending:
+                    continue
+                hours, series.pending = series.pending, []
+                if series.has_sum and series.sum is None:
+                    await self._async_load_sum(series)
+                statistics = [self._statistic(series, *hour) for hour in hours]
+                async_add_external_statistics(self._hass, series.metadata, statistics)
+                self.statistics_written += len(statistics)
+
+    @staticmethod
+    def _statistic(
+        series: _Series, hour: int, mean: float, low: float, high: float, last: float
+    ) -> StatisticData:
+        """Return the statistic of one hour, advancing the running sum."""
+        start = dt_util.utc_from_timestamp(hour)
+        if not series.has_sum:
+            return StatisticData(start=start, mean=mean, min=low, max=high)
+        if series.last_state is None:
+            series.last_state = last
+        elif last < series.last_state:
+            # The meter was reset
+            series.sum += last
+        else:
+            series.sum += last - series.last_state
+        series.last_state = last
+        return StatisticData(start=start, state=last, sum=series.sum)
+
+    async def _async_load_sum(self, series: _Series) -> None:
+        """Continue the sum of a statistic from its last written hour."""
+        statistic_id = series.metadata["statistic_id"]
+        last = await get_instance(self._hass).async_add_executor_job(
+            get_last_statistics, self._hass, 1, statistic_id, True, {"state", "sum"}
+        )
+        rows = last.get(statistic_id)
+        if rows and rows[0].get("sum") is not None:
+            series.sum = rows[0]["sum"]
+            series.last_state = rows[0].get("state")
+        else:
+            series.sum = 0.0
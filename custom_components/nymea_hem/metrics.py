@@ -0,0 +1,262 @@
+"""Performance metrics for the Nymea HEM integration."""
+
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+# Upper bounds of the latency histogram buckets in milliseconds
+LATENCY_BUCKETS_MS: tuple[float, ...] = (
+    5,
+    10,
+    25,
+    50,
+    100,
+    250,
+    500,
+    1000,
+    2500,
+    5000,
+    10000,
+)
+
+# Spans kept in a startup timeline; chunked entity registration adds many
+MAX_STARTUP_SPANS = 200
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of durations."""
+
+    def __init__(self) -> None:
+        """Initialize an empty histogram."""
+        # One extra bucket collects everything above the last bound
+        self._buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+        self.last: float | None = None
+
+    def record(self, seconds: float) -> None:
+        """Record a duration given in seconds."""
+        millis = seconds * 1000
+        self._buckets[bisect_left(LATENCY_BUCKETS_MS, millis)] += 1
+        self.count += 1
+        self.total += millis
+        self.last = millis
+        if self.min is None or millis < self.min:
+            self.min = millis
+        if self.max is None or millis > self.max:
+            self.max = millis
+
+    @property
+    def mean(self) -> float | None:
+        """Return the mean duration in milliseconds."""
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return a serializable representation in milliseconds."""
+        buckets = {
+            f"le_{bound:g}ms": count
+            for bound, count in zip(LATENCY_BUCKETS_MS, self._buckets)
+        }
+        buckets["gt_last"] = self._buckets[-1]
+        return {
+            "count": self.count,
+            "mean_ms": _round(self.mean),
+            "min_ms": _round(self.min),
+            "max_ms": _round(self.max),
+            "last_ms": _round(self.last),
+            "buckets": buckets,
+        }
+
+
+class StartupTrace:
+    """Timeline of the phases of an entry setup on the monotonic clock.
+
+    Spans are collected until the trace is finished, so reconnects and
+    refreshes after startup do not end up in the timeline.
+    """
+
+    def __init__(self) -> None:
+        """Start the trace."""
+        self.started = time.monotonic()
+        self.finished: float | None = None
+        self._spans: list[tuple[str, float, float]] = []
+        # Phase -> total duration in seconds over all its spans
+        self._totals: dict[str, float] = {}
+        self.dropped = 0
+
+    @property
+    def active(self) -> bool:
+        """Return True until the trace is finished."""
+        return self.finished is None
+
+    @contextmanager
+    def span(self, phase: str) -> Iterator[None]:
+        """Record the duration of the enclosed block as a span of phase."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(phase, started, time.monotonic())
+
+    def add(self, phase: str, started: float, finished: float) -> None:
+        """Record a span given by its monotonic start and end."""
+        if not self.active:
+            return
+        self._totals[phase] = self._totals.get(phase, 0.0) + finished - started
+        if len(self._spans) >= MAX_STARTUP_SPANS:
+            self.dropped += 1
+            return
+        self._spans.append((phase, started, finished))
+
+    def finish(self) -> None:
+        """Stop collecting spans."""
+        if self.active:
+            self.finished = time.monotonic()
+
+    def summary(self) -> str:
+        """Return the total and the per-phase durations as one line."""
+        total = ((self.finished or time.monotonic()) - self.started) * 1000
+        phases = ", ".join(
+            f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self._totals.items()
+        )
+        return f"{total:.0f} ms ({phases})"
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the timeline in milliseconds since the start of the entry setup."""
+        finished = self.finished or time.monotonic()
+        return {
+            "finished": not self.active,
+            "total_ms": _round((finished - self.started) * 1000),
+            "phases": {
+                phase: _round(seconds * 1000) for phase, seconds in self._totals.items()
+            },
+            "timeline": [
+                {
+                    "phase": phase,
+                    "start_ms": _round((started - self.started) * 1000),
+                    "duration_ms": _round((ended - started) * 1000),
+                }
+                for phase, started, ended in self._spans
+            ],
+            "dropped_spans": self.dropped,
+        }
+
+
+class NymeaMetrics:
+    """Collect timing and traffic figures for one Nymea server."""
+
+    def __init__(self) -> None:
+        """Initialize all counters."""
+        self.rpc_latency: dict[str, LatencyHistogram] = {}
+        self.rpc_errors: dict[str, int] = {}
+        self.parse_time = LatencyHistogram()
+        self.refresh_duration = LatencyHistogram()
+        # Bytes on the wire and bytes of the JSON payloads before compression
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.payload_bytes_out = 0
+        self.payload_bytes_in = 0
+        self.compression: str | None = None
+        # False while the transport only sees payloads, not its frames
+        self.wire_bytes_measured = True
+        self.connects = 0
+        self.refresh_failures = 0
+        self.refresh_overruns = 0
+        self.merged_refreshes = 0
+        # Work -> number of refreshes in which it was shed
+        self.shed_work: dict[str, int] = {}
+        # Requests waiting for admission by the governor, now and at most
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        # Priority -> time requests waited for admission
+        self.queue_wait: dict[str, LatencyHistogram] = {}
+        # Times waiting requests ran out of tokens
+        self.rate_limit_waits = 0
+        self.state_writes = 0
+        self.suppressed_writes = 0
+        self.deferred_writes = 0
+        self.startup = StartupTrace()
+
+    @property
+    def reconnects(self) -> int:
+        """Return how often the connection had to be re-established."""
+        return max(self.connects - 1, 0)
+
+    def record_rpc(self, method: str, seconds: float) -> None:
+        """Record the round-trip time of a JSON-RPC call."""
+        histogram = self.rpc_latency.get(method)
+        if histogram is None:
+            histogram = self.rpc_latency[method] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def record_rpc_error(self, method: str) -> None:
+        """Record a failed JSON-RPC call."""
+        self.rpc_errors[method] = self.rpc_errors.get(method, 0) + 1
+
+    @property
+    def compression_ratio(self) -> float | None:
+        """Return the received payload bytes per byte on the wire."""
+        if not self.bytes_in or not self.wire_bytes_measured:
+            return None
+        return self.payload_bytes_in / self.bytes_in
+
+    def record_queue_wait(self, priority: str, seconds: float) -> None:
+        """Record how long a request waited for admission."""
+        histogram = self.queue_wait.get(priority)
+        if histogram is None:
+            histogram = self.queue_wait[priority] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def record_shed(self, work: str) -> None:
+        """Record that low-priority work was skipped in a refresh."""
+        self.shed_work[work] = self.shed_work.get(work, 0) + 1
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return a serializable snapshot of all metrics."""
+        return {
+            "rpc_latency": {
+                method: histogram.as_dict()
+                for method, histogram in self.rpc_latency.items()
+            },
+            "rpc_errors": dict(self.rpc_errors),
+            "parse_time": self.parse_time.as_dict(),
+            "refresh_duration": self.refresh_duration.as_dict(),
+            "refresh_failures": self.refresh_failures,
+            "refresh_overruns": self.refresh_overruns,
+            "merged_refreshes": self.merged_refreshes,
+            "shed_work": dict(self.shed_work),
+            "request_queue": {
+                "depth": self.queue_depth,
+                "max_depth": self.max_queue_depth,
+                "rate_limit_waits": self.rate_limit_waits,
+                "wait": {
+                    priority: histogram.as_dict()
+                    for priority, histogram in self.queue_wait.items()
+                },
+            },
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "payload_bytes_out": self.payload_bytes_out,
+            "payload_bytes_in": self.payload_bytes_in,
+            "compression": self.compression,
+            "compression_ratio": _round(self.compression_ratio),
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "state_writes": self.state_writes,
+            "suppressed_writes": self.suppressed_writes,
+            "deferred_writes": self.deferred_writes,
+            "startup": self.startup.as_dict(),
+        }
+
+
+def _round(value: float | None) -> float | None:
+    """Round a millisecond value for display."""
+    return None if value is None else round(value, 2)
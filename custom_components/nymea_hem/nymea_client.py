@@ -1,52 +1,117 @@
 import asyncio
+import contextlib
 import json
 import ssl
 import logging
+import time
 from typing import Optional, Dict, Any
 
-_LOGGER = logging.getLogger(__name__)
+import aiohttp
 
+from .governor import METHOD_PRIORITIES, PRIORITY_CONTROL, PRIORITY_POLL, RequestGovernor
+from .metrics import NymeaMetrics
+from .transport import (
+    DEFAULT_TRANSPORT,
+    TRANSPORT_WEBSOCKET,
+    NymeaTransport,
+    TcpTransport,
+    WebSocketTransport,
+)
 
-@property
-def server_info(self) -> dict[str, Any]:
-    """Return cached server info from handshake."""
-    return getattr(self, "_server_info", {})
+_LOGGER = logging.getLogger(__name__)
 
 
 class NymeaClient:
     """Client for Nymea HEM JSON-RPC communication."""
 
-    def __init__(self, host: str, port: int, username: str, password: str, ssl_enabled: bool = True):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        ssl_enabled: bool = True,
+        token: Optional[str] = None,
+        transport: str = DEFAULT_TRANSPORT,
+        session: Optional[aiohttp.ClientSession] = None,
+    ):
         self._host = host
         self._port = port
         self._username = username
         self._password = password
         self._ssl_enabled = ssl_enabled
-        self._token = None
-        self._reader = None
-        self._writer = None
+        self._token = token
+        self._transport_type = transport
+        # Home Assistant's shared session, used by the WebSocket transport
+        self._session = session
+        self._transport: Optional[NymeaTransport] = None
         self._connection_timeout = 10  # seconds
         self._read_timeout = 15  # seconds
+        self.metrics = NymeaMetrics()
+        # Admits one request at a time by priority, within the server's rate limit
+        self.governor = RequestGovernor(self.metrics)
+        self._capture = None
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        self._handshake_limiter = contextlib.nullcontext()
+
+    @property
+    def server_info(self) -> dict[str, Any]:
+        """Return cached server info from handshake."""
+        return getattr(self, "_server_info", {})
+
+    def set_ssl_context(self, ssl_context: ssl.SSLContext) -> None:
+        """Use a shared SSL context instead of creating one per connection."""
+        self._ssl_context = ssl_context
+
+    def set_handshake_limiter(self, limiter) -> None:
+        """Limit concurrent connects and handshakes with a shared semaphore."""
+        self._handshake_limiter = limiter
+
+    def set_request_rate(self, rate: float) -> None:
+        """Limit the requests per second sent to the server; 0 disables the limit."""
+        self.governor.set_rate(rate)
+
+    def set_timeouts(self, connection_timeout: float, read_timeout: float) -> None:
+        """Change the timeouts; they apply from the next connect or read."""
+        self._connection_timeout = connection_timeout
+        self._read_timeout = read_timeout
+
+    @property
+    def token(self) -> Optional[str]:
+        """Return the session token, if authenticated."""
+        return self._token
 
     def is_connected(self) -> bool:
         """Check if the connection is currently active."""
-        if not self._reader or not self._writer:
-            _LOGGER.debug("Connection check: No reader/writer")
+        if self._transport is None:
+            _LOGGER.debug("Connection check: No transport")
             return False
-        
-        if self._writer.is_closing():
-            _LOGGER.debug("Connection check: Writer is closed")
+
+        if self._transport.is_closing():
+            _LOGGER.debug("Connection check: Transport is closed")
             return False
-            
+
         return True
 
     async def _create_ssl_context(self) -> ssl.SSLContext:
         """Create SSL context for secure connection."""
+        if self._ssl_context is not None:
+            return self._ssl_context
         context = ssl.create_default_context()
         context.check_hostname = False
         context.verify_mode = ssl.CERT_NONE
         return context
 
+    async def _create_transport(self, ssl_context) -> NymeaTransport:
+        """Create the transport configured for this client."""
+        if self._transport_type == TRANSPORT_WEBSOCKET:
+            if self._session is None:
+                raise ConnectionError("The WebSocket transport needs an aiohttp session")
+            return WebSocketTransport(
+                self.metrics, self._session, self._host, self._port, ssl_context
+            )
+        return TcpTransport(self.metrics, self._host, self._port, ssl_context)
+
     async def _connect(self):
         """Establish connection with SSL/TLS or plain socket."""
         if self.is_connected():
@@ -56,20 +121,25 @@ class NymeaClient:
         ssl_context = await self._create_ssl_context() if self._ssl_enabled else None
         try:
             _LOGGER.debug(
-                "Attempting to connect to %s:%d (SSL: %s)",
+                "Attempting to connect to %s:%d (SSL: %s, transport: %s)",
                 self._host,
                 self._port,
-                self._ssl_enabled
+                self._ssl_enabled,
+                self._transport_type
             )
             
-            self._reader, self._writer = await asyncio.wait_for(
-                asyncio.open_connection(
-                    self._host,
-                    self._port,
-                    ssl=ssl_context
-                ),
-                timeout=self._connection_timeout
-            )
+            transport = await self._create_transport(ssl_context)
+            # Connects count against the rate limit, so reconnect storms are paced
+            async with self.governor.slot(PRIORITY_CONTROL):
+                with self.metrics.startup.span("tls_connect" if ssl_context else "connect"):
+                    await asyncio.wait_for(
+                        transport.open(),
+                        timeout=self._connection_timeout
+                    )
+            self._transport = transport
+            self.metrics.compression = transport.compression
+            self.metrics.wire_bytes_measured = transport.measures_wire_bytes
+            self.metrics.connects += 1
             _LOGGER.info("Successfully connected to %s:%d", self._host, self._port)
             
         except asyncio.TimeoutError as e:
@@ -94,26 +164,11 @@ class NymeaClient:
             _LOGGER.error("Unexpected connection error: %s", e)
             raise
 
-    async def _read_full_response(self) -> str:
-        """Read a full JSON response from the reader."""
-        buffer = ""
+    async def _read_full_response(self) -> bytes:
+        """Read a full JSON response from the transport."""
         try:
-            while True:
-                chunk = await asyncio.wait_for(
-                    self._reader.read(4096),
-                    timeout=self._read_timeout
-                )
-                if not chunk:
-                    _LOGGER.warning("Connection closed by server")
-                    raise ConnectionError("Connection closed by remote host")
-                    
-                buffer += chunk.decode()
-                try:
-                    json.loads(buffer)  # Validate if JSON is complete
-                    return buffer
-                except json.JSONDecodeError:
-                    continue
-                    
+            return await self._transport.receive(self._read_timeout)
+
         except asyncio.TimeoutError as e:
             _LOGGER.error("Read timeout after %d seconds", self._read_timeout)
             raise ConnectionError("Read timeout from server") from e
@@ -124,6 +179,44 @@ class NymeaClient:
             _LOGGER.error("Error reading response: %s", e)
             raise ConnectionError(f"Failed to read response: {e}") from e
 
+    async def _send_request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Send a JSON-RPC message and return the decoded response."""
+        method = message.get("method", "unknown")
+        payload = json.dumps(message).encode()
+        try:
+            async with self.governor.slot(METHOD_PRIORITIES.get(method, PRIORITY_POLL)):
+                if self._transport is None:
+                    raise ConnectionError("Connection closed while waiting to send")
+                started = time.monotonic()
+                await self._transport.send(payload)
+                response = await self._read_full_response()
+        except Exception:
+            self.metrics.record_rpc_error(method)
+            raise
+
+        parse_started = time.monotonic()
+        data = json.loads(response)
+        finished = time.monotonic()
+        self.metrics.parse_time.record(finished - parse_started)
+        self.metrics.record_rpc(method, finished - started)
+        if self._capture is not None:
+            self._capture.record(message, data, started, finished - started)
+        return data
+
+    @property
+    def capturing(self) -> bool:
+        """Return True while exchanges are being captured."""
+        return self._capture is not None
+
+    def start_capture(self, capture) -> None:
+        """Record every following exchange into the given capture."""
+        self._capture = capture
+
+    def stop_capture(self):
+        """Stop recording and return the capture."""
+        capture, self._capture = self._capture, None
+        return capture
+
     async def _handshake(self):
         """Perform the JSONRPC.Hello handshake."""
         await self._connect()
@@ -137,11 +230,9 @@ class NymeaClient:
             hello_message["token"] = self._token
 
         try:
-            self._writer.write((json.dumps(hello_message) + "\n").encode())
-            await self._writer.drain()
-            hello_response = await self._read_full_response()
+            with self.metrics.startup.span("hello"):
+                response_data = await self._send_request(hello_message)
             _LOGGER.debug("Hello Response received")
-            response_data = json.loads(hello_response)
 
             if response_data.get("status") != "success":
                 error = response_data.get("error", "Unknown error")
@@ -172,29 +263,44 @@ class NymeaClient:
             raise
 
 
+    async def connect(self):
+        """Connect and reuse the session token if one is known.
+
+        Only runs the Authenticate call when no token is available. A token
+        the server no longer accepts is replaced on the first request.
+        """
+        if self.is_connected() and self._token:
+            return
+        async with self._handshake_limiter:
+            if not self._token:
+                await self._authenticate()
+                return
+            await self._handshake()
+
     async def authenticate(self):
         """Authenticate and establish session."""
+        async with self._handshake_limiter:
+            await self._authenticate()
+
+    async def _authenticate(self):
+        """Run connect, Hello and Authenticate."""
         try:
             _LOGGER.debug("Starting authentication process")
             await self._connect()
             await self._handshake()
 
-            auth_message = json.dumps({
-                "id": 2,
-                "method": "JSONRPC.Authenticate",
-                "params": {
-                    "username": self._username,
-                    "password": self._password,
-                    "deviceName": "HomeAssistant"
-                }
-            }) + "\n"
-            
-            self._writer.write(auth_message.encode())
-            await self._writer.drain()
-            auth_response = await self._read_full_response()
+            with self.metrics.startup.span("authenticate"):
+                auth_data = await self._send_request({
+                    "id": 2,
+                    "method": "JSONRPC.Authenticate",
+                    "params": {
+                        "username": self._username,
+                        "password": self._password,
+                        "deviceName": "HomeAssistant"
+                    }
+                })
             _LOGGER.debug("Authentication response received")
 
-            auth_data = json.loads(auth_response)
             if not auth_data.get("params", {}).get("success", False):
                 _LOGGER.error("Authentication failed: Invalid credentials or server error")
                 raise ValueError("Authentication failed.")
@@ -208,29 +314,17 @@ class NymeaClient:
             raise
         
     async def close_connection(self):
-        """Close the writer connection gracefully, with fallback to forceful closure."""
-        if self._writer:
-            try:
-                self._writer.close()
-                await self._writer.wait_closed()
-                _LOGGER.debug("Connection closed cleanly.")
-            except Exception as e:
-                _LOGGER.debug("Error during clean close: %s", e)
-                try:
-                    self._writer.transport.abort()
-                    _LOGGER.debug("Connection forcefully closed.")
-                except Exception as inner_e:
-                    _LOGGER.debug("Error during force close: %s", inner_e)
-            finally:
-                self._reader = None
-                self._writer = None
+        """Close the connection gracefully, with fallback to forceful closure."""
+        transport, self._transport = self._transport, None
+        if transport is not None:
+            await transport.close()
 
     async def _ensure_authenticated(self):
         """Ensure the connection is established and authenticated."""
         try:
             if not self.is_connected():
-                _LOGGER.debug("No active connection. Re-authenticating...")
-                await self.authenticate()
+                _LOGGER.debug("No active connection. Reconnecting...")
+                await self.connect()
             elif not self._token:
                 _LOGGER.debug("No valid token. Re-authenticating...")
                 await self.authenticate()
@@ -239,25 +333,27 @@ class NymeaClient:
             await self.close_connection()
             raise
 
-    async def get_things(self):
-        """Retrieve all Nymea things/devices."""
+    async def _send_authorized_request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Send a request with the session token, re-authenticating once if it was rejected."""
         await self._ensure_authenticated()
+        data = await self._send_request({**message, "token": self._token})
+        if data.get("status") == "unauthorized":
+            _LOGGER.info("Session token rejected by server, re-authenticating")
+            self._token = None
+            await self.authenticate()
+            data = await self._send_request({**message, "token": self._token})
+        return data
 
+    async def get_things(self):
+        """Retrieve all Nymea things/devices."""
         try:
-            get_things_message = json.dumps({
-                "id": 3,
-                "method": "Integrations.GetThings",
-                "token": self._token
-            }) + "\n"
-            
-            self._writer.write(get_things_message.encode())
-            await self._writer.drain()
-            things_response = await self._read_full_response()
-            _LOGGER.debug("Things response received")
-
-            things_data = json.loads(things_response)
+            with self.metrics.startup.span("get_things"):
+                things_data = await self._send_authorized_request({
+                    "id": 3,
+                    "method": "Integrations.GetThings",
+                })
             devices = things_data.get("params", {}).get("things", [])
-            _LOGGER.info("Retrieved %d devices from Nymea", len(devices))
+            _LOGGER.debug("Retrieved %d devices from Nymea", len(devices))
             return devices
             
         except ConnectionError as e:
@@ -277,24 +373,27 @@ class NymeaClient:
         :param thing_class_id: UUID of the thing class.
         :return: Dictionary containing the thing class details.
         """
-        await self._ensure_authenticated()
+        return await self.get_thing_classes([thing_class_id])
+
+    async def get_thing_classes(self, thing_class_ids):
+        """
+        Fetch the details of several thing classes in one request.
 
+        :param thing_class_ids: UUIDs of the thing classes.
+        :return: List of thing class detail dictionaries.
+        """
         request = {
             "id": 5,  # Unique ID for the request
             "method": "Integrations.GetThingClasses",
             "params": {
-                "thingClassIds": [thing_class_id]
+                "thingClassIds": list(thing_class_ids)
             },
-            "token": self._token
         }
 
         try:
-            self._writer.write((json.dumps(request) + "\n").encode())
-            await self._writer.drain()
-            response = await self._read_full_response()
+            data = await self._send_authorized_request(request)
             _LOGGER.debug("Thing class details response received")
 
-            data = json.loads(response)
             if data.get("status") == "success":
                 return data.get("params", {}).get("thingClasses", [])
             else:
@@ -306,5 +405,43 @@ class NymeaClient:
             raise
             
         except Exception as e:
-            _LOGGER.error("Error in get_thing_class_details: %s", e)
+            _LOGGER.error("Error in get_thing_classes: %s", e)
+            raise
+
+    async def get_log_entries(self, thing_ids, start, end, limit, offset=0):
+        """
+        Fetch one page of state log entries.
+
+        :param thing_ids: UUIDs of the things whose state changes are returned.
+        :param start: Start of the period as unix timestamp in seconds.
+        :param end: End of the period as unix timestamp in seconds.
+        :param limit: Maximum number of entries in the page.
+        :param offset: Number of entries to skip.
+        :return: Tuple of the log entries and the total number of matching entries.
+        """
+        request = {
+            "id": 6,
+            "method": "Logging.GetLogEntries",
+            "params": {
+                "loggingSources": ["LoggingSourceStates"],
+                "thingIds": list(thing_ids),
+                "timeFilters": [{"startDate": int(start), "endDate": int(end)}],
+                "limit": limit,
+                "offset": offset,
+            },
+        }
+
+        try:
+            data = await self._send_authorized_request(request)
+
+            if data.get("status") == "success":
+                params = data.get("params", {})
+                entries = params.get("logEntries", [])
+                return entries, params.get("count", len(entries))
+            else:
+                raise ValueError(f"Error fetching log entries: {data.get('error')}")
+
+        except ConnectionError as e:
+            _LOGGER.error("Connection error while fetching log entries: %s", e)
+            await self.close_connection()
             raise
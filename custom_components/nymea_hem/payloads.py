@@ -0,0 +1,92 @@
+"""Content-addressed storage of state values too large for an entity state."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from collections.abc import Hashable
+from typing import Any
+
+# Home Assistant rejects longer entity states
+MAX_STATE_LENGTH = 255
+
+
+def is_large_value(value: Any) -> bool:
+    """Return True if a converted state value cannot be an entity state."""
+    if isinstance(value, (dict, list, tuple, set)):
+        return True
+    return isinstance(value, str) and len(value) > MAX_STATE_LENGTH
+
+
+def _encode(value: Any) -> bytes:
+    """Return the canonical bytes a payload is hashed and sized by."""
+    if isinstance(value, str):
+        return value.encode()
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode()
+
+
+class PayloadStore:
+    """Keep large state values once per content hash.
+
+    Entities expose the hash and size instead of the value, so unchanged
+    payloads are neither written to the state machine nor recorded again.
+    A value equal to the one stored for its state is not hashed again, and
+    a payload is dropped once no state refers to it anymore.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty store."""
+        # Digest -> (payload, size in bytes, number of states referring to it)
+        self._payloads: dict[str, tuple[Any, int, int]] = {}
+        # State key -> digest of its current value
+        self._digests: dict[Hashable, str] = {}
+        self.hashed = 0
+
+    def put(self, key: Hashable, value: Any) -> str:
+        """Store the current value of a state and return its digest."""
+        previous = self._digests.get(key)
+        if previous is not None and self._payloads[previous][0] == value:
+            return previous
+
+        encoded = _encode(value)
+        digest = hashlib.blake2b(encoded, digest_size=16).hexdigest()
+        self.hashed += 1
+        if digest == previous:
+            return digest
+
+        self.release(key)
+        payload, size, references = self._payloads.get(digest, (value, len(encoded), 0))
+        self._payloads[digest] = (payload, size, references + 1)
+        self._digests[key] = digest
+        return digest
+
+    def release(self, key: Hashable) -> None:
+        """Forget the value of a state, dropping its payload if unreferenced."""
+        digest = self._digests.pop(key, None)
+        if digest is None:
+            return
+        payload, size, references = self._payloads[digest]
+        if references > 1:
+            self._payloads[digest] = (payload, size, references - 1)
+        else:
+            del self._payloads[digest]
+
+    def digest(self, key: Hashable) -> str | None:
+        """Return the digest of the current value of a state."""
+        return self._digests.get(key)
+
+    def get(self, digest: str) -> tuple[Any, int] | None:
+        """Return a payload and its size in bytes."""
+        stored = self._payloads.get(digest)
+        if stored is None:
+            return None
+        return stored[0], stored[1]
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the size of the store."""
+        return {
+            "payloads": len(self._payloads),
+            "states": len(self._digests),
+            "bytes": sum(size for _, size, _ in self._payloads.values()),
+            "hashed": self.hashed,
+        }
@@ -0,0 +1,89 @@
+"""On-demand profiling of the Nymea HEM integration."""
+
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import time
+
+from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import HomeAssistantError
+
+from .const import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+# Restrict the summary to functions defined in this integration
+PROFILE_FILTER = rf"custom_components.{DOMAIN}"
+
+
+class NymeaProfiler:
+    """Profile the event loop thread for a bounded window.
+
+    Nothing is hooked into the integration while no profile is running, so
+    the profiler costs nothing outside of an explicit service call.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize the profiler."""
+        self._hass = hass
+        self._lock = asyncio.Lock()
+
+    @property
+    def active(self) -> bool:
+        """Return True while a profile is being recorded."""
+        return self._lock.locked()
+
+    async def async_profile(
+        self, duration: float, top: int, coordinators: list
+    ) -> tuple[str, str]:
+        """Record a profile and return the paths of the stats and summary files."""
+        if self.active:
+            raise HomeAssistantError("A Nymea HEM profile is already running")
+
+        async with self._lock:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as err:
+                raise HomeAssistantError(f"Cannot start profiler: {err}") from err
+
+            _LOGGER.info("Profiling Nymea HEM for %d seconds", duration)
+            try:
+                # Make sure the window contains at least one full refresh
+                for coordinator in coordinators:
+                    await coordinator.async_refresh()
+                await asyncio.sleep(duration)
+            finally:
+                profile.disable()
+
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        stats_path = self._hass.config.path(f"{DOMAIN}_profile_{stamp}.prof")
+        summary_path = self._hass.config.path(f"{DOMAIN}_profile_{stamp}.txt")
+        await self._hass.async_add_executor_job(
+            _write_profile, profile, stats_path, summary_path, top
+        )
+        _LOGGER.info(
+            "Nymea HEM profile written to %s, summary in %s", stats_path, summary_path
+        )
+        return stats_path, summary_path
+
+
+def _write_profile(
+    profile: cProfile.Profile, stats_path: str, summary_path: str, top: int
+) -> None:
+    """Dump the raw stats and a hot-spot summary to disk."""
+    profile.dump_stats(stats_path)
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stream.write(f"Top {top} Nymea HEM functions by own time\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(PROFILE_FILTER, top)
+    stream.write(f"\nTop {top} Nymea HEM functions by cumulative time\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_FILTER, top)
+
+    with open(summary_path, "w", encoding="utf-8") as summary_file:
+        summary_file.write(stream.getvalue())
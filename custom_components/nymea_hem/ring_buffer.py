@@ -0,0 +1,271 @@
+"""High-resolution in-memory history of selected numeric states."""
+
+from __future__ import annotations
+
+import logging
+import math
+from array import array
+from collections.abc import Iterable, Mapping
+from typing import Any
+
+from .filters import compile_patterns, parse_patterns
+
+_LOGGER = logging.getLogger(__name__)
+
+# Memory of all buffers of one entry, in bytes
+BUFFER_MEMORY_BUDGET = 1024 * 1024
+# A sample is a timestamp and a value, both doubles
+SAMPLE_SIZE = 16
+# Fewest samples per buffer; aggregating needs a window, not a single value
+MIN_CAPACITY = 2
+DEFAULT_BUFFER_RETENTION = 3600
+
+AGGREGATES = ("mean", "min", "max", "percentile")
+NUMERIC_TYPES = {"Double", "Int", "Uint"}
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of (timestamp, value) samples in two arrays.
+
+    Appending is O(1) and overwrites the oldest sample once the buffer is
+    full. Timestamps increase, so windows are found by binary search and
+    aggregated over contiguous array slices.
+    """
+
+    __slots__ = ("_times", "_values", "_start", "count")
+
+    def __init__(self, capacity: int) -> None:
+        """Allocate the buffer."""
+        self._times = array("d", [0.0]) * capacity
+        self._values = array("d", [0.0]) * capacity
+        self._start = 0
+        self.count = 0
+
+    @property
+    def capacity(self) -> int:
+        """Return the maximum number of samples."""
+        return len(self._times)
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Add a sample, replacing the oldest one when full."""
+        capacity = len(self._times)
+        if self.count < capacity:
+            index = (self._start + self.count) % capacity
+            self.count += 1
+        else:
+            index = self._start
+            self._start = (self._start + 1) % capacity
+        self._times[index] = timestamp
+        self._values[index] = value
+
+    def samples(self) -> Iterable[tuple[float, float]]:
+        """Yield the samples from oldest to newest."""
+        capacity = len(self._times)
+        for offset in range(self.count):
+            index = (self._start + offset) % capacity
+            yield self._times[index], self._values[index]
+
+    def _time(self, offset: int) -> float:
+        """Return the timestamp of the sample at a logical offset."""
+        return self._times[(self._start + offset) % len(self._times)]
+
+    def window(self, since: float) -> array:
+        """Return the values of the samples taken at or after since."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._time(middle) < since:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count:
+            return array("d")
+        capacity = len(self._times)
+        first = (self._start + low) % capacity
+        last = (self._start + self.count) % capacity
+        if first < last:
+            return self._values[first:last]
+        return self._values[first:] + self._values[:last]
+
+    @property
+    def first_timestamp(self) -> float | None:
+        """Return the time of the oldest sample."""
+        return self._time(0) if self.count else None
+
+    @property
+    def last_timestamp(self) -> float | None:
+        """Return the time of the newest sample."""
+        return self._time(self.count - 1) if self.count else None
+
+
+def aggregate(values: array, kind: str, percentile: float = 95) -> float | None:
+    """Return the mean, min, max or a percentile of the values."""
+    if not values:
+        return None
+    if kind == "mean":
+        return math.fsum(values) / len(values)
+    if kind == "min":
+        return min(values)
+    if kind == "max":
+        return max(values)
+    ordered = sorted(values)
+    # Linear interpolation between the closest ranks
+    rank = (len(ordered) - 1) * percentile / 100
+    lower = math.floor(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+class StateBuffers:
+    """Ring buffers of the numeric states matching the configured patterns.
+
+    The memory budget is split evenly across the selected states; each
+    buffer holds the retention at the poll interval, or less if the budget
+    does not allow it. When more states match than the budget holds at
+    MIN_CAPACITY samples each, the states buffered already are kept and the
+    rest is skipped. Buffers are re-planned when the selection or the poll
+    interval changes, keeping the newest samples.
+    """
+
+    def __init__(
+        self,
+        patterns: str | Iterable[str] | None,
+        retention: float = DEFAULT_BUFFER_RETENTION,
+        budget: int = BUFFER_MEMORY_BUDGET,
+    ) -> None:
+        """Initialize the buffers for the given state patterns."""
+        self._pattern = compile_patterns(parse_patterns(patterns))
+        self.retention = retention
+        self.budget = budget
+        self.buffers: dict[tuple[str, str], RingBuffer] = {}
+        self._interval: float | None = None
+        # Selected states left out because the budget is exhausted
+        self._skipped: set[tuple[str, str]] = set()
+        # (thing id, state type id) -> selected
+        self._decisions: dict[tuple[str, str], bool] = {}
+
+    def feed(
+        self,
+        timestamp: float,
+        things_by_id: Mapping[str, dict[str, Any]],
+        states: Mapping[tuple[str, str], dict[str, Any]],
+        thing_classes: Mapping[str, dict[str, Any]],
+        interval: float,
+    ) -> None:
+        """Append the current values of the selected states."""
+        if self._pattern is None:
+            return
+        values: dict[tuple[str, str], float] = {}
+        for key, state in states.items():
+            if not self._selected(key, things_by_id, thing_classes):
+                continue
+            try:
+                values[key] = float(state["value"])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+        if values.keys() - self.buffers.keys() - self._skipped or interval != self._interval:
+            self._plan(values.keys() | self.buffers.keys(), interval)
+        for key, value in values.items():
+            if (buffer := self.buffers.get(key)) is not None:
+                buffer.append(timestamp, value)
+
+    def query(
+        self,
+        key: tuple[str, str],
+        since: float,
+        kinds: Iterable[str] = AGGREGATES,
+        percentile: float = 95,
+    ) -> dict[str, Any] | None:
+        """Return the sample count and the requested aggregates since a time."""
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            return None
+        values = buffer.window(since)
+        return {
+            "samples": len(values),
+            **{kind: aggregate(values, kind, percentile) for kind in kinds},
+        }
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the sizing of the buffers."""
+        capacity = sum(buffer.capacity for buffer in self.buffers.values())
+        return {
+            "states": len(self.buffers),
+            "retention": self.retention,
+            "budget_bytes": self.budget,
+            "allocated_bytes": capacity * SAMPLE_SIZE,
+            "samples": sum(buffer.count for buffer in self.buffers.values()),
+            "capacity_per_state": capacity // len(self.buffers) if self.buffers else None,
+            "skipped_states": len(self._skipped),
+        }
+
+    def _plan(self, keys: Iterable[tuple[str, str]], interval: float) -> None:
+        """Size one buffer per key within the budget, keeping recorded samples."""
+        # States buffered already come first, so a new match does not evict them
+        keys = sorted(keys, key=lambda key: (key not in self.buffers, key))
+        limit = self.budget // (MIN_CAPACITY * SAMPLE_SIZE)
+        skipped = set(keys[limit:])
+        if skipped and skipped != self._skipped:
+            _LOGGER.warning(
+                "%d states match the buffered state patterns, but the memory budget "
+                "of %d bytes holds %d; %d states are not buffered",
+                len(keys),
+                self.budget,
+                limit,
+                len(skipped),
+            )
+        self._skipped = skipped
+        keys = keys[:limit]
+        self._interval = interval
+        per_state = self.budget // SAMPLE_SIZE // max(len(keys), 1)
+        wanted = math.ceil(self.retention / max(interval, 1)) + 1
+        capacity = max(min(per_state, wanted), MIN_CAPACITY)
+        buffers = {}
+        for key in keys:
+            buffer = RingBuffer(capacity)
+            if key in self.buffers:
+                for sample in self.buffers[key].samples():
+                    buffer.append(*sample)
+            buffers[key] = buffer
+        self.buffers = buffers
+
+    def _selected(
+        self,
+        key: tuple[str, str],
+        things_by_id: Mapping[str, dict[str, Any]],
+        thing_classes: Mapping[str, dict[str, Any]],
+    ) -> bool:
+        """Return True if a state is numeric and matches the patterns.
+
+        Patterns match the state name, its display name, or the thing name
+        and state name joined by a slash, such as ``Grid meter/currentPower``.
+        """
+        decision = self._decisions.get(key)
+        if decision is not None:
+            return decision
+        thing = things_by_id.get(key[0], {})
+        state_type = next(
+            (
+                state_type
+                for state_type in thing_classes.get(thing.get("thingClassId"), {}).get(
+                    "stateTypes", []
+                )
+                if state_type.get("id") == key[1]
+            ),
+            None,
+        )
+        if state_type is None:
+            # Decide once the thing class is known
+            return False
+        name = str(state_type.get("name", ""))
+        decision = state_type.get("type") in NUMERIC_TYPES and any(
+            self._pattern.match(candidate)
+            for candidate in (
+                name,
+                str(state_type.get("displayName", "")),
+                f"{thing.get('name', '')}/{name}",
+            )
+        )
+        self._decisions[key] = decision
+        return decision
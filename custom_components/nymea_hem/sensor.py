@@ -2,7 +2,11 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
 from typing import Any
 
 from homeassistant.components.sensor import (
@@ -12,28 +16,53 @@ from homeassistant.components.sensor import (
 )
 from homeassistant.const import (
     PERCENTAGE,
+    EntityCategory,
     UnitOfElectricCurrent,
     UnitOfElectricPotential,
     UnitOfEnergy,
     UnitOfFrequency,
+    UnitOfInformation,
     UnitOfPower,
     UnitOfTemperature,
     UnitOfTime,
 )
+from homeassistant.core import callback
 from homeassistant.helpers.device_registry import async_get as async_get_device_registry
+from homeassistant.helpers.entity_registry import (
+    async_entries_for_device,
+    async_get as async_get_entity_registry,
+)
 from homeassistant.helpers.entity import DeviceInfo
+from homeassistant.helpers.entity_platform import async_get_current_platform
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from homeassistant.helpers.typing import StateType
+from homeassistant.util import dt as dt_util
 
 from .const import (
+    ATTR_STALE,
     ATTR_STATE_NAME,
     ATTR_STATE_TYPE_ID,
     ATTR_THING_CLASS_ID,
     ATTR_THING_CLASS_NAME,
+    ATTR_PAYLOAD_HASH,
+    ATTR_PAYLOAD_SIZE,
     ATTR_VALUE_IN_STATE,
-    ATTR_VALUE_PAYLOAD,
     DOMAIN,
 )
+from .coordinator import SHED_ATTRIBUTES, THING_REMOVAL_GRACE
+from .local_statistics import LOCAL_STATISTICS_WRITE_INTERVAL
+from .energy_flow import (
+    AUTARKY,
+    BATTERY_POWER,
+    GRID_POWER,
+    HOUSE_LOAD,
+    PRODUCTION_POWER,
+    SELF_CONSUMPTION,
+)
+from .metrics import NymeaMetrics
+from .payloads import is_large_value
+from .ring_buffer import aggregate
+from .tariffs import PriceSeries
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -100,6 +129,121 @@ DATETIME_KEYWORDS = {
     "when",
 }
 
+# Upper bound of state sensors registered in one batch before yielding to the loop
+ENTITY_CHUNK_SIZE = 100
+# Things with these interfaces are registered first, in this order
+PRIORITY_INTERFACES = ("smartmeter", "energymeter")
+
+# Length of the window searched by the cheapest window sensors, in hours
+TARIFF_WINDOW_HOURS = 3
+
+# key: name suffix of the sensors derived from each price schedule
+TARIFF_SENSORS = {
+    "current_price": "Current Price",
+    "next_price_change": "Next Price Change",
+    "cheapest_window": f"Cheapest {TARIFF_WINDOW_HOURS} h Window",
+}
+
+# key: (name suffix, aggregate, window in seconds) of the sensors of each buffered state
+BUFFER_SENSORS: dict[str, tuple[str, str, int]] = {
+    "mean_5m": ("5 min Mean", "mean", 300),
+    "max_1h": ("1 h Max", "max", 3600),
+}
+
+# key: (name, unit, device class)
+ENERGY_FLOW_SENSORS: dict[str, tuple[str, str, SensorDeviceClass | None]] = {
+    GRID_POWER: ("Net Grid Power", UnitOfPower.WATT, SensorDeviceClass.POWER),
+    PRODUCTION_POWER: ("Production Power", UnitOfPower.WATT, SensorDeviceClass.POWER),
+    BATTERY_POWER: ("Battery Power", UnitOfPower.WATT, SensorDeviceClass.POWER),
+    HOUSE_LOAD: ("House Load", UnitOfPower.WATT, SensorDeviceClass.POWER),
+    SELF_CONSUMPTION: ("Self-Consumption", PERCENTAGE, None),
+    AUTARKY: ("Autarky", PERCENTAGE, None),
+}
+
+# key: (name, unit, device class, state class, value function)
+METRIC_SENSORS: dict[
+    str,
+    tuple[
+        str,
+        str | None,
+        SensorDeviceClass | None,
+        SensorStateClass,
+        Callable[[NymeaMetrics], StateType],
+    ],
+] = {
+    "refresh_duration": (
+        "Refresh Duration",
+        UnitOfTime.MILLISECONDS,
+        SensorDeviceClass.DURATION,
+        SensorStateClass.MEASUREMENT,
+        lambda metrics: metrics.refresh_duration.last,
+    ),
+    "get_things_latency": (
+        "GetThings Latency",
+        UnitOfTime.MILLISECONDS,
+        SensorDeviceClass.DURATION,
+        SensorStateClass.MEASUREMENT,
+        lambda metrics: metrics.rpc_latency["Integrations.GetThings"].last
+        if "Integrations.GetThings" in metrics.rpc_latency
+        else None,
+    ),
+    "bytes_in": (
+        "Bytes Received",
+        UnitOfInformation.BYTES,
+        SensorDeviceClass.DATA_SIZE,
+        SensorStateClass.TOTAL_INCREASING,
+        lambda metrics: metrics.bytes_in,
+    ),
+    "bytes_out": (
+        "Bytes Sent",
+        UnitOfInformation.BYTES,
+        SensorDeviceClass.DATA_SIZE,
+        SensorStateClass.TOTAL_INCREASING,
+        lambda metrics: metrics.bytes_out,
+    ),
+    "reconnects": (
+        "Reconnects",
+        None,
+        None,
+        SensorStateClass.TOTAL_INCREASING,
+        lambda metrics: metrics.reconnects,
+    ),
+    "refresh_overruns": (
+        "Refresh Overruns",
+        None,
+        None,
+        SensorStateClass.TOTAL_INCREASING,
+        lambda metrics: metrics.refresh_overruns,
+    ),
+    "poll_queue_wait": (
+        "Poll Queue Wait",
+        UnitOfTime.MILLISECONDS,
+        SensorDeviceClass.DURATION,
+        SensorStateClass.MEASUREMENT,
+        lambda metrics: metrics.queue_wait["poll"].last
+        if "poll" in metrics.queue_wait
+        else None,
+    ),
+    "suppressed_writes": (
+        "Suppressed State Writes",
+        None,
+        None,
+        SensorStateClass.TOTAL_INCREASING,
+        lambda metrics: metrics.suppressed_writes,
+    ),
+}
+
+
+def server_device_info(server_info: dict[str, Any], server_identifier: str) -> DeviceInfo:
+    """Return the Home Assistant device info of the Nymea server."""
+    return DeviceInfo(
+        identifiers={(DOMAIN, server_identifier)},
+        name=server_info.get("name", "Nymea Server"),
+        manufacturer="Nymea",
+        model=server_info.get("server", "Unknown Model"),
+        sw_version=server_info.get("version", "Unknown"),
+    )
+
 
 def convert_value(value: Any, value_type: str) -> Any:
     """Convert value based on Nymea type."""
@@ -228,14 +372,13 @@ def infer_state_class(
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """Set up sensors for the Nymea integration."""
     entry_data = hass.data[DOMAIN][config_entry.entry_id]
-    client = entry_data["client"]
     coordinator = entry_data["coordinator"]
     server_info = entry_data.get("server_info", {})
 
     device_registry = async_get_device_registry(hass)
 
     server_identifier = server_info.get("uuid", f"unknown_{config_entry.entry_id}")
-    server_device = device_registry.async_get_or_create(
+    device_registry.async_get_or_create(
         config_entry_id=config_entry.entry_id,
         identifiers={(DOMAIN, server_identifier)},
         name=server_info.get("name", "Nymea Server"),
@@ -251,23 +394,261 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
             server_identifier=server_identifier,
         )
     ]
+    sensors.extend(
+        NymeaMetricSensor(
+            coordinator=coordinator,
+            server_info=server_info,
+            server_identifier=server_identifier,
+            key=key,
+        )
+        for key in METRIC_SENSORS
+    )
+
+    # Server and metric sensors do not depend on the things
+    async_add_entities(sensors)
+
+    platform = async_get_current_platform()
+    trace = coordinator.metrics.startup
+    things = list(coordinator.data or [])
 
-    for thing in coordinator.data or []:
-        thing_class_id = thing.get("thingClassId")
-        thing_class_details = None
-
-        try:
-            if thing_class_id:
-                result = await client.get_thing_class_details(thing_class_id)
-                if result:
-                    thing_class_details = result[0]
-        except Exception as err:
-            _LOGGER.error(
-                "Error fetching thing class details for %s: %s",
-                thing.get("name"),
-                err,
+    with trace.span("thing_class_fetch"):
+        await coordinator.async_fetch_thing_classes(
+            {thing.get("thingClassId") for thing in things}
+        )
+
+    # Unique ids of the state sensors created so far
+    known_unique_ids: set[str] = set()
+
+    async def _async_register(things: list[dict[str, Any]]) -> int:
+        """Register the sensors of things in bounded chunks, yielding in between."""
+        registered = 0
+        for chunk in _thing_chunks(things, ENTITY_CHUNK_SIZE):
+            with trace.span("metadata_inference"):
+                chunk_sensors = _build_thing_sensors(
+                    device_registry,
+                    config_entry,
+                    coordinator,
+                    chunk,
+                    server_identifier,
+                    known_unique_ids,
+                )
+            if chunk_sensors:
+                with trace.span("entity_registration"):
+                    await platform.async_add_entities(chunk_sensors)
+                registered += len(chunk_sensors)
+            await asyncio.sleep(0)
+        return registered
+
+    @callback
+    def _async_finish_trace() -> None:
+        """Log the startup timeline once all sensors are registered."""
+        trace.finish()
+        _LOGGER.info("Startup of %s took %s", config_entry.title, trace.summary())
+
+    priority_things: list[tuple[int, dict[str, Any]]] = []
+    other_things: list[dict[str, Any]] = []
+    for thing in things:
+        priority = _registration_priority(thing, coordinator.thing_classes)
+        if priority < len(PRIORITY_INTERFACES):
+            priority_things.append((priority, thing))
+        else:
+            other_things.append(thing)
+    priority_things.sort(key=lambda item: item[0])
+
+    # Meters are registered before setup finishes, everything else in the background
+    registered = await _async_register([thing for _, thing in priority_things])
+    _LOGGER.debug("Registered %d sensors of %d meters", registered, len(priority_things))
+
+    async def _async_register_others() -> None:
+        registered = await _async_register(other_things)
+        _LOGGER.debug(
+            "Registered %d sensors of %d remaining things", registered, len(other_things)
+        )
+        _async_finish_trace()
+
+    if other_things:
+        # Background tasks are cancelled when the entry is unloaded
+        config_entry.async_create_background_task(
+            hass,
+            _async_register_others(),
+            name=f"{DOMAIN}_register_sensors_{config_entry.entry_id}",
+        )
+    else:
+        _async_finish_trace()
+
+    async def _async_add_things(added: list[dict[str, Any]]) -> None:
+        """Create entities for things that appeared on the server."""
+        await coordinator.async_fetch_thing_classes(
+            {thing.get("thingClassId") for thing in added}
+        )
+        new_sensors = _build_thing_sensors(
+            device_registry,
+            config_entry,
+            coordinator,
+            added,
+            server_identifier,
+            known_unique_ids,
+        )
+        if not new_sensors:
+            return
+        _LOGGER.info(
+            "Adding %d sensors for %d new Nymea things", len(new_sensors), len(added)
+        )
+        async_add_entities(new_sensors)
+
+    @callback
+    def _async_topology_changed(
+        added: list[dict[str, Any]],
+        removed: list[str],
+        dropped_states: list[tuple[str, str]],
+    ) -> None:
+        """Add and retire entities incrementally."""
+        entity_registry = async_get_entity_registry(hass)
+        for thing_id, state_type_id in dropped_states:
+            unique_id = f"{thing_id}_{state_type_id}"
+            known_unique_ids.discard(unique_id)
+            if entity_id := entity_registry.async_get_entity_id("sensor", DOMAIN, unique_id):
+                entity_registry.async_remove(entity_id)
+
+        for thing_id in removed:
+            device = device_registry.async_get_device(identifiers={(DOMAIN, thing_id)})
+            if device is None:
+                continue
+            registry_entries = async_entries_for_device(
+                entity_registry, device.id, include_disabled_entities=True
             )
+            for registry_entry in registry_entries:
+                known_unique_ids.discard(registry_entry.unique_id)
+                entity_registry.async_remove(registry_entry.entity_id)
+            device_registry.async_remove_device(device.id)
+            _LOGGER.warning(
+                "Removed Nymea thing %s and its %d entities after it was missing for %d hours",
+                device.name,
+                len(registry_entries),
+                THING_REMOVAL_GRACE // 3600,
+            )
+
+        if added:
+            config_entry.async_create_background_task(
+                hass,
+                _async_add_things(added),
+                name=f"{DOMAIN}_add_things_{config_entry.entry_id}",
+            )
+
+    config_entry.async_on_unload(
+        coordinator.async_add_topology_listener(_async_topology_changed)
+    )
 
+    # Schedules and flows of things whose class was unknown at the first refresh
+    coordinator.tariffs.update(
+        coordinator.things_by_id, coordinator.states, coordinator.thing_classes
+    )
+    coordinator.energy_flow.update(
+        coordinator.things_by_id, coordinator.states, coordinator.thing_classes
+    )
+    known_tariffs: set[tuple[str, str]] = set()
+
+    @callback
+    def _async_add_tariff_sensors() -> None:
+        """Create the sensors of price schedules seen for the first time."""
+        new_keys = coordinator.tariffs.series.keys() - known_tariffs
+        if not new_keys:
+            return
+        known_tariffs.update(new_keys)
+        async_add_entities(
+            NymeaTariffSensor(coordinator, key, server_identifier, tariff_key)
+            for key in sorted(new_keys)
+            for tariff_key in TARIFF_SENSORS
+        )
+
+    _async_add_tariff_sensors()
+    config_entry.async_on_unload(coordinator.async_add_listener(_async_add_tariff_sensors))
+
+    energy_flow_added = False
+
+    @callback
+    def _async_add_energy_flow_sensors() -> None:
+        """Create the energy flow sensors once a grid meter is known."""
+        nonlocal energy_flow_added
+        if energy_flow_added or not coordinator.energy_flow.active:
+            return
+        energy_flow_added = True
+        async_add_entities(
+            NymeaEnergyFlowSensor(coordinator, server_info, server_identifier, key)
+            for key in ENERGY_FLOW_SENSORS
+        )
+
+    _async_add_energy_flow_sensors()
+    config_entry.async_on_unload(
+        coordinator.async_add_listener(_async_add_energy_flow_sensors)
+    )
+
+    if coordinator.buffers is None:
+        return
+    known_buffers: set[tuple[str, str]] = set()
+
+    @callback
+    def _async_add_buffer_sensors() -> None:
+        """Create the windowed sensors of states buffered for the first time."""
+        new_keys = coordinator.buffers.buffers.keys() - known_buffers
+        if not new_keys:
+            return
+        known_buffers.update(new_keys)
+        async_add_entities(
+            NymeaBufferSensor(coordinator, key, server_identifier, buffer_key)
+            for key in sorted(new_keys)
+            for buffer_key in BUFFER_SENSORS
+        )
+
+    _async_add_buffer_sensors()
+    config_entry.async_on_unload(coordinator.async_add_listener(_async_add_buffer_sensors))
+
+
+def _registration_priority(
+    thing: dict[str, Any], thing_classes: dict[str, dict[str, Any]]
+) -> int:
+    """Return the position of the thing's first priority interface, lower goes first."""
+    thing_class = thing_classes.get(thing.get("thingClassId")) or {}
+    interfaces = {
+        str(interface).lower()
+        for interface in thing.get("interfaces") or thing_class.get("interfaces", [])
+    }
+    for index, interface in enumerate(PRIORITY_INTERFACES):
+        if interface in interfaces:
+            return index
+    return len(PRIORITY_INTERFACES)
+
+
+def _thing_chunks(
+    things: list[dict[str, Any]], max_states: int
+) -> Iterator[list[dict[str, Any]]]:
+    """Split things into chunks of about max_states states, keeping things whole."""
+    chunk: list[dict[str, Any]] = []
+    states = 0
+    for thing in things:
+        chunk.append(thing)
+        states += len(thing.get("states", []))
+        if states >= max_states:
+            yield chunk
+            chunk = []
+            states = 0
+    if chunk:
+        yield chunk
+
+
+def _build_thing_sensors(
+    device_registry,
+    config_entry,
+    coordinator,
+    things: list[dict[str, Any]],
+    server_identifier: str,
+    known_unique_ids: set[str],
+) -> list[SensorEntity]:
+    """Create the devices and the not yet known state sensors of the given things."""
+    sensors: list[SensorEntity] = []
+
+    for thing in things:
+        thing_class_details = coordinator.thing_classes.get(thing.get("thingClassId"))
         if thing_class_details:
             thing["thingClassDetails"] = thing_class_details
 
@@ -296,6 +677,11 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
             if not state_type:
                 continue
 
+            unique_id = f"{thing_identifier}_{state_type['id']}"
+            if unique_id in known_unique_ids:
+                continue
+            known_unique_ids.add(unique_id)
+
             sensors.append(
                 NymeaHEMStateSensor(
                     coordinator=coordinator,
@@ -305,7 +691,7 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
                 )
             )
 
-    async_add_entities(sensors)
+    return sensors
 
 
 class NymeaHEMStateSensor(CoordinatorEntity, SensorEntity):
@@ -326,11 +712,11 @@ class NymeaHEMStateSensor(CoordinatorEntity, SensorEntity):
         self._state_type = state_type
         self._server_identifier = server_identifier
         self._value_type = state_type.get("type", "String")
-        self._max_state_len = 255
 
         display_name = state_type.get("displayName") or state_type.get("name") or "Unknown"
         self._attr_name = display_name
         self._attr_unique_id = f"{thing_data['id']}_{state_type['id']}"
+        self._state_key = (thing_data["id"], state_type["id"])
 
         nymea_unit = state_type.get("unit")
         native_unit = UNIT_MAP.get(nymea_unit, nymea_unit)
@@ -353,6 +739,85 @@ class NymeaHEMStateSensor(CoordinatorEntity, SensorEntity):
         if self._value_type == "Double":
             self._attr_suggested_display_precision = 2
 
+        self._last_fingerprint: tuple[Any, ...] | None = None
+        self._last_write = 0.0
+        self._thing_attributes: dict[str, Any] | None = None
+
+        # With local statistics the recorder neither compiles statistics
+        # nor stores every value of this sensor
+        self._statistic_id: str | None = None
+        if coordinator.local_statistics is not None and self._attr_state_class is not None:
+            self._statistic_id = coordinator.local_statistics.async_register(
+                self._state_key,
+                f"{thing_data.get('name', 'Nymea Thing')} {display_name}",
+                native_unit,
+                self._attr_state_class,
+            )
+            self._attr_state_class = None
+
+    async def async_added_to_hass(self) -> None:
+        """Remember the initially published state."""
+        await super().async_added_to_hass()
+        self._last_fingerprint = self._state_fingerprint()
+        self._last_write = time.monotonic()
+
+    async def async_will_remove_from_hass(self) -> None:
+        """Drop the payload of this sensor from the store."""
+        await super().async_will_remove_from_hass()
+        self.coordinator.payloads.release(self._state_key)
+
+    def _state_fingerprint(self) -> tuple[Any, ...]:
+        """Return everything the published state depends on."""
+        thing = self._get_live_thing_data()
+        value, raw_value = self._get_live_value()
+        # Large payloads are compared by their content hash
+        digest = self._payload_digest(value, raw_value)
+        return (
+            thing.get("name"),
+            self._get_live_state() is not None,
+            digest if digest is not None else raw_value,
+            self.coordinator.stale,
+        )
+
+    def _payload_digest(self, value: Any, raw_value: Any) -> str | None:
+        """Store a value too large for the state and return its digest."""
+        if is_large_value(value):
+            return self.coordinator.payloads.put(self._state_key, raw_value)
+        self.coordinator.payloads.release(self._state_key)
+        return None
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Write the state only when the published value changed."""
+        fingerprint = self._state_fingerprint()
+        if fingerprint == self._last_fingerprint:
+            self.coordinator.metrics.suppressed_writes += 1
+            return
+        if not self.coordinator.slow_tier_due and self.coordinator.in_slow_tier(
+            self._thing_data.get("thingClassId"), self._state_type
+        ):
+            self.coordinator.metrics.deferred_writes += 1
+            return
+        if self._throttled(fingerprint):
+            self.coordinator.metrics.deferred_writes += 1
+            return
+
+        self._last_fingerprint = fingerprint
+        self._last_write = time.monotonic()
+        self.coordinator.metrics.state_writes += 1
+        self.async_write_ha_state()
+
+    def _throttled(self, fingerprint: tuple[Any, ...]) -> bool:
+        """Return True if only the value of a sensor with local statistics changed too soon."""
+        if self._statistic_id is None or self._last_fingerprint is None:
+            return False
+        name, present, _, stale = fingerprint
+        last_name, last_present, _, last_stale = self._last_fingerprint
+        return (
+            (name, present, stale) == (last_name, last_present, last_stale)
+            and time.monotonic() - self._last_write < LOCAL_STATISTICS_WRITE_INTERVAL
+        )
+
     @property
     def device_info(self) -> DeviceInfo:
         """Return the Home Assistant device this sensor belongs to."""
@@ -369,19 +834,11 @@ class NymeaHEMStateSensor(CoordinatorEntity, SensorEntity):
 
     def _get_live_thing_data(self) -> dict[str, Any]:
         """Return the latest thing data from coordinator."""
-        current_thing_id = self._thing_data.get("id")
-        for thing in self.coordinator.data or []:
-            if thing.get("id") == current_thing_id:
-                return thing
-        return self._thing_data
+        return self.coordinator.things_by_id.get(self._thing_data.get("id"), self._thing_data)
 
     def _get_live_state(self) -> dict[str, Any] | None:
         """Return the current state object."""
-        thing = self._get_live_thing_data()
-        for state in thing.get("states", []):
-            if state.get("stateTypeId") == self._state_type.get("id"):
-                return state
-        return None
+        return self.coordinator.states.get(self._state_key)
 
     def _get_live_value(self) -> tuple[Any, Any]:
         """Return converted and raw value."""
@@ -398,10 +855,7 @@ class NymeaHEMStateSensor(CoordinatorEntity, SensorEntity):
         """Return the current value in a HA-safe shape."""
         value, _ = self._get_live_value()
 
-        if isinstance(value, (dict, list, tuple, set)):
-            return None
-
-        if isinstance(value, str) and len(value) > self._max_state_len:
+        if is_large_value(value):
             return None
 
         return value
@@ -411,13 +865,10 @@ class NymeaHEMStateSensor(CoordinatorEntity, SensorEntity):
         """Return availability."""
         return self._get_live_state() is not None
 
-    @property
-    def extra_state_attributes(self) -> dict[str, Any]:
-        """Return additional attributes."""
+    def _build_thing_attributes(self) -> dict[str, Any]:
+        """Return the attributes that do not depend on the state value."""
         thing = self._get_live_thing_data()
-        value, raw_value = self._get_live_value()
-
-        attributes: dict[str, Any] = {
+        return {
             ATTR_STATE_TYPE_ID: self._state_type["id"],
             ATTR_STATE_NAME: self._state_type.get("name"),
             "state_value_type": self._value_type,
@@ -432,18 +883,302 @@ class NymeaHEMStateSensor(CoordinatorEntity, SensorEntity):
             "interfaces": thing.get("interfaces", self._thing_data.get("interfaces", [])),
             "nymea_unit": self._state_type.get("unit"),
             "value_type": self._value_type,
+            **({"statistic_id": self._statistic_id} if self._statistic_id else {}),
         }
 
-        if isinstance(value, (dict, list, tuple, set)):
-            attributes[ATTR_VALUE_PAYLOAD] = raw_value
-            attributes[ATTR_VALUE_IN_STATE] = False
-        elif isinstance(value, str) and len(value) > self._max_state_len:
-            attributes[ATTR_VALUE_PAYLOAD] = raw_value
-            attributes["value_length"] = len(value)
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        """Return additional attributes."""
+        value, raw_value = self._get_live_value()
+
+        # Under overload the thing-level attributes of the last write are reused
+        if self._thing_attributes is None or not self.coordinator.shedding(SHED_ATTRIBUTES):
+            self._thing_attributes = self._build_thing_attributes()
+        attributes = dict(self._thing_attributes)
+
+        # Large values are only referenced; nymea_hem.get_payload returns them
+        digest = self._payload_digest(value, raw_value)
+        if digest is not None:
+            _, size = self.coordinator.payloads.get(digest)
+            attributes[ATTR_PAYLOAD_HASH] = digest
+            attributes[ATTR_PAYLOAD_SIZE] = size
+            if isinstance(value, str):
+                attributes["value_length"] = len(value)
             attributes[ATTR_VALUE_IN_STATE] = False
         else:
             attributes[ATTR_VALUE_IN_STATE] = True
 
+        if self.coordinator.stale:
+            attributes[ATTR_STALE] = True
+
+        return attributes
+
+
+class NymeaDerivedSensor(CoordinatorEntity, SensorEntity, ABC):
+    """Sensor computed from the coordinator data, written only when its result changes.
+
+    Subclasses implement _result, returning the state followed by whatever
+    else their attributes depend on, and read the published result from
+    _current.
+    """
+
+    _published: tuple[Any, ...] | None = None
+
+    @abstractmethod
+    def _result(self) -> tuple[Any, ...]:
+        """Return the state and the values its attributes depend on."""
+
+    @property
+    def _current(self) -> tuple[Any, ...]:
+        """Return the published result, computing it on first use."""
+        if self._published is None:
+            self._published = self._result()
+        return self._published
+
+    async def async_added_to_hass(self) -> None:
+        """Remember the initially published result."""
+        await super().async_added_to_hass()
+        self._published = self._result()
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Write the state only when the result changed."""
+        result = self._result()
+        if result == self._published:
+            self.coordinator.metrics.suppressed_writes += 1
+            return
+        self._published = result
+        self.coordinator.metrics.state_writes += 1
+        self.async_write_ha_state()
+
+
+class NymeaTariffSensor(NymeaDerivedSensor):
+    """Current price, next price change or cheapest window of a price schedule."""
+
+    _attr_has_entity_name = True
+
+    def __init__(
+        self,
+        coordinator,
+        state_key: tuple[str, str],
+        server_identifier: str,
+        key: str,
+    ) -> None:
+        """Initialize the tariff sensor."""
+        super().__init__(coordinator)
+        self._state_key = state_key
+        self._server_identifier = server_identifier
+        self._key = key
+
+        thing = coordinator.things_by_id.get(state_key[0], {})
+        state_type = _state_type(coordinator, state_key)
+        state_name = state_type.get("displayName") or state_type.get("name") or "Schedule"
+        self._thing_name = thing.get("name", "Nymea Thing")
+        self._attr_name = f"{state_name} {TARIFF_SENSORS[key]}"
+        self._attr_unique_id = f"{state_key[0]}_{state_key[1]}_{key}"
+        if key == "current_price":
+            nymea_unit = state_type.get("unit")
+            self._attr_native_unit_of_measurement = UNIT_MAP.get(nymea_unit, nymea_unit)
+            self._attr_state_class = SensorStateClass.MEASUREMENT
+            self._attr_suggested_display_precision = 2
+        else:
+            self._attr_device_class = SensorDeviceClass.TIMESTAMP
+            self._attr_icon = "mdi:clock-outline"
+
+    def _result(self) -> tuple[StateType, dict[str, Any]]:
+        """Return the state and attributes answered by the schedule."""
+        series: PriceSeries | None = self.coordinator.tariffs.series.get(self._state_key)
+        if series is None:
+            return None, {}
+        now = time.time()
+
+        if self._key == "current_price":
+            index = series.slot_at(now)
+            if index is None:
+                return None, {}
+            slot = series.slot(index)
+            return slot["price"], {
+                "slot_start": dt_util.utc_from_timestamp(slot["start"]).isoformat(),
+                "slot_end": dt_util.utc_from_timestamp(slot["end"]).isoformat(),
+            }
+
+        if self._key == "next_price_change":
+            index = series.next_change(now)
+            if index is None:
+                return None, {}
+            return dt_util.utc_from_timestamp(series.starts[index]), {
+                "next_price": series.prices[index]
+            }
+
+        window = series.cheapest_window(TARIFF_WINDOW_HOURS * 3600, now)
+        if window is None:
+            return None, {}
+        return dt_util.utc_from_timestamp(window["start"]), {
+            "window_end": dt_util.utc_from_timestamp(window["end"]).isoformat(),
+            "average_price": round(window["average_price"], 4),
+        }
+
+    @property
+    def device_info(self) -> DeviceInfo:
+        """Return the device of the thing publishing the schedule."""
+        return DeviceInfo(
+            identifiers={(DOMAIN, self._state_key[0])},
+            name=self._thing_name,
+            manufacturer="Nymea",
+            via_device=(DOMAIN, self._server_identifier),
+        )
+
+    @property
+    def available(self) -> bool:
+        """Return True while the schedule is published."""
+        return self._state_key in self.coordinator.tariffs.series
+
+    @property
+    def native_value(self) -> StateType:
+        """Return the query result."""
+        return self._current[0]
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        """Return slot details of the query result."""
+        return {
+            "thing_id": self._state_key[0],
+            ATTR_STATE_TYPE_ID: self._state_key[1],
+            "slots": len(self.coordinator.tariffs.series.get(self._state_key) or ()),
+            **self._current[1],
+        }
+
+
+class NymeaBufferSensor(NymeaDerivedSensor):
+    """Windowed aggregate of a state kept in memory at full resolution."""
+
+    _attr_has_entity_name = True
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_suggested_display_precision = 2
+
+    def __init__(
+        self,
+        coordinator,
+        state_key: tuple[str, str],
+        server_identifier: str,
+        key: str,
+    ) -> None:
+        """Initialize the buffer sensor."""
+        super().__init__(coordinator)
+        self._state_key = state_key
+        self._server_identifier = server_identifier
+        suffix, self._aggregate, self._window = BUFFER_SENSORS[key]
+
+        thing = coordinator.things_by_id.get(state_key[0], {})
+        state_type = _state_type(coordinator, state_key)
+        state_name = state_type.get("displayName") or state_type.get("name") or "State"
+        self._thing_name = thing.get("name", "Nymea Thing")
+        self._attr_name = f"{state_name} {suffix}"
+        self._attr_unique_id = f"{state_key[0]}_{state_key[1]}_{key}"
+        nymea_unit = state_type.get("unit")
+        self._attr_native_unit_of_measurement = UNIT_MAP.get(nymea_unit, nymea_unit)
+
+    def _result(self) -> tuple[float | None, int]:
+        """Return the aggregate over the window and the number of samples in it."""
+        buffer = self.coordinator.buffers.buffers.get(self._state_key)
+        if buffer is None or buffer.last_timestamp is None:
+            return None, 0
+        values = buffer.window(buffer.last_timestamp - self._window)
+        value = aggregate(values, self._aggregate)
+        return (round(value, 4) if value is not None else None), len(values)
+
+    @property
+    def device_info(self) -> DeviceInfo:
+        """Return the device of the thing the state belongs to."""
+        return DeviceInfo(
+            identifiers={(DOMAIN, self._state_key[0])},
+            name=self._thing_name,
+            manufacturer="Nymea",
+            via_device=(DOMAIN, self._server_identifier),
+        )
+
+    @property
+    def native_value(self) -> StateType:
+        """Return the aggregate."""
+        return self._current[0]
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        """Return the window and the samples it covers."""
+        return {
+            "thing_id": self._state_key[0],
+            ATTR_STATE_TYPE_ID: self._state_key[1],
+            "window": self._window,
+            "samples": self._current[1],
+        }
+
+
+def _state_type(coordinator, state_key: tuple[str, str]) -> dict[str, Any]:
+    """Return the state type of a (thing id, state type id) key, if known."""
+    thing = coordinator.things_by_id.get(state_key[0], {})
+    thing_class = coordinator.thing_classes.get(thing.get("thingClassId"), {})
+    for state_type in thing_class.get("stateTypes", []):
+        if state_type.get("id") == state_key[1]:
+            return state_type
+    return {}
+
+
+class NymeaEnergyFlowSensor(NymeaDerivedSensor):
+    """Energy flow of the site, computed by the coordinator once per refresh."""
+
+    _attr_has_entity_name = True
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_suggested_display_precision = 0
+
+    def __init__(
+        self,
+        coordinator,
+        server_info: dict[str, Any],
+        server_identifier: str,
+        key: str,
+    ) -> None:
+        """Initialize the energy flow sensor."""
+        super().__init__(coordinator)
+        self._server_info = server_info
+        self._server_identifier = server_identifier
+        self._key = key
+        name, unit, device_class = ENERGY_FLOW_SENSORS[key]
+        self._attr_name = name
+        self._attr_unique_id = f"{server_identifier}_energy_flow_{key}"
+        self._attr_native_unit_of_measurement = unit
+        self._attr_device_class = device_class
+
+    def _result(self) -> tuple[float | None, bool]:
+        """Return the computed flow and whether it is based on stale data."""
+        return self.coordinator.energy_flow.values.get(self._key), self.coordinator.stale
+
+    @property
+    def device_info(self) -> DeviceInfo:
+        """Return server device info."""
+        return server_device_info(self._server_info, self._server_identifier)
+
+    @property
+    def available(self) -> bool:
+        """Return True while a grid meter reports its power."""
+        return self.coordinator.energy_flow.active
+
+    @property
+    def native_value(self) -> StateType:
+        """Return the computed flow."""
+        return self._current[0]
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        """Return the grid meter and the number of things feeding the computation."""
+        energy_flow = self.coordinator.energy_flow
+        attributes: dict[str, Any] = {
+            "inputs": dict(energy_flow.inputs),
+            "grid_meter": self.coordinator.things_by_id.get(
+                energy_flow.grid_meter_id, {}
+            ).get("name"),
+        }
+        if self.coordinator.stale:
+            attributes[ATTR_STALE] = True
         return attributes
 
 
@@ -464,13 +1199,7 @@ class NymeaServerInfoSensor(CoordinatorEntity, SensorEntity):
     @property
     def device_info(self) -> DeviceInfo:
         """Return server device info."""
-        return DeviceInfo(
-            identifiers={(DOMAIN, self._server_identifier)},
-            name=self._server_info.get("name", "Nymea Server"),
-            manufacturer="Nymea",
-            model=self._server_info.get("server", "Unknown Model"),
-            sw_version=self._server_info.get("version", "Unknown"),
-        )
+        return server_device_info(self._server_info, self._server_identifier)
 
     @property
     def native_value(self) -> str | None:
@@ -492,3 +1221,47 @@ class NymeaServerInfoSensor(CoordinatorEntity, SensorEntity):
             "authentication_required": self._server_info.get("authentication_required"),
             "initial_setup_required": self._server_info.get("initial_setup_required"),
         }
+
+
+class NymeaMetricSensor(CoordinatorEntity, SensorEntity):
+    """Diagnostic sensor exposing an integration performance metric."""
+
+    _attr_has_entity_name = True
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+
+    def __init__(
+        self,
+        coordinator,
+        server_info: dict[str, Any],
+        server_identifier: str,
+        key: str,
+    ) -> None:
+        """Initialize the metric sensor."""
+        super().__init__(coordinator)
+        self._server_info = server_info
+        self._server_identifier = server_identifier
+        name, unit, device_class, state_class, value_fn = METRIC_SENSORS[key]
+        self._value_fn = value_fn
+        self._attr_name = name
+        self._attr_unique_id = f"{server_identifier}_metric_{key}"
+        self._attr_native_unit_of_measurement = unit
+        self._attr_device_class = device_class
+        self._attr_state_class = state_class
+        if unit == UnitOfTime.MILLISECONDS:
+            self._attr_suggested_display_precision = 1
+
+    @property
+    def device_info(self) -> DeviceInfo:
+        """Return server device info."""
+        return server_device_info(self._server_info, self._server_identifier)
+
+    @property
+    def available(self) -> bool:
+        """Metrics are collected locally and are always available."""
+        return True
+
+    @property
+    def native_value(self) -> StateType:
+        """Return the current metric value."""
+        return self._value_fn(self.coordinator.metrics)
@@ -0,0 +1,322 @@
+"""Services for the Nymea HEM integration."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any
+
+import voluptuous as vol
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.entity_registry import async_get as async_get_entity_registry
+from homeassistant.util import dt as dt_util
+
+from .capture import TrafficCapture
+from .const import (
+    DATA_FLEET,
+    DATA_PROFILER,
+    DOMAIN,
+    SERVICE_BUFFER_QUERY,
+    SERVICE_CAPTURE,
+    SERVICE_FLEET_STATUS,
+    SERVICE_GET_PAYLOAD,
+    SERVICE_PROFILE,
+    SERVICE_TARIFF_QUERY,
+)
+from .profiler import NymeaProfiler
+from .ring_buffer import AGGREGATES
+from .tariffs import PriceSeries
+
+_LOGGER = logging.getLogger(__name__)
+
+PROFILE_SCHEMA = vol.Schema(
+    {
+        vol.Optional("duration", default=60): vol.All(
+            vol.Coerce(float), vol.Range(min=1, max=600)
+        ),
+        vol.Optional("top", default=30): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=500)
+        ),
+    }
+)
+
+CAPTURE_SCHEMA = vol.Schema(
+    {
+        vol.Optional("duration", default=300): vol.All(
+            vol.Coerce(float), vol.Range(min=1, max=3600)
+        ),
+    }
+)
+
+TARIFF_QUERY_SCHEMA = vol.Schema(
+    {
+        vol.Required("hours"): vol.All(vol.Coerce(float), vol.Range(min=0.25, max=48)),
+        vol.Optional("entity_id"): cv.entity_ids,
+        vol.Optional("after"): cv.datetime,
+        vol.Optional("before"): cv.datetime,
+    }
+)
+
+GET_PAYLOAD_SCHEMA = vol.All(
+    vol.Schema(
+        {
+            vol.Exclusive("entity_id", "payload"): cv.entity_id,
+            vol.Exclusive("hash", "payload"): cv.string,
+        }
+    ),
+    cv.has_at_least_one_key("entity_id", "hash"),
+)
+
+BUFFER_QUERY_SCHEMA = vol.Schema(
+    {
+        vol.Required("entity_id"): cv.entity_ids,
+        vol.Optional("window", default=300): vol.All(
+            vol.Coerce(float), vol.Range(min=1, max=86400)
+        ),
+        vol.Optional("aggregates", default=list(AGGREGATES)): vol.All(
+            cv.ensure_list, [vol.In(AGGREGATES)]
+        ),
+        vol.Optional("percentile", default=95): vol.All(
+            vol.Coerce(float), vol.Range(min=0, max=100)
+        ),
+    }
+)
+
+
+def loaded_entries(hass: HomeAssistant) -> list[dict]:
+    """Return the runtime data of all loaded config entries."""
+    return [
+        data
+        for data in hass.data.get(DOMAIN, {}).values()
+        if isinstance(data, dict) and "coordinator" in data
+    ]
+
+
+async def async_setup_services(hass: HomeAssistant) -> None:
+    """Register the integration services."""
+    profiler = hass.data[DOMAIN][DATA_PROFILER] = NymeaProfiler(hass)
+
+    async def async_handle_profile(call: ServiceCall) -> None:
+        """Profile the integration for the requested window."""
+        coordinators = [data["coordinator"] for data in loaded_entries(hass)]
+        await profiler.async_profile(
+            call.data["duration"], call.data["top"], coordinators
+        )
+
+    async def async_handle_capture(call: ServiceCall) -> None:
+        """Capture the traffic of every loaded entry."""
+        entries = loaded_entries(hass)
+        if any(data["client"].capturing for data in entries):
+            raise HomeAssistantError("A Nymea HEM capture is already running")
+        await asyncio.gather(
+            *(_async_capture_entry(hass, data, call.data["duration"]) for data in entries)
+        )
+
+    async def async_handle_fleet_status(call: ServiceCall) -> ServiceResponse:
+        """Return health and timing of every configured server."""
+        return hass.data[DOMAIN][DATA_FLEET].as_dict()
+
+    async def async_handle_get_payload(call: ServiceCall) -> ServiceResponse:
+        """Return a large state value by its hash or by the sensor showing it."""
+        digest = call.data.get("hash")
+        selected = _selected_unique_ids(hass, [call.data["entity_id"]]) if digest is None else None
+        for data in loaded_entries(hass):
+            payloads = data["coordinator"].payloads
+            if selected is not None:
+                digest = next(
+                    (
+                        payloads.digest((thing_id, state_type_id))
+                        for thing_id, state_type_id in data["coordinator"].states
+                        if f"{thing_id}_{state_type_id}" in selected
+                    ),
+                    None,
+                )
+            stored = payloads.get(digest) if digest is not None else None
+            if stored is not None:
+                return {"hash": digest, "size": stored[1], "payload": stored[0]}
+        raise HomeAssistantError("No Nymea HEM payload found for this hash or entity")
+
+    async def async_handle_buffer_query(call: ServiceCall) -> ServiceResponse:
+        """Return windowed aggregates of the buffered states of the given sensors."""
+        selected = _selected_unique_ids(hass, call.data["entity_id"])
+        since = time.time() - call.data["window"]
+        results = []
+        for data in loaded_entries(hass):
+            coordinator = data["coordinator"]
+            if coordinator.buffers is None:
+                continue
+            for (thing_id, state_type_id), buffer in coordinator.buffers.buffers.items():
+                if not any(
+                    unique_id == f"{thing_id}_{state_type_id}"
+                    or unique_id.startswith(f"{thing_id}_{state_type_id}_")
+                    for unique_id in selected
+                ):
+                    continue
+                result = coordinator.buffers.query(
+                    (thing_id, state_type_id),
+                    since,
+                    call.data["aggregates"],
+                    call.data["percentile"],
+                )
+                results.append(
+                    {
+                        "thing_id": thing_id,
+                        "thing_name": coordinator.things_by_id.get(thing_id, {}).get("name"),
+                        "state_type_id": state_type_id,
+                        "oldest_sample": dt_util.utc_from_timestamp(
+                            buffer.first_timestamp
+                        ).isoformat()
+                        if buffer.first_timestamp is not None
+                        else None,
+                        **result,
+                    }
+                )
+        if not results:
+            raise HomeAssistantError("None of the given sensors has a buffered Nymea state")
+        return {"results": results}
+
+    async def async_handle_tariff_query(call: ServiceCall) -> ServiceResponse:
+        """Return the current slot, next change and cheapest window of each schedule."""
+        now = time.time()
+        after = dt_util.as_utc(call.data["after"]).timestamp() if "after" in call.data else now
+        before = dt_util.as_utc(call.data["before"]).timestamp() if "before" in call.data else None
+        selected = _selected_unique_ids(hass, call.data.get("entity_id"))
+        schedules = []
+        for data in loaded_entries(hass):
+            coordinator = data["coordinator"]
+            for (thing_id, state_type_id), series in coordinator.tariffs.series.items():
+                if selected is not None and not any(
+                    unique_id == f"{thing_id}_{state_type_id}"
+                    or unique_id.startswith(f"{thing_id}_{state_type_id}_")
+                    for unique_id in selected
+                ):
+                    continue
+                schedules.append(
+                    {
+                        "thing_id": thing_id,
+                        "thing_name": coordinator.things_by_id.get(thing_id, {}).get("name"),
+                        "state_type_id": state_type_id,
+                        **_tariff_answer(series, now, call.data["hours"] * 3600, after, before),
+                    }
+                )
+        return {"schedules": schedules}
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_PROFILE, async_handle_profile, schema=PROFILE_SCHEMA
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_CAPTURE, async_handle_capture, schema=CAPTURE_SCHEMA
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_FLEET_STATUS,
+        async_handle_fleet_status,
+        supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_BUFFER_QUERY,
+        async_handle_buffer_query,
+        schema=BUFFER_QUERY_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_GET_PAYLOAD,
+        async_handle_get_payload,
+        schema=GET_PAYLOAD_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_TARIFF_QUERY,
+        async_handle_tariff_query,
+        schema=TARIFF_QUERY_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+
+
+def _selected_unique_ids(hass: HomeAssistant, entity_ids: list[str] | None) -> set[str] | None:
+    """Return the unique ids of the selected Nymea HEM entities, or None for all."""
+    if entity_ids is None:
+        return None
+    entity_registry = async_get_entity_registry(hass)
+    return {
+        registry_entry.unique_id
+        for entity_id in entity_ids
+        if (registry_entry := entity_registry.async_get(entity_id)) is not None
+        and registry_entry.platform == DOMAIN
+    }
+
+
+def _tariff_answer(
+    series: PriceSeries, now: float, duration: float, after: float, before: float | None
+) -> dict[str, Any]:
+    """Return the query results of one schedule with ISO timestamps."""
+
+    def iso(timestamp: float) -> str:
+        return dt_util.utc_from_timestamp(timestamp).isoformat()
+
+    current = series.slot_at(now)
+    next_change = series.next_change(now)
+    window = series.cheapest_window(duration, after, before)
+    return {
+        "slots": len(series),
+        "first_slot": iso(series.starts[0]),
+        "last_slot_end": iso(series.ends[-1]),
+        "current": None
+        if current is None
+        else {
+            "start": iso(series.starts[current]),
+            "end": iso(series.ends[current]),
+            "price": series.prices[current],
+        },
+        "next_change": None
+        if next_change is None
+        else {"at": iso(series.starts[next_change]), "price": series.prices[next_change]},
+        "cheapest_window": None
+        if window is None
+        else {
+            "start": iso(window["start"]),
+            "end": iso(window["end"]),
+            "average_price": window["average_price"],
+        },
+    }
+
+
+async def _async_capture_entry(hass: HomeAssistant, data: dict, duration: float) -> None:
+    """Capture the traffic of one entry including a complete setup sequence."""
+    client = data["client"]
+    coordinator = data["coordinator"]
+    identifier = data.get("server_info", {}).get("uuid") or "unknown"
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    capture = TrafficCapture(
+        hass.config.path(f"{DOMAIN}_capture_{identifier}_{stamp}.jsonl.gz")
+    )
+
+    client.start_capture(capture)
+    try:
+        # Reconnect with a full Hello and Authenticate and fetch the thing
+        # classes, so the capture can be replayed through a complete config
+        # flow and setup, not only through polling. The lock lets a running
+        # poll finish first and holds back the next one during the reconnect.
+        async with coordinator.refresh_lock:
+            await client.close_connection()
+            await client.authenticate()
+        await coordinator.async_refresh()
+        thing_class_ids = {
+            thing.get("thingClassId") for thing in coordinator.data or []
+        } - {None}
+        try:
+            await client.get_thing_classes(thing_class_ids)
+        except Exception as err:  # noqa: BLE001
+            _LOGGER.debug("Capturing thing classes failed: %s", err)
+        await asyncio.sleep(duration)
+    finally:
+        client.stop_capture()
+
+    await hass.async_add_executor_job(capture.write)
+    _LOGGER.info("Captured %d exchanges to %s", len(capture), capture.path)
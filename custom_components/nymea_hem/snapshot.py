@@ -0,0 +1,48 @@
+"""Persisted snapshot of the last known Nymea state."""
+
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+from typing import Any
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from .const import DOMAIN
+
+STORAGE_VERSION = 1
+
+# Write the snapshot at most this often while polling, in seconds
+SNAPSHOT_SAVE_INTERVAL = 900
+# Delay before a scheduled snapshot is written, in seconds
+SNAPSHOT_WRITE_DELAY = 10
+
+
+class NymeaSnapshotStore:
+    """Store the things, thing classes and server info of one entry."""
+
+    def __init__(self, hass: HomeAssistant, entry_id: str) -> None:
+        """Initialize the snapshot store."""
+        self._store: Store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}.snapshot")
+        self._last_save: float | None = None
+
+    async def async_load(self) -> dict[str, Any] | None:
+        """Return the last persisted snapshot, if any."""
+        snapshot = await self._store.async_load()
+        if not snapshot or not snapshot.get("things"):
+            return None
+        return snapshot
+
+    @callback
+    def async_schedule_save(self, data_func: Callable[[], dict[str, Any]]) -> None:
+        """Schedule a write unless one was written recently."""
+        now = time.monotonic()
+        if self._last_save is not None and now - self._last_save < SNAPSHOT_SAVE_INTERVAL:
+            return
+        self._last_save = now
+        self._store.async_delay_save(data_func, SNAPSHOT_WRITE_DELAY)
+
+    async def async_remove(self) -> None:
+        """Delete the persisted snapshot."""
+        await self._store.async_remove()
@@ -0,0 +1,291 @@
+"""Indexed price and time-slot schedules published by Nymea things."""
+
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_right
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from typing import Any
+
+PRICE_UNIT = "UnitEuroCentPerKiloWattHour"
+# State names hinting at a schedule when the unit is not a price
+SCHEDULE_KEYWORDS = ("price", "tariff", "slot", "schedule", "forecast")
+
+# Keys tried in order when reading a slot
+START_KEYS = ("start", "startTime", "startDateTime", "startTimestamp", "begin", "from", "timestamp", "time")
+END_KEYS = ("end", "endTime", "endDateTime", "endTimestamp", "to")
+PRICE_KEYS = ("price", "value", "marketPrice", "total", "cost")
+# Keys of a wrapping object holding the slot list
+LIST_KEYS = ("prices", "data", "slots", "values", "entries", "series", "schedule")
+
+# Slot length assumed for a single slot without an end, in seconds
+DEFAULT_SLOT_LENGTH = 3600
+
+
+def _timestamp(value: Any) -> float | None:
+    """Return unix seconds of a number in seconds or milliseconds, or of an ISO string."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            try:
+                parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            except ValueError:
+                return None
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            return parsed.timestamp()
+    if isinstance(value, (int, float)):
+        # Millisecond timestamps are beyond the year 5000 in seconds
+        return value / 1000 if value > 1e11 else float(value)
+    return None
+
+
+def _first(slot: Mapping[str, Any], keys: tuple[str, ...]) -> Any:
+    """Return the value of the first key present in slot."""
+    for key in keys:
+        if key in slot:
+            return slot[key]
+    return None
+
+
+def parse_slots(payload: Any) -> list[tuple[float, float | None, float]]:
+    """Return (start, end or None, price) of every slot found in a payload."""
+    if isinstance(payload, Mapping):
+        for key in LIST_KEYS:
+            if isinstance(payload.get(key), list):
+                return parse_slots(payload[key])
+        # {timestamp: price}
+        slots = []
+        for start, price in payload.items():
+            start = _timestamp(start)
+            if start is None or not isinstance(price, (int, float)) or isinstance(price, bool):
+                return []
+            slots.append((start, None, float(price)))
+        return slots
+
+    if not isinstance(payload, list):
+        return []
+    slots = []
+    for slot in payload:
+        if not isinstance(slot, Mapping):
+            continue
+        start = _timestamp(_first(slot, START_KEYS))
+        price = _first(slot, PRICE_KEYS)
+        try:
+            price = float(price)
+        except (TypeError, ValueError):
+            continue
+        if start is None:
+            continue
+        slots.append((start, _timestamp(_first(slot, END_KEYS)), price))
+    return slots
+
+
+class PriceSeries:
+    """Time-indexed price slots backed by arrays with prefix sums.
+
+    Slots are sorted and do not overlap; gaps between slots are allowed.
+    Prefix sums of price times duration and of covered time answer
+    average price queries over any window with two binary searches.
+    """
+
+    __slots__ = ("starts", "ends", "prices", "_weighted", "_covered", "_next_change")
+
+    def __init__(self, slots: list[tuple[float, float | None, float]]) -> None:
+        """Index the slots; missing ends are taken from the next start."""
+        slots = sorted(slots)
+        self.starts = array("d")
+        self.ends = array("d")
+        self.prices = array("d")
+        for index, (start, end, price) in enumerate(slots):
+            if end is None:
+                if index + 1 < len(slots):
+                    end = slots[index + 1][0]
+                elif self.ends:
+                    end = start + (self.ends[-1] - self.starts[-1])
+                else:
+                    end = start + DEFAULT_SLOT_LENGTH
+            if self.ends and start < self.ends[-1]:
+                # Overlapping slots: keep the earlier one
+                continue
+            if end <= start:
+                continue
+            self.starts.append(start)
+            self.ends.append(end)
+            self.prices.append(price)
+
+        count = len(self.starts)
+        self._weighted = array("d", [0.0]) * (count + 1)
+        self._covered = array("d", [0.0]) * (count + 1)
+        for index in range(count):
+            duration = self.ends[index] - self.starts[index]
+            self._weighted[index + 1] = self._weighted[index] + self.prices[index] * duration
+            self._covered[index + 1] = self._covered[index] + duration
+        # Index of the next slot with a different price, or count
+        self._next_change = array("l", [count]) * count
+        for index in range(count - 2, -1, -1):
+            if self.prices[index + 1] != self.prices[index]:
+                self._next_change[index] = index + 1
+            else:
+                self._next_change[index] = self._next_change[index + 1]
+
+    def __len__(self) -> int:
+        """Return the number of slots."""
+        return len(self.starts)
+
+    def slot_at(self, timestamp: float) -> int | None:
+        """Return the index of the slot covering timestamp."""
+        index = bisect_right(self.starts, timestamp) - 1
+        if index >= 0 and timestamp < self.ends[index]:
+            return index
+        return None
+
+    def slot(self, index: int) -> dict[str, float]:
+        """Return a slot as start, end and price."""
+        return {
+            "start": self.starts[index],
+            "end": self.ends[index],
+            "price": self.prices[index],
+        }
+
+    def next_change(self, timestamp: float) -> int | None:
+        """Return the index of the next slot whose price differs from the current one."""
+        current = self.slot_at(timestamp)
+        if current is None:
+            # Outside any slot the next slot starts a new price
+            index = bisect_right(self.starts, timestamp)
+            return index if index < len(self) else None
+        index = self._next_change[current]
+        return index if index < len(self) else None
+
+    def _integral(self, timestamp: float, sums: array, values: array | None) -> float:
+        """Return the prefix sum up to timestamp, including a partial slot."""
+        index = bisect_right(self.starts, timestamp) - 1
+        if index < 0:
+            return 0.0
+        partial = min(timestamp, self.ends[index]) - self.starts[index]
+        return sums[index] + (values[index] if values is not None else 1.0) * partial
+
+    def average(self, start: float, end: float) -> tuple[float, float]:
+        """Return the average price and the covered seconds between start and end."""
+        covered = self._integral(end, self._covered, None) - self._integral(
+            start, self._covered, None
+        )
+        if covered <= 0:
+            return 0.0, 0.0
+        weighted = self._integral(end, self._weighted, self.prices) - self._integral(
+            start, self._weighted, self.prices
+        )
+        return weighted / covered, covered
+
+    def cheapest_window(
+        self, duration: float, after: float, before: float | None = None
+    ) -> dict[str, float] | None:
+        """Return the contiguous window of duration seconds with the lowest average price.
+
+        Prices are constant within a slot, so the optimum starts at a slot
+        start or at after, or ends at a slot end or at before; only those
+        windows are evaluated. Windows end by before and must be fully
+        covered by slots.
+        """
+        if not len(self) or duration <= 0:
+            return None
+        limit = self.ends[-1] if before is None else min(before, self.ends[-1])
+        candidates = {after} if self.slot_at(after) is not None else set()
+        candidates.update(self.starts[bisect_right(self.starts, after):])
+        candidates.update(end - duration for end in self.ends if end - duration > after)
+        if limit - duration >= after:
+            candidates.add(limit - duration)
+        candidates = sorted(candidates)
+
+        best: dict[str, float] | None = None
+        for start in candidates:
+            end = start + duration
+            if end > limit:
+                break
+            price, covered = self.average(start, end)
+            # A window across a gap in the schedule is not contiguous
+            if covered < duration - 1e-6:
+                continue
+            if best is None or price < best["average_price"]:
+                best = {"start": start, "end": end, "average_price": price}
+        return best
+
+
+def is_schedule_state(state_type: Mapping[str, Any]) -> bool:
+    """Return True if a state type may carry a price or time-slot schedule."""
+    if state_type.get("unit") == PRICE_UNIT:
+        return True
+    if state_type.get("type") not in (None, "Object", "QVariantList", "QVariantMap", "String"):
+        return False
+    text = f"{state_type.get('name', '')} {state_type.get('displayName', '')}".lower()
+    return any(keyword in text for keyword in SCHEDULE_KEYWORDS)
+
+
+class TariffStore:
+    """Parse schedule states once per change and keep them as price series."""
+
+    def __init__(self) -> None:
+        """Initialize an empty store."""
+        # (thing id, state type id) -> series
+        self.series: dict[tuple[str, str], PriceSeries] = {}
+        # Last raw value per state, parsed or not, so unchanged values are skipped
+        self._raw: dict[tuple[str, str], Any] = {}
+        # (thing class id, state type id) -> is a schedule state
+        self._candidates: dict[tuple[str, str], bool] = {}
+
+    def update(
+        self,
+        things_by_id: Mapping[str, dict[str, Any]],
+        states: Mapping[tuple[str, str], dict[str, Any]],
+        thing_classes: Mapping[str, dict[str, Any]],
+    ) -> bool:
+        """Re-parse the schedule states whose value changed; return True if any did."""
+        changed = False
+        for key, state in states.items():
+            value = state.get("value")
+            if not isinstance(value, (list, dict)):
+                continue
+            if not self._is_candidate(key, things_by_id, thing_classes):
+                continue
+            if key in self._raw and self._raw[key] == value:
+                continue
+            self._raw[key] = value
+            slots = parse_slots(value)
+            series = PriceSeries(slots) if slots else None
+            if series:
+                self.series[key] = series
+            else:
+                self.series.pop(key, None)
+            changed = True
+
+        for key in [key for key in self._raw if key not in states]:
+            self._raw.pop(key)
+            changed |= self.series.pop(key, None) is not None
+        return changed
+
+    def _is_candidate(
+        self,
+        key: tuple[str, str],
+        things_by_id: Mapping[str, dict[str, Any]],
+        thing_classes: Mapping[str, dict[str, Any]],
+    ) -> bool:
+        """Return True if the state type of key may carry a schedule."""
+        thing_class_id = things_by_id.get(key[0], {}).get("thingClassId")
+        decision = self._candidates.get((thing_class_id, key[1]))
+        if decision is not None:
+            return decision
+        thing_class = thing_classes.get(thing_class_id)
+        if thing_class is None:
+            # Decide once the thing class is known
+            return False
+        decision = any(
+            state_type.get("id") == key[1] and is_schedule_state(state_type)
+            for state_type in thing_class.get("stateTypes", [])
+        )
+        self._candidates[(thing_class_id, key[1])] = decision
+        return decision
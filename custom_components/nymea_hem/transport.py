@@ -0,0 +1,297 @@
+"""Transports carrying the Nymea JSON-RPC messages."""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import json
+import logging
+import ssl
+from abc import ABC, abstractmethod
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import aiohttp
+
+from .metrics import NymeaMetrics
+
+_LOGGER = logging.getLogger(__name__)
+
+TRANSPORT_TCP = "tcp"
+TRANSPORT_WEBSOCKET = "websocket"
+TRANSPORTS = (TRANSPORT_TCP, TRANSPORT_WEBSOCKET)
+DEFAULT_TRANSPORT = TRANSPORT_TCP
+
+TCP_READ_SIZE = 4096
+
+# Window bits offered for permessage-deflate, the largest window zlib supports
+WS_COMPRESS_WBITS = 15
+
+
+class NymeaTransport(ABC):
+    """Send and receive whole JSON-RPC messages.
+
+    Transports count the bytes on the wire and the bytes of the JSON
+    payloads; the two differ when the transport compresses.
+    """
+
+    # False if the transport cannot see its frames and counts payload bytes only
+    measures_wire_bytes = True
+
+    def __init__(self, metrics: NymeaMetrics) -> None:
+        """Initialize the transport."""
+        self.metrics = metrics
+        # Name of the negotiated compression, None when messages are sent as is
+        self.compression: str | None = None
+
+    @abstractmethod
+    async def open(self) -> None:
+        """Open the connection."""
+
+    @abstractmethod
+    async def send(self, message: bytes) -> None:
+        """Send one JSON message."""
+
+    @abstractmethod
+    async def receive(self, read_timeout: float) -> bytes:
+        """Return the next JSON message; each read waits at most read_timeout."""
+
+    @abstractmethod
+    def is_closing(self) -> bool:
+        """Return True once the connection is closed or closing."""
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Close the connection."""
+
+    def _record_out(self, wire_bytes: int, payload_bytes: int) -> None:
+        """Count a sent message."""
+        self.metrics.bytes_out += wire_bytes
+        self.metrics.payload_bytes_out += payload_bytes
+
+    def _record_in(self, wire_bytes: int, payload_bytes: int) -> None:
+        """Count a received message."""
+        self.metrics.bytes_in += wire_bytes
+        self.metrics.payload_bytes_in += payload_bytes
+
+
+class _StreamTransport(NymeaTransport):
+    """Transport on top of an asyncio stream pair, with optional TLS."""
+
+    def __init__(
+        self,
+        metrics: NymeaMetrics,
+        host: str,
+        port: int,
+        ssl_context: ssl.SSLContext | None,
+    ) -> None:
+        """Initialize the transport."""
+        super().__init__(metrics)
+        self._host = host
+        self._port = port
+        self._ssl_context = ssl_context
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def _open_streams(self) -> None:
+        """Open the TCP or TLS connection."""
+        self._reader, self._writer = await asyncio.open_connection(
+            self._host, self._port, ssl=self._ssl_context
+        )
+
+    def is_closing(self) -> bool:
+        """Return True once the writer is closed or closing."""
+        return self._writer is None or self._writer.is_closing()
+
+    async def close(self) -> None:
+        """Close the writer gracefully, aborting it if that fails."""
+        if self._writer is None:
+            return
+        try:
+            self._writer.close()
+            await self._writer.wait_closed()
+            _LOGGER.debug("Connection closed cleanly.")
+        except Exception as e:
+            _LOGGER.debug("Error during clean close: %s", e)
+            try:
+                self._writer.transport.abort()
+                _LOGGER.debug("Connection forcefully closed.")
+            except Exception as inner_e:
+                _LOGGER.debug("Error during force close: %s", inner_e)
+        finally:
+            self._reader = None
+            self._writer = None
+
+
+class TcpTransport(_StreamTransport):
+    """Newline-framed JSON-RPC over TCP or TLS, nymea's native interface."""
+
+    async def open(self) -> None:
+        """Open the connection."""
+        await self._open_streams()
+
+    async def send(self, message: bytes) -> None:
+        """Send one message followed by the newline delimiter."""
+        frame = message + b"\n"
+        self._writer.write(frame)
+        await self._writer.drain()
+        self._record_out(len(frame), len(message))
+
+    async def receive(self, read_timeout: float) -> bytes:
+        """Read until the buffer holds a complete JSON document."""
+        buffer = b""
+        while True:
+            chunk = await asyncio.wait_for(
+                self._reader.read(TCP_READ_SIZE), timeout=read_timeout
+            )
+            if not chunk:
+                _LOGGER.warning("Connection closed by server")
+                raise ConnectionError("Connection closed by remote host")
+
+            buffer += chunk
+            # A complete object ends with its closing brace; skip parsing before
+            if not buffer.rstrip().endswith(b"}"):
+                continue
+            try:
+                json.loads(buffer)
+            except json.JSONDecodeError:
+                continue
+            self._record_in(len(buffer), len(buffer.rstrip()))
+            return buffer
+
+
+class WebSocketTransport(NymeaTransport):
+    """JSON-RPC over nymea's WebSocket interface.
+
+    Uses the aiohttp client session of Home Assistant, which offers
+    permessage-deflate (RFC 7692) and falls back to uncompressed frames if
+    the server does not accept it. Frames are not visible through aiohttp,
+    so only the payload bytes are counted.
+    """
+
+    measures_wire_bytes = False
+
+    def __init__(
+        self,
+        metrics: NymeaMetrics,
+        session: aiohttp.ClientSession,
+        host: str,
+        port: int,
+        ssl_context: ssl.SSLContext | None,
+        compress: bool = True,
+    ) -> None:
+        """Initialize the transport."""
+        super().__init__(metrics)
+        self._session = session
+        self._host = host
+        self._port = port
+        self._ssl_context = ssl_context
+        self._compress = compress
+        self._ws: aiohttp.ClientWebSocketResponse | None = None
+
+    async def open(self) -> None:
+        """Open the WebSocket connection."""
+        scheme = "wss" if self._ssl_context is not None else "ws"
+        try:
+            self._ws = await self._session.ws_connect(
+                f"{scheme}://{self._host}:{self._port}/",
+                compress=WS_COMPRESS_WBITS if self._compress else 0,
+                ssl=self._ssl_context if self._ssl_context is not None else False,
+            )
+        except aiohttp.ClientError as err:
+            raise ConnectionError(f"WebSocket connection failed: {err}") from err
+        if self._ws.compress:
+            self.compression = "permessage-deflate"
+        _LOGGER.debug(
+            "WebSocket connected to %s:%d, compression: %s",
+            self._host,
+            self._port,
+            self.compression or "none",
+        )
+
+    async def send(self, message: bytes) -> None:
+        """Send one message as a text frame, compressed if negotiated."""
+        await self._ws.send_str(message.decode())
+        self._record_out(len(message), len(message))
+
+    async def receive(self, read_timeout: float) -> bytes:
+        """Return the next data message; pings are answered by aiohttp."""
+        msg = await self._ws.receive(timeout=read_timeout)
+        if msg.type == aiohttp.WSMsgType.TEXT:
+            message = msg.data.encode()
+        elif msg.type == aiohttp.WSMsgType.BINARY:
+            message = msg.data
+        else:
+            _LOGGER.warning("Connection closed by server")
+            raise ConnectionError("WebSocket closed by remote host")
+        self._record_in(len(message), len(message))
+        return message
+
+    def is_closing(self) -> bool:
+        """Return True once the WebSocket is closed."""
+        return self._ws is None or self._ws.closed
+
+    async def close(self) -> None:
+        """Close the WebSocket with a close frame."""
+        if self._ws is None:
+            return
+        try:
+            await self._ws.close()
+        except Exception as e:  # noqa: BLE001
+            _LOGGER.debug("Error closing WebSocket: %s", e)
+        finally:
+            self._ws = None
+
+
+class MemoryTransport(NymeaTransport):
+    """Answer requests in process, for tests, benchmarks and capture replays.
+
+    The handler receives each decoded request and returns the response, or
+    an awaitable of it to simulate latency.
+    """
+
+    def __init__(
+        self,
+        metrics: NymeaMetrics,
+        handler: Callable[[dict[str, Any]], dict[str, Any] | Awaitable[dict[str, Any]]],
+    ) -> None:
+        """Initialize the transport."""
+        super().__init__(metrics)
+        self._handler = handler
+        self._responses: asyncio.Queue = asyncio.Queue()
+        self._closed = True
+
+    async def open(self) -> None:
+        """Open the transport."""
+        self._closed = False
+
+    async def send(self, message: bytes) -> None:
+        """Hand the request to the handler."""
+        if self._closed:
+            raise ConnectionError("Memory transport is closed")
+        self._record_out(len(message), len(message))
+        response = self._handler(json.loads(message))
+        if inspect.isawaitable(response):
+            response = asyncio.ensure_future(response)
+        self._responses.put_nowait(response)
+
+    async def receive(self, read_timeout: float) -> bytes:
+        """Return the encoded response to the oldest pending request."""
+        response = await asyncio.wait_for(self._responses.get(), timeout=read_timeout)
+        if isinstance(response, asyncio.Future):
+            response = await asyncio.wait_for(response, timeout=read_timeout)
+        message = json.dumps(response).encode()
+        self._record_in(len(message), len(message))
+        return message
+
+    def is_closing(self) -> bool:
+        """Return True once the transport is closed."""
+        return self._closed
+
+    async def close(self) -> None:
+        """Close the transport, dropping pending responses."""
+        self._closed = True
+        while not self._responses.empty():
+            response = self._responses.get_nowait()
+            if isinstance(response, asyncio.Future):
+                response.cancel()
@@ -0,0 +1,140 @@
+"""Tests of the price schedule parsing and queries."""
+
+from __future__ import annotations
+
+import importlib.util
+import random
+from pathlib import Path
+
+import pytest
+
+# tariffs.py has no Home Assistant imports; load it without the package __init__
+_SPEC = importlib.util.spec_from_file_location(
+    "nymea_hem_tariffs",
+    Path(__file__).parents[1] / "custom_components" / "nymea_hem" / "tariffs.py",
+)
+tariffs = importlib.util.module_from_spec(_SPEC)
+_SPEC.loader.exec_module(tariffs)
+
+HOUR = 3600
+
+
+def _series(*prices: float, start: float = 0) -> tariffs.PriceSeries:
+    """Return consecutive one hour slots with the given prices."""
+    return tariffs.PriceSeries(
+        [
+            (start + index * HOUR, start + (index + 1) * HOUR, price)
+            for index, price in enumerate(prices)
+        ]
+    )
+
+
+def test_parse_slots_list_of_objects() -> None:
+    """Slots are read from the first known start, end and price keys."""
+    payload = [
+        {"startTime": "2024-01-01T00:00:00Z", "endTime": "2024-01-01T01:00:00Z", "price": 12.5},
+        {"start": 1704070800000, "marketPrice": "9"},
+        {"start": "not a time", "price": 1},
+        {"start": 1704074400, "price": None},
+        "not a slot",
+    ]
+    assert tariffs.parse_slots(payload) == [
+        (1704067200.0, 1704070800.0, 12.5),
+        (1704070800.0, None, 9.0),
+    ]
+
+
+def test_parse_slots_wrapped_and_mapping() -> None:
+    """Slot lists may be wrapped in an object or given as timestamp to price."""
+    assert tariffs.parse_slots({"data": [{"from": 0, "to": HOUR, "value": 3}]}) == [
+        (0.0, float(HOUR), 3.0)
+    ]
+    assert tariffs.parse_slots({"0": 1, "3600": 2}) == [(0.0, None, 1.0), (3600.0, None, 2.0)]
+    assert tariffs.parse_slots({"0": 1, "3600": "two"}) == []
+    assert tariffs.parse_slots("10 ct") == []
+
+
+def test_series_fills_missing_ends_and_drops_overlaps() -> None:
+    """Missing ends come from the next start; overlapping slots keep the earlier one."""
+    series = tariffs.PriceSeries(
+        [(0, None, 1), (HOUR, 3 * HOUR, 2), (2 * HOUR, 3 * HOUR, 5), (4 * HOUR, None, 3)]
+    )
+    assert list(series.starts) == [0, HOUR, 4 * HOUR]
+    # The last slot without an end is as long as the one before it
+    assert list(series.ends) == [HOUR, 3 * HOUR, 6 * HOUR]
+    assert list(series.prices) == [1, 2, 3]
+    assert series.slot_at(3 * HOUR + 60) is None
+    assert series.slot_at(4 * HOUR) == 2
+
+
+def test_cheapest_window_on_slot_boundaries() -> None:
+    """The cheapest window aligned to slot starts is found."""
+    series = _series(5, 4, 1, 2, 8)
+    assert series.cheapest_window(2 * HOUR, 0) == {
+        "start": 2 * HOUR,
+        "end": 4 * HOUR,
+        "average_price": 1.5,
+    }
+
+
+def test_cheapest_window_ending_at_slot_end() -> None:
+    """A window may end at a slot end instead of starting at a slot start."""
+    series = _series(1, 9, 9)
+    window = series.cheapest_window(HOUR, HOUR / 2)
+    assert window == {"start": HOUR / 2, "end": 3 * HOUR / 2, "average_price": 5.0}
+
+
+def test_cheapest_window_clipped_by_after() -> None:
+    """Windows never start before after."""
+    series = _series(1, 6, 4, 7)
+    window = series.cheapest_window(HOUR, HOUR + HOUR / 2)
+    assert window["start"] == 2 * HOUR
+    assert window["average_price"] == 4
+
+
+def test_cheapest_window_clipped_by_before() -> None:
+    """A window ending exactly at before is considered when before is inside a slot."""
+    series = _series(10, 1)
+    window = series.cheapest_window(HOUR, 0, before=3 * HOUR / 2)
+    assert window == {"start": HOUR / 2, "end": 3 * HOUR / 2, "average_price": 5.5}
+    assert series.cheapest_window(HOUR, HOUR, before=3 * HOUR / 2) is None
+
+
+def test_cheapest_window_skips_gaps() -> None:
+    """Windows must be fully covered by slots."""
+    series = tariffs.PriceSeries([(0, HOUR, 1), (2 * HOUR, 3 * HOUR, 9), (3 * HOUR, 4 * HOUR, 8)])
+    window = series.cheapest_window(2 * HOUR, 0)
+    assert window == {"start": 2 * HOUR, "end": 4 * HOUR, "average_price": 8.5}
+    assert series.cheapest_window(3 * HOUR, 0) is None
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_cheapest_window_matches_brute_force(seed: int) -> None:
+    """The candidate search finds the same optimum as a minute-by-minute scan."""
+    rng = random.Random(seed)
+    slots, time = [], 0
+    for _ in range(rng.randint(1, 8)):
+        if rng.random() < 0.2:
+            time += 1800
+        length = 1800 * rng.randint(1, 4)
+        slots.append((time, time + length, rng.randint(1, 30)))
+        time += length
+    series = tariffs.PriceSeries(slots)
+    duration = 1800 * rng.randint(1, 3)
+    after = rng.randrange(0, time, 60)
+    before = rng.choice([None, rng.randrange(0, time + 60, 60)])
+
+    limit = time if before is None else min(before, time)
+    expected = None
+    start = after
+    while start + duration <= limit:
+        price, covered = series.average(start, start + duration)
+        if covered >= duration - 1e-6 and (expected is None or price < expected):
+            expected = price
+        start += 60
+
+    window = series.cheapest_window(duration, after, before)
+    if expected is None:
+        assert window is None
+    else:
+        assert window["average_price"] == pytest.approx(expected)